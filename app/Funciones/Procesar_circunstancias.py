@@ -1,97 +1,214 @@
-import json
+import asyncio
 import logging
-from typing import Optional, Any, Tuple
-from vertexai.generative_models import GenerativeModel
+from typing import Any, Tuple
 from app.commons.services.miscelaneous import load_prompts_generales
+from app.commons.services import marcus_cascada, metricas
+from app.commons.services.context_cache import marcus_context_cache, marcus_context_cache_flash
+from app.commons.services.llm_invoker import invocar_modelo, invocar_modelo_async, nombre_modelo
+from app.commons.services.salida_estructurada import con_esquema, parsear_json, generar_validado, generar_validado_async, RespuestaFueraDeEsquema
 
-def _strip_code_fences(text: str) -> str:
-    """Elimina bloques de código Markdown de la respuesta."""
-    if not isinstance(text, str):
-        return text
-    text = text.strip()
-    if text.startswith("```"):
-        first_newline = text.find("\n")
-        if first_newline != -1:
-            text = text[first_newline + 1:].strip()
-    if text.endswith("```"):
-        text = text[:-3].strip()
-    return text
-
-def _extract_json(text: str) -> Tuple[Optional[Any], Optional[Exception]]:
-    """Intenta extraer y parsear JSON de la respuesta del modelo."""
-    if text is None:
-        return None, ValueError("Respuesta vacía")
-    try:
-        return json.loads(text), None
-    except Exception:
-        pass
-    stripped = _strip_code_fences(text)
-    try:
-        return json.loads(stripped), None
-    except Exception:
-        pass
-    try:
-        start = stripped.find("{")
-        end = stripped.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            return json.loads(stripped[start:end + 1]), None
-    except Exception as e:
-        return None, e
-    return None, ValueError("No se pudo parsear el JSON")
 
-def evaluar_circunstancias_marcus(
-        llms_resource: dict,
-        contexto_marcus: str,
-        json_visual: str,
-        json_transcripcion: str
-) -> Any:
+def construir_prefijo_marcus(contexto_marcus: str) -> str:
     """
-    Aplica la matriz Marcus usando Gemini 1.5 Pro nativo y el prompt del YAML.
+    Parte estática del prompt de Marcus: instrucciones del YAML + matriz.
+    Es idéntica para todos los casos, por eso se registra como contenido cacheado en Vertex.
     """
-    try:
-        # 1. Recuperar recursos del cliente nativo
-        model = llms_resource["gemini_pro"]
-        labels = llms_resource["config"]["labels"]
-        params = llms_resource["config"]["params_pro"]
-
-        # 2. Cargar el prompt experto desde el YAML
-        prompt_base = load_prompts_generales("evaluar_circunstancias_marcus")
-        if not prompt_base:
-            return {"error": "❌ Prompt 'evaluar_circunstancias_marcus' no encontrado en el YAML."}
-
-        # 3. Construir el prompt final inyectando los datos del caso
-        # El prompt_base del YAML ya contiene la estructura JSON de salida
-        user_prompt = f"""
+    prompt_base = load_prompts_generales("evaluar_circunstancias_marcus")
+    if not prompt_base:
+        return ""
+    return f"""
         {prompt_base}
 
         ### DATOS PARA EL ANÁLISIS ###
-        - CONTEXTO MARCUS: {contexto_marcus}
+        - CONTEXTO MARCUS: {contexto_marcus}"""
+
+
+def construir_datos_caso(json_visual: str, json_transcripcion: str) -> str:
+    """Parte variable del prompt de Marcus: la evidencia del caso."""
+    return f"""
         - JSON ANÁLISIS VISUAL: {json_visual}
         - JSON TRANSCRIPCIONES: {json_transcripcion}
         """
 
-        # 4. Invocación al modelo Gemini Pro
-        logging.info("📨 Enviando análisis lógico Marcus a Gemini Pro (Nativo)...")
-        respuesta = model.generate_content(
-            user_prompt,
-            generation_config={
-                "temperature": 0.0,  # Precisión máxima para adjudicación
-                "max_output_tokens": params.get("max_tokens", 8192),
-                "response_mime_type": "application/json" # Obliga al modelo a responder en JSON
-            },
-            labels=labels # Trazabilidad de costos para Movilidad
-        )
+
+# Nivel de la cascada -> (modelo en llms_resource, parámetros, caché de contexto del prefijo)
+_NIVELES_MARCUS = {
+    "pro": ("gemini_pro", "params_pro", marcus_context_cache),
+    "flash": ("gemini_flash", "params_flash", marcus_context_cache_flash),
+}
+
+
+def preparar_cache_marcus(llms_resource: dict, contexto_marcus: str) -> bool:
+    """Registra el prefijo de Marcus en el caché de contexto (se usa en el arranque)."""
+    prefijo = construir_prefijo_marcus(contexto_marcus)
+    if not prefijo:
+        return False
+    niveles = ["flash", "pro"] if marcus_cascada.MARCUS_CASCADA else ["pro"]
+    preparados = [
+        _NIVELES_MARCUS[nivel][2].preparar(nombre_modelo(llms_resource[_NIVELES_MARCUS[nivel][0]]), prefijo)
+        for nivel in niveles
+    ]
+    return preparados[-1]
+
+
+def _preparar_marcus(llms_resource: dict, contexto_marcus: str, json_visual: str, json_transcripcion: str, nivel: str = "pro"):
+    """
+    Arma la solicitud al modelo del nivel (Pro por defecto). Devuelve None si el prompt no está en el YAML.
+    Puede crear o renovar el caché de contexto, por eso es bloqueante.
+    """
+    # 1. Recuperar recursos del cliente nativo
+    llave_modelo, llave_params, cache_contexto = _NIVELES_MARCUS[nivel]
+    model = llms_resource[llave_modelo]
+    labels = llms_resource["config"]["labels"]
+    params = llms_resource["config"][llave_params]
+
+    # 2. Prefijo estático (prompt experto del YAML + matriz Marcus)
+    # El prompt_base del YAML ya contiene la estructura JSON de salida
+    prefijo = construir_prefijo_marcus(contexto_marcus)
+    if not prefijo:
+        return None
+
+    # 3. Si el prefijo está cacheado en Vertex solo se envían los datos del caso
+    datos_caso = construir_datos_caso(json_visual, json_transcripcion)
+    modelo_cacheado = cache_contexto.modelo_para(nombre_modelo(model), prefijo)
+    if modelo_cacheado is not None:
+        model = modelo_cacheado
+        user_prompt = datos_caso
+    else:
+        user_prompt = prefijo + datos_caso
+
+    # Obliga al modelo a responder con el JSON del esquema de evaluar_circunstancias_marcus
+    generation_config = con_esquema({
+        "temperature": 0.0,  # Precisión máxima para adjudicación
+        "max_output_tokens": params.get("max_tokens", 8192),
+        "response_mime_type": "application/json",
+    }, "evaluar_circunstancias_marcus")
+    return model, user_prompt, generation_config, labels
+
+
+def _procesar_respuesta_marcus(respuesta) -> Any:
+    raw_text = respuesta.text
+    parsed, err = parsear_json(raw_text)
+
+    if parsed is None:
+        logging.error(f"❌ Falló la generación de JSON en Marcus: {err}")
+        return {"error": f"JSON inválido: {str(err)}", "raw": raw_text}
+
+    return parsed
+
+
+def _evaluar_nivel(nivel: str, llms_resource: dict, contexto_marcus: str, json_visual: str, json_transcripcion: str) -> Any:
+    try:
+        solicitud = _preparar_marcus(llms_resource, contexto_marcus, json_visual, json_transcripcion, nivel)
+        if solicitud is None:
+            return {"error": "❌ Prompt 'evaluar_circunstancias_marcus' no encontrado en el YAML."}
+        model, user_prompt, generation_config, labels = solicitud
+
+        # 4. Invocación al modelo (labels: trazabilidad de costos para Movilidad)
+        logging.info(f"📨 Enviando análisis lógico Marcus a Gemini {nivel.capitalize()} (Nativo)...")
+        try:
+            respuesta = generar_validado("evaluar_circunstancias_marcus", lambda nota: invocar_modelo(
+                model, user_prompt + nota, generation_config, labels
+            ))
+        except RespuestaFueraDeEsquema as e:
+            # La adjudicación no se cachea: se evalúa la última respuesta (la cascada la escala si no sirve)
+            respuesta = e.respuesta
 
         # 5. Procesamiento de salida
-        raw_text = respuesta.text
-        parsed, err = _extract_json(raw_text)
+        return _procesar_respuesta_marcus(respuesta)
+
+    except Exception as e:
+        logging.error(f"❌ Error crítico en evaluar_circunstancias_marcus ({nivel}): {e}")
+        return {"error": str(e)}
 
-        if parsed is None:
-            logging.error(f"❌ Falló la generación de JSON en Marcus: {err}")
-            return {"error": f"JSON inválido: {str(err)}", "raw": raw_text}
 
-        return parsed
+async def _evaluar_nivel_async(nivel: str, llms_resource: dict, contexto_marcus: str, json_visual: str, json_transcripcion: str) -> Any:
+    try:
+        solicitud = await asyncio.to_thread(_preparar_marcus, llms_resource, contexto_marcus, json_visual, json_transcripcion, nivel)
+        if solicitud is None:
+            return {"error": "❌ Prompt 'evaluar_circunstancias_marcus' no encontrado en el YAML."}
+        model, user_prompt, generation_config, labels = solicitud
+
+        logging.info(f"📨 Enviando análisis lógico Marcus a Gemini {nivel.capitalize()} (Nativo, async)...")
+        try:
+            respuesta = await generar_validado_async("evaluar_circunstancias_marcus", lambda nota: invocar_modelo_async(
+                model, user_prompt + nota, generation_config, labels
+            ))
+        except RespuestaFueraDeEsquema as e:
+            respuesta = e.respuesta
+        return _procesar_respuesta_marcus(respuesta)
 
     except Exception as e:
-        logging.error(f"❌ Error crítico en evaluar_circunstancias_marcus: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+        logging.error(f"❌ Error crítico en evaluar_circunstancias_marcus_async ({nivel}): {e}")
+        return {"error": str(e)}
+
+
+def _decidir_cascada(resultado_flash: Any) -> Tuple[bool, dict]:
+    """Indica si Flash decide el caso y arma el registro de la adjudicación."""
+    motivos = marcus_cascada.motivos_escalamiento(resultado_flash)
+    if not motivos:
+        metricas.ADJUDICACION_NIVEL.labels("flash").inc()
+        return True, {"nivel": "flash", "cascada": True, "motivos_escalamiento": []}
+    print(f"⬆️ [MARCUS_CASCADA] Flash no resuelve el caso, se escala a Pro: {', '.join(motivos)}", flush=True)
+    for motivo in motivos:
+        metricas.ESCALAMIENTOS_MARCUS.labels(motivo).inc()
+    metricas.ADJUDICACION_NIVEL.labels("pro").inc()
+    return False, {"nivel": "pro", "cascada": True, "motivos_escalamiento": motivos}
+
+
+def adjudicar_marcus(
+        llms_resource: dict,
+        contexto_marcus: str,
+        json_visual: str,
+        json_transcripcion: str
+) -> Tuple[Any, dict]:
+    """
+    Adjudicación Marcus con registro del nivel que decidió.
+    Con MARCUS_CASCADA=1 Flash adjudica primero y Pro solo interviene si Flash no alcanza
+    los umbrales de marcus_cascada; sin cascada, Pro adjudica directamente.
+    """
+    args = (llms_resource, contexto_marcus, json_visual, json_transcripcion)
+    if not marcus_cascada.MARCUS_CASCADA:
+        return _evaluar_nivel("pro", *args), {"nivel": "pro", "cascada": False}
+    resultado_flash = _evaluar_nivel("flash", *args)
+    decide_flash, adjudicacion = _decidir_cascada(resultado_flash)
+    return (resultado_flash if decide_flash else _evaluar_nivel("pro", *args)), adjudicacion
+
+
+async def adjudicar_marcus_async(
+        llms_resource: dict,
+        contexto_marcus: str,
+        json_visual: str,
+        json_transcripcion: str
+) -> Tuple[Any, dict]:
+    """Variante asíncrona de `adjudicar_marcus` para la API."""
+    args = (llms_resource, contexto_marcus, json_visual, json_transcripcion)
+    if not marcus_cascada.MARCUS_CASCADA:
+        return await _evaluar_nivel_async("pro", *args), {"nivel": "pro", "cascada": False}
+    resultado_flash = await _evaluar_nivel_async("flash", *args)
+    decide_flash, adjudicacion = _decidir_cascada(resultado_flash)
+    return (resultado_flash if decide_flash else await _evaluar_nivel_async("pro", *args)), adjudicacion
+
+
+def evaluar_circunstancias_marcus(
+        llms_resource: dict,
+        contexto_marcus: str,
+        json_visual: str,
+        json_transcripcion: str
+) -> Any:
+    """
+    Aplica la matriz Marcus usando Gemini nativo y el prompt del YAML (con la cascada si está activa).
+    """
+    resultado, _ = adjudicar_marcus(llms_resource, contexto_marcus, json_visual, json_transcripcion)
+    return resultado
+
+
+async def evaluar_circunstancias_marcus_async(
+        llms_resource: dict,
+        contexto_marcus: str,
+        json_visual: str,
+        json_transcripcion: str
+) -> Any:
+    """Variante asíncrona de `evaluar_circunstancias_marcus` para la API."""
+    resultado, _ = await adjudicar_marcus_async(llms_resource, contexto_marcus, json_visual, json_transcripcion)
+    return resultado
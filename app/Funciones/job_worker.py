@@ -0,0 +1,144 @@
+import os
+import time
+import uuid
+import asyncio
+import socket
+from typing import Callable, Optional
+
+from app.commons.services.job_queue import JobQueue
+from app.Funciones.pipeline_caso import CaseRequest, ejecutar_caso_eventos
+
+
+# Workers asíncronos que drenan la cola persistente dentro del proceso de la API
+JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS", "4"))
+JOBS_POLL_S = float(os.environ.get("JOBS_POLL_S", "1.0"))
+
+
+class LeasePerdido(Exception):
+    """El lease del trabajo venció y otro worker lo reclamó: este worker lo abandona."""
+
+
+class JobWorkerPool:
+    """
+    Pool de workers que toma casos de la cola SQLite y los ejecuta con el mismo
+    pipeline de /process-case. El progreso por etapa se persiste en cada evento
+    y el lease del trabajo se renueva mientras el caso está en vuelo; si el lease
+    se pierde (otro worker reclamó el trabajo) el caso se cancela en este worker.
+    """
+
+    def __init__(self, cola: JobQueue, obtener_recursos: Callable[[], tuple], workers: int = JOBS_WORKERS):
+        self.cola = cola
+        self.obtener_recursos = obtener_recursos
+        self.workers = workers
+        self.nombre = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._tareas = []
+        self._nuevo_trabajo: Optional[asyncio.Event] = None
+
+    def iniciar(self):
+        self._nuevo_trabajo = asyncio.Event()
+        self._tareas = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"🧵 [JOBS] {self.workers} workers iniciados ({self.nombre})", flush=True)
+
+    async def detener(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+    def notificar(self):
+        """Despierta a los workers cuando se encola un trabajo en este proceso."""
+        if self._nuevo_trabajo is not None:
+            self._nuevo_trabajo.set()
+
+    async def _esperar_trabajo(self):
+        try:
+            await asyncio.wait_for(self._nuevo_trabajo.wait(), JOBS_POLL_S)
+        except asyncio.TimeoutError:
+            pass
+        self._nuevo_trabajo.clear()
+
+    async def _worker(self, indice: int):
+        worker = f"{self.nombre}-{indice}"
+        while True:
+            try:
+                job = await asyncio.to_thread(self.cola.reclamar, worker)
+            except Exception as e:
+                print(f"❌ [JOBS] Error leyendo la cola: {e}", flush=True)
+                job = None
+            if job is None:
+                await self._esperar_trabajo()
+                continue
+            await self._procesar(job, worker)
+
+    async def _renovar_lease(self, job_id: str, worker: str):
+        """Renueva el lease mientras el trabajo siga siendo de este worker; termina solo si lo perdió."""
+        espera = self.cola.lease_s / 3
+        while True:
+            await asyncio.sleep(espera)
+            try:
+                vigente = await asyncio.to_thread(self.cola.renovar, job_id, worker)
+            except Exception as e:
+                # SQLite ocupado u otro fallo transitorio: se reintenta pronto, antes de que venza el lease
+                print(f"⚠️ [JOBS] No se pudo renovar el lease de {job_id}, se reintenta: {e}", flush=True)
+                espera = min(self.cola.lease_s / 10, JOBS_POLL_S)
+                continue
+            if not vigente:
+                return
+            espera = self.cola.lease_s / 3
+
+    async def _ejecutar(self, job_id: str, worker: str, request: CaseRequest, llms, contexto_marcus) -> Optional[dict]:
+        progreso = {"etapas": {}, "modalidades": {}, "inicio": time.time()}
+        veredicto = None
+        async for evento in ejecutar_caso_eventos(request, llms, contexto_marcus):
+            tipo = evento["evento"]
+            if tipo == "modalidad":
+                progreso["modalidades"][evento["nombre"]] = {"ok": evento["ok"], "latencia_s": evento["latencia_s"]}
+            elif tipo == "etapa":
+                progreso["etapas"][evento["etapa"]] = {"latencia_s": evento["latencia_s"]}
+            elif tipo == "veredicto":
+                veredicto = {k: v for k, v in evento.items() if k != "evento"}
+                continue
+            if not await asyncio.to_thread(self.cola.actualizar_progreso, job_id, worker, progreso):
+                raise LeasePerdido(job_id)
+        return veredicto
+
+    async def _procesar(self, job: dict, worker: str):
+        job_id = job["id"]
+        llms, contexto_marcus = self.obtener_recursos()
+        request = CaseRequest(**job["payload"])
+        print(f"📥 [JOBS] Trabajo {job_id} (caso {request.case_id}, intento {job['intentos']})", flush=True)
+
+        ejecucion = asyncio.create_task(self._ejecutar(job_id, worker, request, llms, contexto_marcus))
+        renovador = asyncio.create_task(self._renovar_lease(job_id, worker))
+        try:
+            await asyncio.wait({ejecucion, renovador}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # Apagado del proceso: el lease vence y otro worker lo retoma
+            ejecucion.cancel()
+            renovador.cancel()
+            await asyncio.gather(ejecucion, renovador, return_exceptions=True)
+            raise
+        renovador.cancel()
+
+        if not ejecucion.done():
+            # El renovador solo termina cuando otro worker reclamó el trabajo: se abandona el caso
+            ejecucion.cancel()
+            await asyncio.gather(ejecucion, return_exceptions=True)
+            print(f"⚠️ [JOBS] Trabajo {job_id}: se perdió el lease, lo continúa otro worker", flush=True)
+            return
+
+        try:
+            veredicto = ejecucion.result()
+        except LeasePerdido:
+            print(f"⚠️ [JOBS] Trabajo {job_id}: se perdió el lease, lo continúa otro worker", flush=True)
+            return
+        except Exception as e:
+            print(f"❌ [JOBS] Trabajo {job_id} falló: {e}", flush=True)
+            if not await asyncio.to_thread(self.cola.fallar, job_id, worker, str(e)):
+                print(f"⚠️ [JOBS] Trabajo {job_id}: el error no se registró, el trabajo ya es de otro worker", flush=True)
+            return
+
+        if await asyncio.to_thread(self.cola.completar, job_id, worker, veredicto):
+            print(f"✅ [JOBS] Trabajo {job_id} completado", flush=True)
+        else:
+            print(f"⚠️ [JOBS] Trabajo {job_id}: resultado descartado, el trabajo ya es de otro worker", flush=True)
@@ -0,0 +1,279 @@
+import os
+import time
+import asyncio
+from functools import partial
+from typing import AsyncIterator, Callable, List, Optional
+from pydantic import BaseModel
+
+from app.commons.services import metricas
+from app.commons.services.llm_scheduler import fijar_deadline_caso, limpiar_deadline_caso, acotar_deadline
+from app.Funciones.procesar_audio import transcribir_audio_gemini_async
+from app.Funciones.procesar_imagen import procesar_evidencia_visual_async
+from app.Funciones.procesar_video import procesar_video_gemini_async
+from app.Funciones.Procesar_circunstancias import adjudicar_marcus_async
+from app.commons.services.salida_estructurada import datos_modalidad
+from app.commons.services.evidencia_compacta import preparar_evidencia_marcus
+
+
+# Presupuesto de tiempo por caso: los reintentos ante 429/503 nunca lo superan.
+# Se reparte entre etapas y llega como timeout a las descargas de GCS y a las llamadas a Vertex:
+#   CASE_DEADLINE_S: plazo total del caso (por debajo del timeout del cliente)
+#   CASE_DEADLINE_MARCUS_S: parte reservada para la adjudicación; la extracción (descargas
+#   incluidas) tiene el resto, y las modalidades que no terminan a tiempo se cancelan
+CASE_DEADLINE_S = float(os.environ.get("CASE_DEADLINE_S", "540"))
+CASE_DEADLINE_MARCUS_S = float(os.environ.get("CASE_DEADLINE_MARCUS_S", "120"))
+
+# Prefijos con los que las funciones de app/Funciones reportan un fallo de la modalidad
+PREFIJOS_ERROR = ("Error en audio:", "Error visual:", "Error video:")
+
+_FIN = object()
+
+
+class CaseRequest(BaseModel):
+    case_id: str
+    urls_visuales: List[str] = []
+    urls_audios: List[str] = []
+    urls_videos: List[str] = []
+
+
+def es_error_modalidad(resultado) -> bool:
+    return isinstance(resultado, str) and resultado.startswith(PREFIJOS_ERROR)
+
+
+def nombres_modalidades(request: CaseRequest) -> List[str]:
+    """Nombres de las extracciones del caso, en el orden en que se lanzan."""
+    nombres = ["IA_VISUAL_PRO"] if request.urls_visuales else []
+    nombres += [f"IA_AUDIO_FLASH_{i}" for i in range(len(request.urls_audios))]
+    nombres += [f"IA_VIDEO_PRO_{i}" for i in range(len(request.urls_videos))]
+    return nombres
+
+
+def plazo_extraccion() -> float:
+    """Segundos de la etapa de extracción: el plazo del caso menos la reserva de Marcus."""
+    return max(CASE_DEADLINE_S - CASE_DEADLINE_MARCUS_S, CASE_DEADLINE_S / 2)
+
+
+def _tareas_multimedia(request: CaseRequest, llms: dict, previos: Optional[dict] = None) -> dict:
+    """
+    Corrutinas de extracción del caso indexadas por nombre (Flash para Audio, Pro para Video/Imagen).
+    Las modalidades presentes en `previos` no se vuelven a invocar: se reutiliza su resultado.
+    """
+    previos = previos or {}
+    fabricas = {}
+    if request.urls_visuales:
+        fabricas["IA_VISUAL_PRO"] = partial(procesar_evidencia_visual_async, request.urls_visuales, llms)
+    for i, url in enumerate(request.urls_audios):
+        fabricas[f"IA_AUDIO_FLASH_{i}"] = partial(transcribir_audio_gemini_async, url, llms)
+    for i, url in enumerate(request.urls_videos):
+        fabricas[f"IA_VIDEO_PRO_{i}"] = partial(procesar_video_gemini_async, url, llms)
+    return {n: _resultado_previo(previos[n]) if n in previos else f() for n, f in fabricas.items()}
+
+
+async def _resultado_previo(resultado):
+    return resultado
+
+
+async def _cronometrar(nombre: str, corrutina):
+    # Cada modalidad corre en su propia tarea: la etiqueta de métricas no se mezcla entre ellas
+    modalidad = metricas.modalidad_de(nombre)
+    t_inicio = time.perf_counter()
+    with metricas.en_modalidad(modalidad):
+        resultado = await corrutina
+    latencia = time.perf_counter() - t_inicio
+    metricas.MODALIDAD_S.labels(modalidad, str(not es_error_modalidad(resultado)).lower()).observe(latencia)
+    return nombre, resultado, latencia
+
+
+async def _producir_eventos(
+        request: CaseRequest,
+        llms: dict,
+        contexto_marcus: str,
+        emitir: Callable[[dict], None],
+        previos: Optional[dict] = None
+):
+    t_total_inicio = time.perf_counter()
+    case_id = request.case_id
+    tiempos_detalle = {}
+    token_deadline = fijar_deadline_caso(CASE_DEADLINE_S)
+    print(f"🚀 [CASO: {case_id}] Inicio de procesamiento multimodal", flush=True)
+    emitir({"evento": "inicio", "case_id": case_id})
+
+    pendientes = []
+    resultado_caso = "error"
+    metricas.CASOS_EN_VUELO.inc()
+    try:
+        # 1. PROCESAMIENTO MULTIMEDIA
+        # Llamadas nativas asíncronas: no dependen del límite de hilos de AnyIO
+        t_ia_parallel_start = time.perf_counter()
+        print(f"📡 [CASO: {case_id}] Lanzando tareas multimedia en paralelo...", flush=True)
+        # Las tareas copian el contexto al crearse: se llevan el plazo de la etapa, no el del caso
+        plazo = plazo_extraccion()
+        token_etapa = acotar_deadline(plazo)
+        try:
+            nombres_tareas = {
+                asyncio.ensure_future(_cronometrar(n, c)): n for n, c in _tareas_multimedia(request, llms, previos).items()
+            }
+        finally:
+            limpiar_deadline_caso(token_etapa)
+        pendientes = list(nombres_tareas)
+
+        res_map = {}
+        errores_modalidades = {}
+        fuera_de_plazo = []
+        limite_etapa = time.perf_counter() + plazo
+        por_terminar = set(pendientes)
+        while por_terminar:
+            hechas, por_terminar = await asyncio.wait(
+                por_terminar, timeout=max(limite_etapa - time.perf_counter(), 0), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not hechas:
+                break
+            for tarea in hechas:
+                nombre, resultado, latencia = tarea.result()
+                ok = not es_error_modalidad(resultado)
+                if ok:
+                    # La salida de cada modalidad es JSON con esquema: se parsea una vez y viaja como datos
+                    resultado = datos_modalidad(resultado)
+                    res_map[nombre] = resultado
+                else:
+                    # Los fallos (p. ej. cuota agotada tras los reintentos) no se le pasan a Marcus como evidencia
+                    errores_modalidades[nombre] = resultado
+                    metricas.ERRORES.labels(metricas.modalidad_de(nombre), "error_modalidad").inc()
+                    print(f"⚠️ [CASO: {case_id}] {nombre} falló y se excluye de la adjudicación", flush=True)
+                emitir({
+                    "evento": "modalidad",
+                    "case_id": case_id,
+                    "nombre": nombre,
+                    "ok": ok,
+                    "latencia_s": round(latencia, 3),
+                    "resultado": resultado,
+                })
+
+        # Modalidades que no terminaron en su plazo: se cancelan y Marcus adjudica con la evidencia disponible
+        for tarea in por_terminar:
+            tarea.cancel()
+            nombre = nombres_tareas[tarea]
+            fuera_de_plazo.append(nombre)
+            errores_modalidades[nombre] = f"Sin tiempo: {nombre} no terminó dentro del plazo de extracción ({plazo:.0f}s)"
+            metricas.ERRORES.labels(metricas.modalidad_de(nombre), "fuera_de_plazo").inc()
+            print(f"⏱️ [CASO: {case_id}] {nombre} no terminó a tiempo, se cancela y se excluye de la adjudicación", flush=True)
+            emitir({
+                "evento": "modalidad",
+                "case_id": case_id,
+                "nombre": nombre,
+                "ok": False,
+                "latencia_s": round(plazo, 3),
+                "resultado": errores_modalidades[nombre],
+            })
+
+        tiempos_detalle["latencia_multimedia_paralela"] = f"{time.perf_counter() - t_ia_parallel_start:.2f}s"
+        emitir({"evento": "etapa", "case_id": case_id, "etapa": "multimedia", "latencia_s": round(time.perf_counter() - t_ia_parallel_start, 3)})
+
+        # 2. RAZONAMIENTO MARCUS (Gemini Pro)
+        print(f"🧠 [CASO: {case_id}] Ejecutando análisis lógico Marcus...", flush=True)
+        t_marcus_start = time.perf_counter()
+
+        # Evidencia consolidada y sin repeticiones entre fuentes, dentro del presupuesto de tokens
+        # (comparar textos es trabajo de CPU: fuera del event loop)
+        json_visual, json_transcripcion, compactacion = await asyncio.to_thread(preparar_evidencia_marcus, res_map)
+        if "hechos_extraidos" in compactacion:
+            print(
+                f"🗜️ [CASO: {case_id}] Evidencia para Marcus: {compactacion['tokens_antes']} → {compactacion['tokens_despues']} tokens "
+                f"({compactacion.get('hechos_unicos', 0)}/{compactacion.get('hechos_extraidos', 0)} hechos únicos, "
+                f"{compactacion.get('descartados_por_presupuesto', 0)} fuera del presupuesto)",
+                flush=True,
+            )
+
+        with metricas.en_modalidad("marcus"), metricas.cronometro(metricas.ADJUDICACION_S):
+            resultado_final, adjudicacion = await adjudicar_marcus_async(
+                llms_resource=llms,
+                contexto_marcus=contexto_marcus,
+                json_visual=json_visual,
+                json_transcripcion=json_transcripcion
+            )
+        tiempos_detalle["latencia_razonamiento_marcus"] = f"{time.perf_counter() - t_marcus_start:.2f}s"
+        emitir({"evento": "etapa", "case_id": case_id, "etapa": "marcus", "latencia_s": round(time.perf_counter() - t_marcus_start, 3)})
+
+        tiempos_detalle["latencia_total_api"] = f"{time.perf_counter() - t_total_inicio:.2f}s"
+        print(f"🏁 [CASO: {case_id}] Proceso terminado en {tiempos_detalle['latencia_total_api']}", flush=True)
+
+        emitir({
+            "evento": "veredicto",
+            "ok": True,
+            "case_id": case_id,
+            "metricas_tiempos": tiempos_detalle,
+            "errores_modalidades": errores_modalidades,
+            # Veredicto sobre evidencia incompleta: alguna modalidad falló o se quedó sin tiempo
+            "evidencia_parcial": bool(errores_modalidades),
+            "modalidades_fuera_de_plazo": fuera_de_plazo,
+            "adjudicacion": adjudicacion,
+            "compactacion_evidencia": compactacion,
+            "resultado": resultado_final
+        })
+        resultado_caso = "ok"
+    except asyncio.CancelledError:
+        resultado_caso = "cancelado"
+        raise
+    except Exception as e:
+        metricas.registrar_error("caso", e)
+        raise
+    finally:
+        for tarea in pendientes:
+            if not tarea.done():
+                tarea.cancel()
+        limpiar_deadline_caso(token_deadline)
+        metricas.CASOS_EN_VUELO.dec()
+        metricas.CASO_S.labels(resultado_caso).observe(time.perf_counter() - t_total_inicio)
+
+
+async def ejecutar_caso_eventos(
+        request: CaseRequest,
+        llms: dict,
+        contexto_marcus: str,
+        latido_s: Optional[float] = None,
+        previos: Optional[dict] = None
+) -> AsyncIterator[dict]:
+    """
+    Ejecuta el caso y entrega sus eventos a medida que ocurren:
+    `inicio`, un `modalidad` por cada extracción terminada, `etapa` con los tiempos
+    de cada fase y `veredicto` con el resultado de Marcus.
+    Con `latido_s` se emite un evento `latido` cuando pasa ese tiempo sin novedades.
+    Si el consumidor deja de iterar (cliente desconectado) se cancela el trabajo pendiente.
+    `previos` permite reanudar un caso con resultados de modalidades ya extraídas.
+    """
+    cola: asyncio.Queue = asyncio.Queue()
+
+    async def _productor():
+        try:
+            await _producir_eventos(request, llms, contexto_marcus, cola.put_nowait, previos)
+        finally:
+            cola.put_nowait(_FIN)
+
+    # El productor corre en su propia tarea para que el deadline del caso (contextvar)
+    # se mantenga durante todo el pipeline, sin depender de cómo se itere este generador
+    productor = asyncio.create_task(_productor())
+    try:
+        while True:
+            try:
+                evento = await asyncio.wait_for(cola.get(), latido_s) if latido_s else await cola.get()
+            except asyncio.TimeoutError:
+                yield {"evento": "latido", "case_id": request.case_id}
+                continue
+            if evento is _FIN:
+                break
+            yield evento
+        await productor
+    finally:
+        if not productor.done():
+            productor.cancel()
+
+
+async def ejecutar_caso(request: CaseRequest, llms: dict, contexto_marcus: str) -> dict:
+    """Ejecuta el caso completo y devuelve la respuesta de /process-case."""
+    veredicto = None
+    async for evento in ejecutar_caso_eventos(request, llms, contexto_marcus):
+        if evento["evento"] == "veredicto":
+            veredicto = evento
+    respuesta = dict(veredicto)
+    respuesta.pop("evento", None)
+    return respuesta
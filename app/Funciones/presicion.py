@@ -1,62 +1,9 @@
-import json
 import logging
-from typing import Callable, Optional, Any, Tuple
+from typing import Callable, Optional, Any
 
 from langchain_core.messages import SystemMessage, HumanMessage
 from app.commons.services.miscelaneous import load_prompts_generales
-
-
-def _strip_code_fences(text: str) -> str:
-    """
-    Elimina fences de código tipo ``` de una respuesta del LLM.
-    """
-    if not isinstance(text, str):
-        return text
-    text = text.strip()
-    if text.startswith("```"):
-        first_newline = text.find("\n")
-        if first_newline != -1:
-            text = text[first_newline + 1:].strip()
-    if text.endswith("```"):
-        text = text[:-3].strip()
-    return text
-
-
-def _extract_json(text: str) -> Tuple[Optional[Any], Optional[Exception]]:
-    """
-    Intenta extraer JSON válido desde un string.
-    - Primero intenta json.loads directo.
-    - Luego sin fences.
-    - Luego buscando el primer '{' y el último '}'.
-    Devuelve (objeto_json, error) donde error es None si todo salió bien.
-    """
-    if text is None:
-        return None, ValueError("Empty response")
-
-    # Intento directo
-    try:
-        return json.loads(text), None
-    except Exception:
-        pass
-
-    # Intento sin fences
-    stripped = _strip_code_fences(text)
-    try:
-        return json.loads(stripped), None
-    except Exception:
-        pass
-
-    # Intento recortando desde el primer '{' hasta el último '}'
-    try:
-        start = stripped.find("{")
-        end = stripped.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            candidate = stripped[start:end + 1]
-            return json.loads(candidate), None
-    except Exception as e:
-        return None, e
-
-    return None, ValueError("Could not parse JSON after repairs")
+from app.commons.services.salida_estructurada import parsear_json
 
 
 def evaluar_coherencia_visual_vs_ficha(
@@ -126,7 +73,7 @@ def evaluar_coherencia_visual_vs_ficha(
         respuesta = llm.invoke(mensajes)
         raw = respuesta.content if hasattr(respuesta, "content") else str(respuesta)
 
-        parsed, err = _extract_json(raw)
+        parsed, err = parsear_json(raw)
 
         # 5. Validación opcional contra schema (Pydantic u otro)
         if parsed is not None and schema_validator:
@@ -158,7 +105,7 @@ def evaluar_coherencia_visual_vs_ficha(
 
             respuesta = llm.invoke(fix_messages)
             raw = respuesta.content if hasattr(respuesta, "content") else str(respuesta)
-            parsed, err = _extract_json(raw)
+            parsed, err = parsear_json(raw)
 
             if parsed is not None and schema_validator:
                 try:
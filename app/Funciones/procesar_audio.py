@@ -1,37 +1,180 @@
 import time
-from google.cloud import storage
-from vertexai.generative_models import Part
+import asyncio
+import logging
 from app.commons.services.miscelaneous import load_prompts_generales
+from app.commons.services.media_parts import generar_con_medios, generar_con_medios_async, partes_desde_datos, detectar_mime
+from app.commons.services.result_cache import result_cache, llave_para_uris, llave_resultado, identidad_bytes
+from app.commons.services.gcs_fetcher import descargar_blob_async
+from app.commons.services.llm_invoker import invocar_modelo, invocar_modelo_async
+from app.commons.services import audio_largo
+from app.commons.services.salida_estructurada import con_esquema, generar_validado, generar_validado_async
+
+
+def _config_audio(llms_resource):
+    model = llms_resource["gemini_flash"]
+    labels = llms_resource["config"]["labels"]
+    params = llms_resource["config"]["params_flash"]
+
+    # --- CARGA DEL PROMPT DESDE YAML ---
+    prompt_base = load_prompts_generales("transcription_audio")
+
+    # Salida restringida al esquema de transcription_audio (forma parte de la llave de caché)
+    generation_config = con_esquema({
+        "temperature": params.get("temperature", 0.0),
+        "max_output_tokens": params.get("max_tokens", 8192),
+    }, "transcription_audio")
+    return model, prompt_base, generation_config, labels
+
+
+def _llave_audio(uri_gcs, model, generation_config, largo):
+    # Resultado cacheado por identidad del contenido + prompt + modelo + parámetros; las opciones
+    # de fragmentación entran solo si la respuesta salió del modo de grabaciones largas
+    extra = {"audio_largo": audio_largo.opciones_fragmentacion()} if largo else None
+    return llave_para_uris("audio", [uri_gcs], "transcription_audio", model, generation_config, extra)
+
+
+def _preparar_audio(uri_gcs, llms_resource, largo=False):
+    model, prompt_base, generation_config, labels = _config_audio(llms_resource)
+    llave = _llave_audio(uri_gcs, model, generation_config, largo)
+    return model, prompt_base, generation_config, labels, llave
 
 
 def transcribir_audio_gemini(uri_gcs, llms_resource):
     try:
-        model = llms_resource["gemini_flash"]
-        labels = llms_resource["config"]["labels"]
-        params = llms_resource["config"]["params_flash"]
+        # La ruta síncrona transcribe siempre el archivo completo: llave sin opciones de fragmentación
+        model, prompt_base, generation_config, labels, llave = _preparar_audio(uri_gcs, llms_resource)
+        en_cache = result_cache.get(llave)
+        if en_cache is not None:
+            return en_cache
 
-        # --- CARGA DEL PROMPT DESDE YAML ---
-        prompt_base = load_prompts_generales("transcription_audio")
+        t_ia = time.perf_counter()
+        # Se envía el prompt_base cargado del YAML; el audio va por URI o en bytes según GEMINI_MEDIA_MODE_AUDIO
+        respuesta = generar_validado("transcription_audio", lambda nota: generar_con_medios(
+            model, prompt_base + nota, [uri_gcs], "audio", generation_config, labels
+        ))
+        result_cache.set(llave, respuesta.text)
+        return respuesta.text
+    except Exception as e:
+        return f"Error en audio: {str(e)}"
 
-        client = storage.Client()
-        bucket_name = uri_gcs.split("/")[2]
-        blob_name = "/".join(uri_gcs.split("/")[3:])
 
-        blob = client.bucket(bucket_name).blob(blob_name)
-        audio_bytes = blob.download_as_bytes()
+async def _transcribir_partes_async(model, prompt, partes, generation_config, labels):
+    return await generar_validado_async("transcription_audio", lambda nota: invocar_modelo_async(
+        model, [prompt + nota, *partes], generation_config, labels
+    ))
 
-        audio_part = Part.from_data(data=audio_bytes, mime_type="audio/mpeg")
 
-        t_ia = time.perf_counter()
-        # Se envía el prompt_base cargado del YAML
-        respuesta = model.generate_content(
-            [prompt_base, audio_part],
-            generation_config={
-                "temperature": params.get("temperature", 0.0),
-                "max_output_tokens": params.get("max_tokens", 8192),
-            },
-            labels=labels
+async def _transcribir_fragmento_async(fragmento, identidad, model, prompt_fragmento, config_fragmento, labels, limite):
+    rango = f"{fragmento['desde_s']:.2f}-{fragmento['hasta_s']:.2f}"
+    llave = llave_resultado("audio", [f"{identidad}#{rango}"], "transcription_audio_fragmento", model, config_fragmento)
+    en_cache = result_cache.get(llave)
+    if en_cache is not None:
+        return en_cache
+    async with limite:
+        partes = partes_desde_datos([(fragmento["bytes"], "audio/mpeg")])
+        respuesta = await generar_validado_async("transcription_audio_fragmento", lambda nota: invocar_modelo_async(
+            model, [prompt_fragmento + nota, *partes], config_fragmento, labels
+        ))
+    result_cache.set(llave, respuesta.text)
+    return respuesta.text
+
+
+async def _transcribir_largo_async(uri_gcs, model, prompt_base, generation_config, labels):
+    """
+    Modo de grabaciones largas: fragmentos solapados cortados en silencios, transcritos
+    en paralelo, unidos en una sola línea de tiempo y analizados con el prompt de audio.
+    """
+    data = await descargar_blob_async(uri_gcs)
+    plan = await asyncio.to_thread(audio_largo.fragmentar, data)
+    if plan is None:
+        # Grabación corta: una sola llamada, con el MIME detectado por el contenido
+        partes = partes_desde_datos([(data, detectar_mime(uri_gcs, data, "audio"))])
+        return (await _transcribir_partes_async(model, prompt_base, partes, generation_config, labels)).text
+
+    t_inicio = time.perf_counter()
+    identidad = identidad_bytes(data)
+    prompt_fragmento = load_prompts_generales("transcription_audio_fragmento")
+    # Los fragmentos devuelven la lista de segmentos: su propio esquema en lugar del de transcription_audio
+    config_base = {k: v for k, v in generation_config.items() if k != "response_schema"}
+    config_fragmento = con_esquema({**config_base, "response_mime_type": "application/json"}, "transcription_audio_fragmento")
+    limite = asyncio.Semaphore(audio_largo.AUDIO_MAX_PARALELO)
+    textos = await asyncio.gather(*(
+        _transcribir_fragmento_async(f, identidad, model, prompt_fragmento, config_fragmento, labels, limite)
+        for f in plan["fragmentos"]
+    ))
+    transcripcion = audio_largo.formatear_transcripcion(audio_largo.unir_transcripciones(plan["fragmentos"], textos))
+    print(
+        f"🎧 [AUDIO_LARGO] {uri_gcs}: {plan['duracion_s'] / 60:.1f} min en {len(plan['fragmentos'])} fragmentos "
+        f"transcritos en {time.perf_counter() - t_inicio:.2f}s",
+        flush=True,
+    )
+
+    # El análisis final trabaja sobre el texto completo (la plantilla del prompt espera {texto})
+    respuesta = await _transcribir_partes_async(model, prompt_base.replace("{texto}", transcripcion), [], generation_config, labels)
+    return respuesta.text
+
+
+async def transcribir_audio_gemini_async(uri_gcs, llms_resource):
+    """Variante asíncrona para la API: no ocupa hilos mientras espera a Gemini."""
+    try:
+        model, prompt_base, generation_config, labels, llave = await asyncio.to_thread(
+            _preparar_audio, uri_gcs, llms_resource, audio_largo.AUDIO_LARGO
         )
+        en_cache = result_cache.get(llave)
+        if en_cache is not None:
+            return en_cache
+
+        if audio_largo.AUDIO_LARGO:
+            try:
+                texto = await _transcribir_largo_async(uri_gcs, model, prompt_base, generation_config, labels)
+                result_cache.set(llave, texto)
+                return texto
+            except audio_largo.ERRORES_FFMPEG as e:
+                logging.warning(f"⚠️ [AUDIO_LARGO] No se pudo fragmentar {uri_gcs}, se transcribe completo: {e}")
+            # La transcripción completa no salió del modo largo: se cachea con la llave de la ruta normal
+            llave = await asyncio.to_thread(_llave_audio, uri_gcs, model, generation_config, False)
+            en_cache = result_cache.get(llave)
+            if en_cache is not None:
+                return en_cache
+
+        texto = (await generar_validado_async("transcription_audio", lambda nota: generar_con_medios_async(
+            model, prompt_base + nota, [uri_gcs], "audio", generation_config, labels
+        ))).text
+        result_cache.set(llave, texto)
+        return texto
+    except Exception as e:
+        return f"Error en audio: {str(e)}"
+
+
+def transcribir_audio_bytes(data: bytes, mime: str, llms_resource):
+    """Transcribe audio ya disponible en memoria (p. ej. la pista extraída de un video)."""
+    try:
+        model, prompt_base, generation_config, labels = _config_audio(llms_resource)
+        llave = llave_resultado("audio", [identidad_bytes(data)], "transcription_audio", model, generation_config)
+        en_cache = result_cache.get(llave)
+        if en_cache is not None:
+            return en_cache
+
+        partes = partes_desde_datos([(data, mime)])
+        respuesta = generar_validado("transcription_audio", lambda nota: invocar_modelo(
+            model, [prompt_base + nota, *partes], generation_config, labels
+        ))
+        result_cache.set(llave, respuesta.text)
+        return respuesta.text
+    except Exception as e:
+        return f"Error en audio: {str(e)}"
+
+
+async def transcribir_audio_bytes_async(data: bytes, mime: str, llms_resource):
+    try:
+        model, prompt_base, generation_config, labels = _config_audio(llms_resource)
+        llave = llave_resultado("audio", [identidad_bytes(data)], "transcription_audio", model, generation_config)
+        en_cache = result_cache.get(llave)
+        if en_cache is not None:
+            return en_cache
+
+        respuesta = await _transcribir_partes_async(model, prompt_base, partes_desde_datos([(data, mime)]), generation_config, labels)
+        result_cache.set(llave, respuesta.text)
         return respuesta.text
     except Exception as e:
-        return f"Error en audio: {str(e)}"
\ No newline at end of file
+        return f"Error en audio: {str(e)}"
@@ -1,39 +1,293 @@
 import time
-from google.cloud import storage
-from vertexai.generative_models import Part
+import json
+import asyncio
+import logging
+import functools
 from app.commons.services.miscelaneous import load_prompts_generales
+from app.commons.services.media_parts import generar_con_medios, generar_con_medios_async, partes_desde_datos, detectar_mime, modo_envio, MODO_BYTES
+from app.commons.services.result_cache import result_cache, llave_para_uris, llave_para_bytes, llave_resultado, identidad_bytes
+from app.commons.services.gcs_fetcher import descargar_blobs, descargar_blobs_async, en_paralelo
+from app.commons.services.llm_invoker import invocar_modelo, invocar_modelo_async
+from app.commons.services import imagen_preproceso, pdf_split
+from app.commons.services.salida_estructurada import con_esquema, datos_modalidad, generar_validado, generar_validado_async
+
+
+def _descarga_previa() -> bool:
+    """
+    Si el camino de extracción va a descargar la evidencia de todos modos, se descarga
+    antes de la llave de caché: su identidad sale de los bytes y no hace falta leer los metadatos en GCS.
+    """
+    return pdf_split.VISUAL_PDF_SPLIT or imagen_preproceso.IMAGE_PREPROCESS or modo_envio("visual") == MODO_BYTES
+
+
+def _preparar_visual(urls_gcs, llms_resource, lista_bytes=None):
+    model = llms_resource["gemini_pro"]
+    labels = llms_resource["config"]["labels"]
+    params = llms_resource["config"]["params_pro"]
+
+    # --- CARGA DEL PROMPT DESDE YAML ---
+    prompt_base = load_prompts_generales("extraction_visual")
+
+    # Salida restringida al esquema de extraction_visual (forma parte de la llave de caché)
+    generation_config = con_esquema({
+        "temperature": params.get("temperature", 0.0),
+        "max_output_tokens": params.get("max_tokens", 8192),
+    }, "extraction_visual")
+
+    # Resultado cacheado por identidad del contenido + prompt + modelo + parámetros (+ preprocesamiento)
+    extra = {}
+    if imagen_preproceso.IMAGE_PREPROCESS:
+        extra["preproceso"] = imagen_preproceso.opciones_preproceso()
+    if pdf_split.VISUAL_PDF_SPLIT:
+        extra["division_pdf"] = pdf_split.opciones_division()
+    extra = extra or None
+    if lista_bytes is not None:
+        llave = llave_para_bytes("visual", lista_bytes, "extraction_visual", model, generation_config, extra)
+    else:
+        llave = llave_para_uris("visual", list(urls_gcs), "extraction_visual", model, generation_config, extra)
+    return model, prompt_base, generation_config, labels, llave
+
+
+def _partes_normalizadas(urls_gcs, lista_bytes):
+    """Formato real por firma, orientación EXIF, presupuesto de píxeles y descarte de casi duplicados."""
+    mimes = [detectar_mime(uri, data, "visual") for uri, data in zip(urls_gcs, lista_bytes)]
+    datos, reporte = imagen_preproceso.preprocesar_imagenes(list(urls_gcs), lista_bytes, mimes)
+    print(
+        f"🖼️ [VISUAL_PREP] {reporte['enviadas']}/{reporte['recibidas']} archivos enviados, "
+        f"{reporte['duplicadas_descartadas']} casi duplicados descartados, "
+        f"{reporte['bytes_ahorrados'] / 1e6:.1f}MB ahorrados",
+        flush=True,
+    )
+    return partes_desde_datos(datos)
+
+
+def _partes_fotos(urls_gcs, lista_bytes, mimes):
+    if imagen_preproceso.IMAGE_PREPROCESS:
+        return _partes_normalizadas(urls_gcs, lista_bytes)
+    return partes_desde_datos(list(zip(lista_bytes, mimes)))
+
+
+def _planificar_fragmentos(urls_gcs, lista_bytes):
+    """
+    Separa el lote en fotos (una sola llamada) y fragmentos de páginas de cada PDF
+    (una llamada por fragmento). Cada fragmento lleva su llave de caché propia.
+    """
+    mimes = [detectar_mime(uri, data, "visual") for uri, data in zip(urls_gcs, lista_bytes)]
+    fotos = [(uri, data, mime) for uri, data, mime in zip(urls_gcs, lista_bytes, mimes) if mime != "application/pdf"]
+    fragmentos = []
+    for uri, data, mime in zip(urls_gcs, lista_bytes, mimes):
+        if mime != "application/pdf":
+            continue
+        try:
+            total, partes = pdf_split.dividir_pdf(data)
+        except Exception as e:
+            # PDF cifrado o dañado: se envía completo en un solo fragmento
+            logging.warning(f"⚠️ [VISUAL_PDF] No se pudo dividir {uri}, se envía completo: {e}")
+            total, partes = None, [((1, None), data)]
+        identidad = identidad_bytes(data)
+        for (inicio, fin), contenido in partes:
+            paginas = f"{inicio}-{fin}" if fin else "todas"
+            fragmentos.append({"uri": uri, "paginas": paginas, "total": total, "identidad": f"{identidad}#p{paginas}", "bytes": contenido})
+    return fotos, fragmentos
+
+
+def _prompt_fragmento(prompt_base, fragmento):
+    if fragmento["total"] is None:
+        return prompt_base
+    return (
+        f"{prompt_base}\n\nEste archivo es un fragmento del documento {fragmento['uri']}: "
+        f"páginas {fragmento['paginas']} de {fragmento['total']}. Extrae solo lo que aparece en estas páginas."
+    )
+
+
+def _consolidar(resultado_fotos, fragmentos, resultados_fragmentos):
+    """
+    Une las extracciones parciales en un único JSON visual para Marcus.
+    Los resultados pueden ser excepciones: cada fragmento fallido queda registrado con su
+    error y el resto se conserva. Devuelve (texto, completo); si todo falló se propaga el error.
+
+    Las extracciones no se funden en un solo objeto de extraction_visual: cada fragmento
+    describe solo sus páginas y dos documentos pueden contradecirse (placas, posiciones),
+    de modo que fundir campo a campo obligaría a elegir un valor y perder el otro. Se
+    anidan con su procedencia; con EVIDENCIA_COMPACTA la compactación las desarma hecho por hecho.
+    """
+    if not fragmentos:
+        # Lote sin PDF: la respuesta es la misma que sin división
+        if isinstance(resultado_fotos, BaseException):
+            raise resultado_fotos
+        return resultado_fotos, True
+
+    consolidado = {"fotografias": None, "documentos": []}
+    if isinstance(resultado_fotos, BaseException):
+        consolidado["fotografias"] = {"error": str(resultado_fotos)}
+    elif resultado_fotos is not None:
+        consolidado["fotografias"] = datos_modalidad(resultado_fotos)
+    for fragmento, resultado in zip(fragmentos, resultados_fragmentos):
+        documento = {"uri": fragmento["uri"], "paginas": fragmento["paginas"], "total_paginas": fragmento["total"]}
+        if isinstance(resultado, BaseException):
+            documento["error"] = str(resultado)
+        else:
+            documento["extraccion"] = datos_modalidad(resultado)
+        consolidado["documentos"].append(documento)
+
+    resultados = ([resultado_fotos] if resultado_fotos is not None else []) + list(resultados_fragmentos)
+    fallidos = [r for r in resultados if isinstance(r, BaseException)]
+    if len(fallidos) == len(resultados):
+        raise fallidos[0]
+    if fallidos:
+        print(f"⚠️ [VISUAL_PDF] {len(fallidos)}/{len(resultados)} partes del lote fallaron; se entrega el resto", flush=True)
+    return json.dumps(consolidado, ensure_ascii=False), not fallidos
+
+
+def _extraer_fragmento(fragmento, model, prompt_base, generation_config, labels):
+    llave = llave_resultado("visual", [fragmento["identidad"]], "extraction_visual", model, generation_config)
+    en_cache = result_cache.get(llave)
+    if en_cache is not None:
+        return en_cache
+    partes = partes_desde_datos([(fragmento["bytes"], "application/pdf")])
+    prompt = _prompt_fragmento(prompt_base, fragmento)
+    texto = generar_validado(
+        "extraction_visual", lambda nota: invocar_modelo(model, [prompt + nota, *partes], generation_config, labels)
+    ).text
+    result_cache.set(llave, texto)
+    return texto
+
+
+async def _extraer_fragmento_async(fragmento, model, prompt_base, generation_config, labels, limite):
+    llave = llave_resultado("visual", [fragmento["identidad"]], "extraction_visual", model, generation_config)
+    en_cache = result_cache.get(llave)
+    if en_cache is not None:
+        return en_cache
+    partes = partes_desde_datos([(fragmento["bytes"], "application/pdf")])
+    prompt = _prompt_fragmento(prompt_base, fragmento)
+    async with limite:
+        respuesta = await generar_validado_async(
+            "extraction_visual", lambda nota: invocar_modelo_async(model, [prompt + nota, *partes], generation_config, labels)
+        )
+    result_cache.set(llave, respuesta.text)
+    return respuesta.text
+
+
+def _extraer_partes(model, prompt_base, partes, generation_config, labels):
+    return generar_validado(
+        "extraction_visual", lambda nota: invocar_modelo(model, [prompt_base + nota, *partes], generation_config, labels)
+    )
+
+
+async def _extraer_partes_async(model, prompt_base, partes, generation_config, labels):
+    return await generar_validado_async(
+        "extraction_visual", lambda nota: invocar_modelo_async(model, [prompt_base + nota, *partes], generation_config, labels)
+    )
+
+
+def _extraer_fotos(uris, datos, mimes, model, prompt_base, generation_config, labels):
+    return _extraer_partes(model, prompt_base, _partes_fotos(uris, datos, mimes), generation_config, labels).text
+
+
+def _partes_en_linea(urls_gcs, lista_bytes):
+    return partes_desde_datos([(data, detectar_mime(uri, data, "visual")) for uri, data in zip(urls_gcs, lista_bytes)])
+
+
+def _intentar(trabajo):
+    """Ejecuta un trabajo del lote y devuelve la excepción en lugar de propagarla."""
+    try:
+        return trabajo()
+    except Exception as e:
+        return e
+
+
+def _procesar_por_fragmentos(urls_gcs, lista_bytes, model, prompt_base, generation_config, labels):
+    fotos, fragmentos = _planificar_fragmentos(list(urls_gcs), lista_bytes)
+    print(f"📑 [VISUAL_PDF] {len(fotos)} fotos y {len(fragmentos)} fragmentos de PDF en paralelo", flush=True)
+    trabajos = []
+    if fotos:
+        uris, datos, mimes = map(list, zip(*fotos))
+        trabajos.append(functools.partial(_extraer_fotos, uris, datos, mimes, model, prompt_base, generation_config, labels))
+    trabajos += [functools.partial(_extraer_fragmento, f, model, prompt_base, generation_config, labels) for f in fragmentos]
+    # Pool compartido de hilos de la evidencia (los bytes ya están descargados: no espera otro lote del pool)
+    resultados = en_paralelo(_intentar, trabajos, pdf_split.VISUAL_PDF_MAX_PARALELO)
+    resultado_fotos = resultados.pop(0) if fotos else None
+    return _consolidar(resultado_fotos, fragmentos, resultados)
+
+
+async def _procesar_por_fragmentos_async(urls_gcs, lista_bytes, model, prompt_base, generation_config, labels):
+    # Leer y reescribir los PDF es trabajo de CPU: fuera del event loop
+    fotos, fragmentos = await asyncio.to_thread(_planificar_fragmentos, list(urls_gcs), lista_bytes)
+    print(f"📑 [VISUAL_PDF] {len(fotos)} fotos y {len(fragmentos)} fragmentos de PDF en paralelo", flush=True)
+
+    async def _fotos():
+        if not fotos:
+            return None
+        uris, datos, mimes = map(list, zip(*fotos))
+        partes = await asyncio.to_thread(_partes_fotos, uris, datos, mimes)
+        return (await _extraer_partes_async(model, prompt_base, partes, generation_config, labels)).text
+
+    limite = asyncio.Semaphore(pdf_split.VISUAL_PDF_MAX_PARALELO)
+    # Un fragmento fallido no cancela ni descarta a los demás: se registra en el consolidado
+    resultado_fotos, *resultados = await asyncio.gather(
+        _fotos(),
+        *(_extraer_fragmento_async(f, model, prompt_base, generation_config, labels, limite) for f in fragmentos),
+        return_exceptions=True,
+    )
+    return _consolidar(resultado_fotos, fragmentos, resultados)
 
 
 def procesar_evidencia_visual(urls_gcs, llms_resource):
     try:
-        model = llms_resource["gemini_pro"]
-        labels = llms_resource["config"]["labels"]
-        params = llms_resource["config"]["params_pro"]
-
-        # --- CARGA DEL PROMPT DESDE YAML ---
-        prompt_base = load_prompts_generales("extraction_visual")
-
-        # Iniciamos la lista de contenido con el prompt del YAML
-        contenido_mensaje = [prompt_base]
-
-        client = storage.Client()
-        for url in urls_gcs:
-            bucket_name = url.split("/")[2]
-            blob_name = "/".join(url.split("/")[3:])
-            blob = client.bucket(bucket_name).blob(blob_name)
-            data_bytes = blob.download_as_bytes()
-
-            mime = "application/pdf" if url.lower().endswith(".pdf") else "image/jpeg"
-            contenido_mensaje.append(Part.from_data(data=data_bytes, mime_type=mime))
-
-        respuesta = model.generate_content(
-            contenido_mensaje,
-            generation_config={
-                "temperature": params.get("temperature", 0.0),
-                "max_output_tokens": params.get("max_tokens", 8192),
-            },
-            labels=labels
-        )
-        return respuesta.text
+        lista_bytes = descargar_blobs(list(urls_gcs)) if _descarga_previa() else None
+        model, prompt_base, generation_config, labels, llave = _preparar_visual(urls_gcs, llms_resource, lista_bytes)
+        en_cache = result_cache.get(llave)
+        if en_cache is not None:
+            return en_cache
+
+        if pdf_split.VISUAL_PDF_SPLIT:
+            texto, completo = _procesar_por_fragmentos(urls_gcs, lista_bytes, model, prompt_base, generation_config, labels)
+            if not completo:
+                # Con fragmentos fallidos no se cachea el lote: el próximo intento repite solo esos
+                return texto
+        elif imagen_preproceso.IMAGE_PREPROCESS:
+            partes = _partes_normalizadas(urls_gcs, lista_bytes)
+            texto = _extraer_partes(model, prompt_base, partes, generation_config, labels).text
+        elif lista_bytes is not None:
+            texto = _extraer_partes(model, prompt_base, _partes_en_linea(urls_gcs, lista_bytes), generation_config, labels).text
+        else:
+            # El prompt del YAML va primero, seguido de cada PDF/imagen del lote
+            # (por URI o descargados en paralelo según GEMINI_MEDIA_MODE_VISUAL)
+            texto = generar_validado("extraction_visual", lambda nota: generar_con_medios(
+                model, prompt_base + nota, list(urls_gcs), "visual", generation_config, labels
+            )).text
+        result_cache.set(llave, texto)
+        return texto
+    except Exception as e:
+        return f"Error visual: {str(e)}"
+
+
+async def procesar_evidencia_visual_async(urls_gcs, llms_resource):
+    """Variante asíncrona para la API: no ocupa hilos mientras espera a Gemini."""
+    try:
+        lista_bytes = await descargar_blobs_async(list(urls_gcs)) if _descarga_previa() else None
+        # El hash de los bytes (o la lectura de metadatos en GCS) es bloqueante: fuera del event loop
+        model, prompt_base, generation_config, labels, llave = await asyncio.to_thread(_preparar_visual, urls_gcs, llms_resource, lista_bytes)
+        en_cache = result_cache.get(llave)
+        if en_cache is not None:
+            return en_cache
+
+        if pdf_split.VISUAL_PDF_SPLIT:
+            texto, completo = await _procesar_por_fragmentos_async(urls_gcs, lista_bytes, model, prompt_base, generation_config, labels)
+            if not completo:
+                return texto
+        elif imagen_preproceso.IMAGE_PREPROCESS:
+            # Decodificar y recomprimir es trabajo de CPU: fuera del event loop
+            partes = await asyncio.to_thread(_partes_normalizadas, urls_gcs, lista_bytes)
+            texto = (await _extraer_partes_async(model, prompt_base, partes, generation_config, labels)).text
+        elif lista_bytes is not None:
+            partes = _partes_en_linea(urls_gcs, lista_bytes)
+            texto = (await _extraer_partes_async(model, prompt_base, partes, generation_config, labels)).text
+        else:
+            texto = (await generar_validado_async("extraction_visual", lambda nota: generar_con_medios_async(
+                model, prompt_base + nota, list(urls_gcs), "visual", generation_config, labels
+            ))).text
+        result_cache.set(llave, texto)
+        return texto
     except Exception as e:
-        return f"Error visual: {str(e)}"
\ No newline at end of file
+        return f"Error visual: {str(e)}"
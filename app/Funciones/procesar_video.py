@@ -1,34 +1,120 @@
 import time
-from google.cloud import storage
-from vertexai.generative_models import Part
+import json
+import asyncio
+import logging
 from app.commons.services.miscelaneous import load_prompts_generales
+from app.commons.services.media_parts import generar_con_medios, generar_con_medios_async, partes_desde_datos, detectar_mime
+from app.commons.services.result_cache import result_cache, llave_para_uris
+from app.commons.services.gcs_fetcher import descargar_blob, descargar_blob_async
+from app.commons.services.llm_invoker import invocar_modelo, invocar_modelo_async
+from app.commons.services import video_preproceso
+from app.Funciones.procesar_audio import transcribir_audio_bytes, transcribir_audio_bytes_async
+from app.commons.services.salida_estructurada import con_esquema, datos_modalidad, generar_validado, generar_validado_async
+
+def _preparar_video(uri_gcs, llms_resource):
+    model = llms_resource["gemini_pro"]
+    labels = llms_resource["config"]["labels"]
+    params = llms_resource["config"]["params_pro"]
+
+    # --- CARGA DEL PROMPT DESDE YAML ---
+    prompt_base = load_prompts_generales("extraction_visual")
+
+    # Salida restringida al esquema de extraction_visual (forma parte de la llave de caché)
+    generation_config = con_esquema({
+        "temperature": 0.1,
+        "max_output_tokens": params.get("max_tokens", 8192),
+    }, "extraction_visual")
+
+    # Resultado cacheado por identidad del contenido + prompt + modelo + parámetros (+ preprocesamiento)
+    extra = {"preproceso": video_preproceso.opciones_preproceso()} if video_preproceso.VIDEO_PREPROCESS else None
+    llave = llave_para_uris("video", [uri_gcs], "extraction_visual", model, generation_config, extra)
+    return model, prompt_base, generation_config, labels, llave
+
+def _partes_preprocesadas(uri_gcs, data, prep):
+    mime = prep["mime"] or detectar_mime(uri_gcs, data, "video")
+    sondeo = prep["sondeo"]
+    print(
+        f"🎞️ [VIDEO_PREP] {uri_gcs}: {sondeo['ancho']}x{sondeo['alto']}@{sondeo['fps']:.0f}fps "
+        f"{prep['bytes_original'] / 1e6:.1f}MB → {prep['bytes_final'] / 1e6:.1f}MB, "
+        f"{len(prep['keyframes'])} cuadros clave, audio {'separado' if prep['audio'] else 'no'}",
+        flush=True,
+    )
+    datos = [(prep["video"], mime)] + [(keyframe, "image/jpeg") for keyframe in prep["keyframes"]]
+    return partes_desde_datos(datos)
+
+def _con_pista_audio(texto, transcripcion):
+    if not transcripcion or transcripcion.startswith("Error en audio:"):
+        return texto
+    # Ambas salidas son JSON: se anidan como datos en lugar de concatenar texto
+    return json.dumps({
+        "analisis_visual": datos_modalidad(texto),
+        "transcripcion_pista_audio": datos_modalidad(transcripcion),
+    }, ensure_ascii=False)
+
+def _procesar_preprocesado(uri_gcs, llms_resource, model, prompt_base, generation_config, labels):
+    data = descargar_blob(uri_gcs)
+    prep = video_preproceso.preprocesar_video(data)
+    partes = _partes_preprocesadas(uri_gcs, data, prep)
+    respuesta = generar_validado("extraction_visual", lambda nota: invocar_modelo(
+        model, [prompt_base + nota, *partes], generation_config, labels
+    ))
+    transcripcion = transcribir_audio_bytes(prep["audio"], "audio/mpeg", llms_resource) if prep["audio"] else None
+    return _con_pista_audio(respuesta.text, transcripcion)
+
+async def _procesar_preprocesado_async(uri_gcs, llms_resource, model, prompt_base, generation_config, labels):
+    data = await descargar_blob_async(uri_gcs)
+    prep = await video_preproceso.preprocesar_video_async(data)
+    partes = _partes_preprocesadas(uri_gcs, data, prep)
+    # El video reducido y su pista de audio (por la ruta de audio, con Flash) se procesan en paralelo
+    tareas = [generar_validado_async("extraction_visual", lambda nota: invocar_modelo_async(
+        model, [prompt_base + nota, *partes], generation_config, labels
+    ))]
+    if prep["audio"]:
+        tareas.append(transcribir_audio_bytes_async(prep["audio"], "audio/mpeg", llms_resource))
+    respuesta, *transcripcion = await asyncio.gather(*tareas)
+    return _con_pista_audio(respuesta.text, transcripcion[0] if transcripcion else None)
 
 def procesar_video_gemini(uri_gcs, llms_resource):
     try:
-        model = llms_resource["gemini_pro"]
-        labels = llms_resource["config"]["labels"]
-        params = llms_resource["config"]["params_pro"]
-
-        # --- CARGA DEL PROMPT DESDE YAML ---
-        prompt_base = load_prompts_generales("extraction_visual")
-
-        client = storage.Client()
-        bucket_name = uri_gcs.split("/")[2]
-        blob_name = "/".join(uri_gcs.split("/")[3:])
-
-        blob = client.bucket(bucket_name).blob(blob_name)
-        video_bytes = blob.download_as_bytes()
-
-        video_part = Part.from_data(data=video_bytes, mime_type="video/mp4")
-
-        respuesta = model.generate_content(
-            [prompt_base, video_part],
-            generation_config={
-                "temperature": 0.1,
-                "max_output_tokens": params.get("max_tokens", 8192),
-            },
-            labels=labels
-        )
-        return respuesta.text
+        model, prompt_base, generation_config, labels, llave = _preparar_video(uri_gcs, llms_resource)
+        en_cache = result_cache.get(llave)
+        if en_cache is not None:
+            return en_cache
+
+        texto = None
+        if video_preproceso.VIDEO_PREPROCESS:
+            try:
+                texto = _procesar_preprocesado(uri_gcs, llms_resource, model, prompt_base, generation_config, labels)
+            except video_preproceso.ERRORES_FFMPEG as e:
+                logging.warning(f"⚠️ [VIDEO_PREP] No se pudo preprocesar {uri_gcs}, se envía el original: {e}")
+        if texto is None:
+            texto = generar_validado("extraction_visual", lambda nota: generar_con_medios(
+                model, prompt_base + nota, [uri_gcs], "video", generation_config, labels
+            )).text
+        result_cache.set(llave, texto)
+        return texto
+    except Exception as e:
+        return f"Error video: {str(e)}"
+
+async def procesar_video_gemini_async(uri_gcs, llms_resource):
+    """Variante asíncrona para la API: no ocupa hilos mientras espera a Gemini."""
+    try:
+        model, prompt_base, generation_config, labels, llave = await asyncio.to_thread(_preparar_video, uri_gcs, llms_resource)
+        en_cache = result_cache.get(llave)
+        if en_cache is not None:
+            return en_cache
+
+        texto = None
+        if video_preproceso.VIDEO_PREPROCESS:
+            try:
+                texto = await _procesar_preprocesado_async(uri_gcs, llms_resource, model, prompt_base, generation_config, labels)
+            except video_preproceso.ERRORES_FFMPEG as e:
+                logging.warning(f"⚠️ [VIDEO_PREP] No se pudo preprocesar {uri_gcs}, se envía el original: {e}")
+        if texto is None:
+            texto = (await generar_validado_async("extraction_visual", lambda nota: generar_con_medios_async(
+                model, prompt_base + nota, [uri_gcs], "video", generation_config, labels
+            ))).text
+        result_cache.set(llave, texto)
+        return texto
     except Exception as e:
-        return f"Error video: {str(e)}"
\ No newline at end of file
+        return f"Error video: {str(e)}"
@@ -0,0 +1,55 @@
+import os
+import json
+from typing import Optional
+
+from app.commons.services.gcs_fetcher import get_storage_client
+
+
+class ArtifactStore:
+    """
+    Directorio de artefactos intermedios de los jobs, local o en GCS (gs://bucket/prefijo).
+    Las rutas son relativas al directorio base, p. ej. "<case_id>/IA_AUDIO_FLASH_0.json".
+    """
+
+    def __init__(self, destino: str):
+        self.destino = destino.rstrip("/")
+        self.es_gcs = destino.startswith("gs://")
+        if self.es_gcs:
+            # Se admite tanto gs://bucket como gs://bucket/prefijo
+            self.bucket_name, _, prefijo = self.destino[len("gs://"):].partition("/")
+            self.prefijo = prefijo + "/" if prefijo else ""
+        else:
+            os.makedirs(self.destino, exist_ok=True)
+
+    def ruta(self, relativa: str) -> str:
+        return f"{self.destino}/{relativa}"
+
+    def _blob(self, relativa: str):
+        return get_storage_client().bucket(self.bucket_name).blob(self.prefijo + relativa)
+
+    def escribir_json(self, relativa: str, datos) -> str:
+        contenido = json.dumps(datos, ensure_ascii=False, indent=2)
+        if self.es_gcs:
+            self._blob(relativa).upload_from_string(contenido, content_type="application/json")
+        else:
+            ruta = self.ruta(relativa)
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            # Escritura atómica: un job interrumpido no deja artefactos a medias
+            temporal = ruta + ".tmp"
+            with open(temporal, "w", encoding="utf-8") as file:
+                file.write(contenido)
+            os.replace(temporal, ruta)
+        return self.ruta(relativa)
+
+    def leer_json(self, relativa: str) -> Optional[dict]:
+        if not self.existe(relativa):
+            return None
+        if self.es_gcs:
+            return json.loads(self._blob(relativa).download_as_bytes())
+        with open(self.ruta(relativa), "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def existe(self, relativa: str) -> bool:
+        if self.es_gcs:
+            return self._blob(relativa).exists()
+        return os.path.exists(self.ruta(relativa))
@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import tempfile
+import subprocess
+from difflib import SequenceMatcher
+from collections import Counter, defaultdict
+from typing import List, Optional, Tuple
+
+from app.commons.services.salida_estructurada import parsear_json
+
+
+# Transcripción de grabaciones largas por fragmentos en paralelo (opcional):
+#   AUDIO_LARGO=1 activa el modo
+#   AUDIO_LARGO_UMBRAL_S: duración a partir de la cual se fragmenta
+#   AUDIO_FRAGMENTO_S: duración objetivo de cada fragmento (el corte se mueve al silencio más cercano)
+#   AUDIO_SOLAPE_S: audio compartido entre fragmentos vecinos, para no perder palabras en el corte
+#   AUDIO_MAX_PARALELO: fragmentos transcritos a la vez por grabación
+AUDIO_LARGO = os.environ.get("AUDIO_LARGO", "0") == "1"
+AUDIO_LARGO_UMBRAL_S = float(os.environ.get("AUDIO_LARGO_UMBRAL_S", "480"))
+AUDIO_FRAGMENTO_S = float(os.environ.get("AUDIO_FRAGMENTO_S", "240"))
+AUDIO_SOLAPE_S = float(os.environ.get("AUDIO_SOLAPE_S", "6"))
+AUDIO_TOLERANCIA_CORTE_S = float(os.environ.get("AUDIO_TOLERANCIA_CORTE_S", "30"))
+AUDIO_MAX_PARALELO = int(os.environ.get("AUDIO_MAX_PARALELO", "6"))
+AUDIO_FFMPEG_TIMEOUT_S = float(os.environ.get("AUDIO_FFMPEG_TIMEOUT_S", "300"))
+
+# Fallos con los que se transcribe la grabación completa como antes
+# (SubprocessError cubre CalledProcessError y TimeoutExpired; OSError, ffmpeg ausente)
+ERRORES_FFMPEG = (subprocess.SubprocessError, OSError)
+
+_SILENCIO = re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+
+def opciones_fragmentacion() -> dict:
+    """Opciones vigentes; forman parte de la llave del caché de resultados."""
+    return {
+        "umbral_s": AUDIO_LARGO_UMBRAL_S,
+        "fragmento_s": AUDIO_FRAGMENTO_S,
+        "solape_s": AUDIO_SOLAPE_S,
+    }
+
+
+def _ejecutar(comando: List[str]) -> subprocess.CompletedProcess:
+    return subprocess.run(comando, capture_output=True, check=True, timeout=AUDIO_FFMPEG_TIMEOUT_S)
+
+
+def duracion(ruta: str) -> float:
+    salida = _ejecutar(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "json", ruta])
+    try:
+        return float(json.loads(salida.stdout)["format"]["duration"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise subprocess.SubprocessError(f"ffprobe devolvió una salida ilegible: {e}") from e
+
+
+def silencios(ruta: str, ruido_db: int = -35, minimo_s: float = 0.4) -> List[Tuple[float, float]]:
+    """Intervalos de silencio (inicio, fin) según el filtro silencedetect de ffmpeg."""
+    salida = _ejecutar([
+        "ffmpeg", "-v", "info", "-nostats", "-i", ruta,
+        "-af", f"silencedetect=noise={ruido_db}dB:d={minimo_s}", "-f", "null", "-",
+    ])
+    intervalos, inicio = [], None
+    for tipo, valor in _SILENCIO.findall(salida.stderr.decode("utf-8", "ignore")):
+        if tipo == "start":
+            inicio = float(valor)
+        elif inicio is not None:
+            intervalos.append((max(0.0, inicio), float(valor)))
+            inicio = None
+    return intervalos
+
+
+def puntos_de_corte(total_s: float, intervalos_silencio: List[Tuple[float, float]]) -> List[float]:
+    """Cortes cada AUDIO_FRAGMENTO_S, desplazados al centro del silencio más cercano dentro de la tolerancia."""
+    centros = [(inicio + fin) / 2 for inicio, fin in intervalos_silencio]
+    cortes, objetivo = [], AUDIO_FRAGMENTO_S
+    while objetivo < total_s - AUDIO_FRAGMENTO_S / 4:
+        cercanos = [c for c in centros if abs(c - objetivo) <= AUDIO_TOLERANCIA_CORTE_S and (not cortes or c > cortes[-1])]
+        corte = min(cercanos, key=lambda c: abs(c - objetivo)) if cercanos else objetivo
+        cortes.append(corte)
+        objetivo = corte + AUDIO_FRAGMENTO_S
+    return cortes
+
+
+def fragmentar(data: bytes) -> Optional[dict]:
+    """
+    Divide la grabación en fragmentos MP3 solapados, cortando en silencios.
+    Devuelve None si la grabación es más corta que el umbral.
+    Bloqueante (ffmpeg en subprocesos): desde asyncio se llama con to_thread.
+    """
+    with tempfile.TemporaryDirectory(prefix="audio_largo_") as directorio:
+        entrada = os.path.join(directorio, "entrada")
+        with open(entrada, "wb") as file:
+            file.write(data)
+
+        total_s = duracion(entrada)
+        if total_s < AUDIO_LARGO_UMBRAL_S:
+            return None
+
+        cortes = puntos_de_corte(total_s, silencios(entrada))
+        limites = [0.0, *cortes, total_s]
+        fragmentos = []
+        for indice, (inicio, fin) in enumerate(zip(limites, limites[1:])):
+            desde = max(0.0, inicio - AUDIO_SOLAPE_S)
+            hasta = min(total_s, fin + AUDIO_SOLAPE_S)
+            salida = os.path.join(directorio, f"fragmento_{indice:03d}.mp3")
+            _ejecutar([
+                "ffmpeg", "-v", "error", "-y", "-ss", f"{desde:.3f}", "-t", f"{hasta - desde:.3f}", "-i", entrada,
+                "-vn", "-ac", "1", "-ar", "16000", "-c:a", "libmp3lame", "-b:a", "48k", salida,
+            ])
+            with open(salida, "rb") as file:
+                fragmentos.append({"indice": indice, "desde_s": desde, "hasta_s": hasta, "corte_inicio_s": inicio, "corte_fin_s": fin, "bytes": file.read()})
+        return {"duracion_s": total_s, "fragmentos": fragmentos}
+
+
+def _parsear_segmentos(texto: str) -> List[dict]:
+    texto = (texto or "").strip()
+    # La respuesta viene restringida al esquema del fragmento: una sola pasada de json.loads
+    segmentos, _ = parsear_json(texto)
+    if not isinstance(segmentos, list):
+        # Respuesta fuera de formato: se conserva el texto como una sola intervención
+        return [{"inicio_s": 0.0, "hablante": "DESCONOCIDO", "texto": texto}] if texto else []
+    return [s for s in segmentos if isinstance(s, dict) and s.get("texto")]
+
+
+def _mapear_hablantes(previos: List[dict], nuevos: List[dict], desde_s: float, hasta_s: float) -> dict:
+    """
+    Relaciona las etiquetas del fragmento nuevo con las ya usadas comparando las
+    intervenciones que ambos transcribieron en la zona de solape.
+    """
+    votos = defaultdict(Counter)
+    en_solape = [p for p in previos if desde_s <= p["inicio_s"] <= hasta_s]
+    for nuevo in (n for n in nuevos if desde_s <= n["inicio_s"] <= hasta_s):
+        mejor = max(en_solape, key=lambda p: SequenceMatcher(None, p["texto"], nuevo["texto"]).ratio(), default=None)
+        if mejor is not None and SequenceMatcher(None, mejor["texto"], nuevo["texto"]).ratio() >= 0.5:
+            votos[nuevo["hablante"]][mejor["hablante"]] += 1
+    return {etiqueta: conteo.most_common(1)[0][0] for etiqueta, conteo in votos.items()}
+
+
+def unir_transcripciones(fragmentos: List[dict], textos: List[str]) -> List[dict]:
+    """
+    Une las transcripciones de los fragmentos en una sola línea de tiempo:
+    - cada intervención se asigna al fragmento dueño de su instante (entre los cortes),
+      lo que elimina las repetidas en la zona de solape;
+    - las etiquetas de hablante se alinean con las del fragmento anterior.
+    """
+    union: List[dict] = []
+    anteriores: List[dict] = []
+    for fragmento, texto in zip(fragmentos, textos):
+        segmentos = []
+        for segmento in _parsear_segmentos(texto):
+            try:
+                inicio_abs = fragmento["desde_s"] + float(segmento.get("inicio_s", 0.0))
+            except (TypeError, ValueError):
+                continue
+            segmentos.append({"inicio_s": inicio_abs, "hablante": str(segmento.get("hablante", "HABLANTE")), "texto": str(segmento["texto"]).strip()})
+
+        if anteriores:
+            mapa = _mapear_hablantes(anteriores, segmentos, fragmento["desde_s"], fragmento["corte_inicio_s"] + AUDIO_SOLAPE_S)
+            for segmento in segmentos:
+                segmento["hablante"] = mapa.get(segmento["hablante"], segmento["hablante"])
+
+        fin = float("inf") if fragmento is fragmentos[-1] else fragmento["corte_fin_s"]
+        union.extend(s for s in segmentos if fragmento["corte_inicio_s"] <= s["inicio_s"] < fin)
+        anteriores = segmentos
+    return union
+
+
+def formatear_transcripcion(segmentos: List[dict]) -> str:
+    lineas = []
+    for segmento in segmentos:
+        minutos, segundos = divmod(int(segmento["inicio_s"]), 60)
+        lineas.append(f"[{minutos:02d}:{segundos:02d}] {segmento['hablante']}: {segmento['texto']}")
+    return "\n".join(lineas)
@@ -0,0 +1,153 @@
+import os
+import time
+import hashlib
+import logging
+import weakref
+import datetime
+import threading
+from typing import Optional
+
+
+# Caché de contexto de Vertex para el prefijo estático de Marcus (prompt + matriz).
+#   MARCUS_CONTEXT_CACHE=0 desactiva el uso del caché
+#   MARCUS_CONTEXT_CACHE_TTL_S: vida del contenido cacheado en Vertex
+#   MARCUS_CONTEXT_CACHE_MARGIN_S: antelación con la que se renueva el TTL antes de expirar
+MARCUS_CONTEXT_CACHE = os.environ.get("MARCUS_CONTEXT_CACHE", "1") == "1"
+MARCUS_CONTEXT_CACHE_TTL_S = int(os.environ.get("MARCUS_CONTEXT_CACHE_TTL_S", "3600"))
+MARCUS_CONTEXT_CACHE_MARGIN_S = int(os.environ.get("MARCUS_CONTEXT_CACHE_MARGIN_S", "300"))
+
+# Modelo enlazado -> prefijo que tiene cacheado, para quien necesita la solicitud completa
+# (la huella del cassette). Referencias débiles: un modelo descartado sale solo del registro.
+_prefijos: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def prefijo_cacheado(model) -> Optional[str]:
+    """Prefijo que `model` tiene en el caché de contexto, o None si no es un modelo enlazado."""
+    try:
+        return _prefijos.get(model)
+    except TypeError:
+        # Objetos sin referencias débiles (p. ej. dobles de prueba) nunca son modelos enlazados
+        return None
+
+
+class PrefixContextCache:
+    """
+    Mantiene registrado en Vertex un único prefijo de contenido estático.
+    - Se crea la primera vez que se pide (o en el arranque con `preparar`).
+    - Se renueva el TTL cuando faltan menos de `margen_s` segundos para expirar.
+    - Se vuelve a crear si cambia el prefijo (prompt o matriz nuevos), y se borra el anterior.
+    Si Vertex rechaza la creación (p. ej. el prefijo no alcanza el mínimo de tokens
+    cacheables) no se reintenta con esa huella durante un TTL, y el llamador envía
+    el prompt completo como antes.
+    """
+
+    def __init__(self, nombre: str, ttl_s: int, margen_s: int, activo: bool = True):
+        self.nombre = nombre
+        self.ttl_s = ttl_s
+        self.margen_s = min(margen_s, max(ttl_s - 1, 0))
+        self.activo = activo
+        self._lock = threading.Lock()
+        self._huella = None
+        self._cached = None
+        self._modelo = None
+        self._expira = 0.0
+        self._huella_rechazada = None
+        self._rechazo_expira = 0.0
+
+    @staticmethod
+    def huella(model_name: str, prefijo: str) -> str:
+        return hashlib.sha256(f"{model_name}\n{prefijo}".encode("utf-8")).hexdigest()
+
+    def modelo_para(self, model_name: str, prefijo: str):
+        """
+        Devuelve un GenerativeModel enlazado al contenido cacheado del prefijo,
+        o None si el caché está desactivado o no está disponible.
+        """
+        if not self.activo:
+            return None
+
+        huella = self.huella(model_name, prefijo)
+        if huella == self._huella_rechazada and time.time() < self._rechazo_expira:
+            return None
+
+        with self._lock:
+            ahora = time.time()
+            if self._cached is not None and self._huella == huella:
+                if ahora < self._expira - self.margen_s:
+                    return self._modelo
+                if self._renovar(ahora):
+                    return self._modelo
+
+            return self._crear(model_name, prefijo, huella)
+
+    def preparar(self, model_name: str, prefijo: str) -> bool:
+        """Registra el prefijo por adelantado (arranque del proceso)."""
+        return self.modelo_para(model_name, prefijo) is not None
+
+    def _renovar(self, ahora: float) -> bool:
+        try:
+            self._cached.update(ttl=datetime.timedelta(seconds=self.ttl_s))
+            self._expira = ahora + self.ttl_s
+            print(f"♻️ [CONTEXT_CACHE:{self.nombre}] TTL renovado", flush=True)
+            return True
+        except Exception as e:
+            # Si ya expiró en Vertex se vuelve a crear
+            logging.warning(f"⚠️ [CONTEXT_CACHE:{self.nombre}] No se pudo renovar el TTL: {e}")
+            self._descartar()
+            return False
+
+    def _crear(self, model_name: str, prefijo: str, huella: str):
+        from vertexai.generative_models import Content, Part
+        from vertexai.preview import caching
+        from vertexai.preview.generative_models import GenerativeModel as PreviewGenerativeModel
+
+        self._descartar()
+        t_inicio = time.perf_counter()
+        try:
+            cached = caching.CachedContent.create(
+                model_name=model_name,
+                contents=[Content(role="user", parts=[Part.from_text(prefijo)])],
+                ttl=datetime.timedelta(seconds=self.ttl_s),
+                display_name=f"{self.nombre}-{huella[:12]}",
+            )
+        except Exception as e:
+            logging.warning(f"⚠️ [CONTEXT_CACHE:{self.nombre}] Vertex no aceptó el prefijo, se envía completo: {e}")
+            self._huella_rechazada = huella
+            self._rechazo_expira = time.time() + self.ttl_s
+            return None
+
+        self._cached = cached
+        self._modelo = PreviewGenerativeModel.from_cached_content(cached_content=cached)
+        _prefijos[self._modelo] = prefijo
+        self._huella = huella
+        self._expira = time.time() + self.ttl_s
+        print(f"🧊 [CONTEXT_CACHE:{self.nombre}] Prefijo registrado en {time.perf_counter() - t_inicio:.2f}s", flush=True)
+        return self._modelo
+
+    def _descartar(self):
+        anterior = self._cached
+        self._cached = None
+        self._modelo = None
+        self._huella = None
+        if anterior is not None:
+            try:
+                anterior.delete()
+            except Exception:
+                pass
+
+
+marcus_context_cache = PrefixContextCache(
+    "marcus",
+    ttl_s=MARCUS_CONTEXT_CACHE_TTL_S,
+    margen_s=MARCUS_CONTEXT_CACHE_MARGIN_S,
+    activo=MARCUS_CONTEXT_CACHE,
+)
+
+# Con la cascada Flash -> Pro (MARCUS_CASCADA) el mismo prefijo se registra también para Flash:
+# cada caché guarda un único prefijo, así que cada modelo necesita el suyo
+marcus_context_cache_flash = PrefixContextCache(
+    "marcus-flash",
+    ttl_s=MARCUS_CONTEXT_CACHE_TTL_S,
+    margen_s=MARCUS_CONTEXT_CACHE_MARGIN_S,
+    activo=MARCUS_CONTEXT_CACHE,
+)
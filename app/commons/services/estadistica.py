@@ -0,0 +1,13 @@
+import math
+from typing import Iterable
+
+
+def percentil(valores: Iterable[float], q: float) -> float:
+    """
+    Percentil por rango más cercano (q entre 0 y 1): el menor valor que deja al menos
+    la fracción q de las muestras en o por debajo de él. 0.0 si no hay muestras.
+    """
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, max(0, math.ceil(q * len(ordenados)) - 1))]
@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Any, List, Optional, Tuple
+
+from app.commons.services import metricas
+from app.commons.services.llm_scheduler import estimar_tokens
+
+
+# Compactación de la evidencia entre la extracción y la adjudicación Marcus:
+#   EVIDENCIA_COMPACTA=1 activa la compactación (por defecto Marcus recibe la salida completa
+#   de cada modalidad, hasta validar la compactación contra esa salida)
+#   EVIDENCIA_PRESUPUESTO_TOKENS: tope de tokens estimados de la evidencia consolidada
+#   EVIDENCIA_MAX_CARACTERES_HECHO: largo máximo de cada hecho (el resto se recorta)
+#   EVIDENCIA_SIMILITUD: similitud a partir de la cual dos hechos del mismo campo son el mismo hecho
+EVIDENCIA_COMPACTA = os.environ.get("EVIDENCIA_COMPACTA", "0") == "1"
+EVIDENCIA_PRESUPUESTO_TOKENS = int(os.environ.get("EVIDENCIA_PRESUPUESTO_TOKENS", "6000"))
+EVIDENCIA_MAX_CARACTERES_HECHO = int(os.environ.get("EVIDENCIA_MAX_CARACTERES_HECHO", "600"))
+EVIDENCIA_SIMILITUD = float(os.environ.get("EVIDENCIA_SIMILITUD", "0.85"))
+
+# Contenedores que agregan las etapas (fragmentos de PDF, video con pista de audio): no aportan significado
+_ENVOLTORIOS = {"fotografias", "documentos", "extraccion", "analisis_visual"}
+_OMITIDAS = {"uri", "paginas", "total_paginas", "numero_imagenes_analizadas", "tipos_evidencia_visual"}
+# Marcadores de dato ausente (ya normalizados). "ninguno", "no visible" o "desconocido" son
+# hallazgos (no hubo frenado, la placa no se ve) y se conservan
+_VACIOS = {"", "n a", "na", "null", "none", "no aplica", "no aplicable"}
+# Palabras que cambian el sentido de un hecho: dos redacciones que difieren en ellas no son el mismo hecho
+_NEGACIONES = {"no", "sin", "ni", "nunca", "jamas", "tampoco", "nada", "nadie", "ningun", "ninguno", "ninguna"}
+_NUMERO = re.compile(r"\d+(?: \d+)?")
+_LETRA_VEHICULO = re.compile(
+    r"\b(?:vehiculo|conductor|auto|automovil|carro|coche|moto|motocicleta|camion|camioneta|bus|taxi)\s+([ab])\b"
+)
+
+# Clave del esquema -> sección del registro; tienen prioridad sobre el vehículo al que se refieren
+_SECCIONES = {
+    "analisis_causal_y_responsabilidad": "responsabilidad",
+    "limitaciones_y_incertidumbres": "limitaciones",
+    "metadata_analisis": "limitaciones",
+    "declaraciones": "declaraciones",
+}
+_SECCIONES_GENERALES = {
+    "escenario_del_siniestro": "escena",
+    "entorno_tecnico": "escena",
+    "descripcion_general_escena": "escena",
+    "dinamica_de_colision": "dinamica",
+    "reconstruccion_impacto": "dinamica",
+    "analisis_cinematico": "dinamica",
+    "factores_contribuyentes_evidentes": "factores",
+}
+_VEHICULO = re.compile(r"(?:^|_)vehiculo_([ab])$|^confianza_direccion_([ab])$")
+# Claves de audio y visual que describen lo mismo del vehículo -> campo canónico
+_CAMPOS_VEHICULO = {
+    "placa": "placa", "placa_visible": "placa",
+    "modelo_aproximado": "modelo", "año_aproximado": "año", "descripcion_general": "descripcion",
+    "ubicacion_respecto_via": "posicion", "orientacion_vehiculo": "posicion",
+    "distancia_punto_impacto_estimada": "posicion", "posicion_relativa_vehiculo_a": "posicion",
+    "posicion_relativa_vehiculo_b": "posicion",
+    "movimiento_previo_al_conflicto": "maniobra", "maniobra_critica": "maniobra",
+    "direccion_probable_vehiculo_a": "maniobra", "direccion_probable_vehiculo_b": "maniobra",
+    "confianza_direccion_a": "confianza_maniobra", "confianza_direccion_b": "confianza_maniobra",
+    "velocidad_reportada": "velocidad", "velocidad_relativa_estimada": "velocidad", "velocidad_impacto_estimada": "velocidad",
+    "señales_frenado_descritas": "frenado", "huellas_frenado_visibles": "frenado", "marcas_derrape_lateral": "frenado",
+    "punto_impacto_vehiculo_a": "punto_impacto", "punto_impacto_vehiculo_b": "punto_impacto",
+    "zona_impacto_primario": "punto_impacto",
+    "patron_deformacion": "danos", "componentes_afectados": "danos", "evidencia_transferencia": "danos",
+    "severidad_estructural": "danos",
+}
+# Orden de las secciones en el registro y prioridad al aplicar el presupuesto (menor = se conserva antes)
+_PRIORIDAD = {
+    "vehiculo_a": 0, "vehiculo_b": 0, "dinamica": 1, "responsabilidad": 1, "declaraciones": 2,
+    "escena": 2, "factores": 3, "otros": 3, "limitaciones": 4,
+}
+_FORMATO = "Cada hecho termina con [fuentes que lo reportan]; los hechos repetidos entre fuentes aparecen una sola vez."
+
+
+def evidencia_completa(res_map: dict) -> Tuple[str, str]:
+    """Evidencia sin compactar: las salidas de cada modalidad tal como terminaron."""
+    transcripciones = [v for k, v in res_map.items() if "AUDIO" in k]
+    videos_data = [v for k, v in res_map.items() if "VIDEO" in k]
+    json_visual = json.dumps({"estatica": res_map.get("IA_VISUAL_PRO", "N/A"), "videos": videos_data}, ensure_ascii=False)
+    json_transcripcion = json.dumps(transcripciones, ensure_ascii=False) if transcripciones else "N/A"
+    return json_visual, json_transcripcion
+
+
+def _fuente(nombre: str) -> str:
+    """IA_VISUAL_PRO -> visual, IA_VIDEO_PRO_1 -> video_1, IA_AUDIO_FLASH_0 -> audio_0."""
+    return re.sub(r"^IA_|_(PRO|FLASH)", "", nombre).lower()
+
+
+def _es_testimonial(fuente: str) -> bool:
+    return fuente.startswith("audio") or fuente.endswith(":audio")
+
+
+def _normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto)
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).casefold()
+    return " ".join(re.sub(r"[^0-9a-zñ]+", " ", texto).split())
+
+
+def _ubicar(ruta: List[str]) -> Tuple[str, str]:
+    """Sección del registro y campo canónico de un dato según su ruta en el JSON de la modalidad."""
+    if not ruta:
+        return "otros", "texto"
+    hoja = ruta[-1]
+    campo_libre = f"{ruta[-2]}.{hoja}" if _VEHICULO.search(hoja) and len(ruta) > 1 else hoja
+    for clave in ruta:
+        if clave in _SECCIONES:
+            return _SECCIONES[clave], campo_libre
+    for clave in ruta:
+        coincidencia = _VEHICULO.search(clave)
+        if coincidencia:
+            seccion = f"vehiculo_{coincidencia.group(1) or coincidencia.group(2)}"
+            campo = next((_CAMPOS_VEHICULO[c] for c in reversed(ruta) if c in _CAMPOS_VEHICULO), None)
+            return seccion, campo or (ruta[-2] if _VEHICULO.search(hoja) and len(ruta) > 1 else hoja)
+    for clave in ruta:
+        if clave in _SECCIONES_GENERALES:
+            return _SECCIONES_GENERALES[clave], hoja
+    return "otros", hoja
+
+
+def _intervencion(segmento: dict) -> str:
+    minutos, segundos = divmod(int(segmento.get("inicio_s") or 0), 60)
+    return f"[{minutos:02d}:{segundos:02d}] {segmento.get('hablante') or 'DESCONOCIDO'}: {segmento['texto']}"
+
+
+def _extraer_hechos(valor: Any, fuente: str, ruta: List[str], hechos: List[dict]):
+    """Recorre la salida de una modalidad y agrega un hecho por cada dato con contenido."""
+    if isinstance(valor, dict):
+        if "texto" in valor and "inicio_s" in valor:
+            # Intervención de una transcripción por segmentos: se conserva con su marca de tiempo
+            _extraer_hechos(_intervencion(valor), fuente, ["declaraciones"], hechos)
+            return
+        for clave, sub in valor.items():
+            if clave in _OMITIDAS:
+                continue
+            if clave == "transcripcion_pista_audio":
+                _extraer_hechos(sub, f"{fuente}:audio", ruta, hechos)
+                continue
+            _extraer_hechos(sub, fuente, ruta if clave in _ENVOLTORIOS else ruta + [clave], hechos)
+    elif isinstance(valor, list):
+        for item in valor:
+            _extraer_hechos(item, fuente, ruta, hechos)
+    elif valor is not None:
+        texto = str(valor).strip()
+        clave = _normalizar(texto)
+        if clave in _VACIOS:
+            return
+        seccion, campo = _ubicar(ruta)
+        if campo == "placa":
+            # ABC-123, abc 123 y ABC123 son la misma placa
+            clave = clave.replace(" ", "")
+        hechos.append({"seccion": seccion, "campo": campo, "valor": texto, "clave": clave, "fuentes": [fuente], "orden": len(hechos)})
+
+
+def _marcadores(clave: str) -> tuple:
+    """Negaciones, cifras y letras de vehículo (A/B) de un hecho normalizado."""
+    return (
+        frozenset(p for p in clave.split() if p in _NEGACIONES),
+        frozenset(_NUMERO.findall(clave)),
+        frozenset(_LETRA_VEHICULO.findall(clave)),
+    )
+
+
+def _mismo_hecho(a: str, b: str) -> bool:
+    """
+    Igualdad exacta, o redacciones parecidas en las que una solo amplía a la otra y ambas
+    coinciden en negaciones, cifras y vehículo ("frenó" / "no frenó", 40 / 80 km/h,
+    vehículo A / B y verde / rojo quedan como hechos distintos, cada uno con su fuente).
+    """
+    if a == b:
+        return True
+    if _marcadores(a) != _marcadores(b):
+        return False
+    palabras_a, palabras_b = set(a.split()), set(b.split())
+    if not (palabras_a <= palabras_b or palabras_b <= palabras_a):
+        return False
+    if min(len(a), len(b)) >= 12 and (a in b or b in a):
+        return True
+    # Se comparan palabras, no caracteres; y filtros baratos antes de la comparación completa
+    comparador = SequenceMatcher(None, a.split(), b.split())
+    return (
+        comparador.real_quick_ratio() >= EVIDENCIA_SIMILITUD
+        and comparador.quick_ratio() >= EVIDENCIA_SIMILITUD
+        and comparador.ratio() >= EVIDENCIA_SIMILITUD
+    )
+
+
+def _fusionar(hechos: List[dict]) -> List[dict]:
+    """Une los hechos repetidos del mismo campo: queda la redacción más completa con todas sus fuentes."""
+    unicos = []
+    por_campo = {}
+    exactos = {}
+    for hecho in hechos:
+        grupo = por_campo.setdefault((hecho["seccion"], hecho["campo"]), [])
+        igual = exactos.get((hecho["seccion"], hecho["campo"], hecho["clave"]))
+        if igual is None:
+            igual = next((h for h in grupo if _mismo_hecho(h["clave"], hecho["clave"])), None)
+        exactos[(hecho["seccion"], hecho["campo"], hecho["clave"])] = igual or hecho
+        if igual is None:
+            grupo.append(hecho)
+            unicos.append(hecho)
+            continue
+        igual["fuentes"] += [f for f in hecho["fuentes"] if f not in igual["fuentes"]]
+        if len(hecho["valor"]) > len(igual["valor"]):
+            igual["valor"], igual["clave"] = hecho["valor"], hecho["clave"]
+    return unicos
+
+
+def _entrada(hecho: dict) -> str:
+    return f"{hecho['valor']} [{', '.join(hecho['fuentes'])}]"
+
+
+def _aplicar_presupuesto(hechos: List[dict], presupuesto: int) -> Tuple[List[dict], int]:
+    """
+    Conserva los hechos más útiles para adjudicar dentro del presupuesto: primero por sección
+    (vehículos y dinámica antes que limitaciones), después los corroborados por más fuentes.
+    """
+    recortados = 0
+    for hecho in hechos:
+        if len(hecho["valor"]) > EVIDENCIA_MAX_CARACTERES_HECHO:
+            hecho["valor"] = hecho["valor"][:EVIDENCIA_MAX_CARACTERES_HECHO].rstrip() + "…"
+            recortados += 1
+
+    conservados, usados = [], estimar_tokens(_FORMATO)
+    for hecho in sorted(hechos, key=lambda h: (_PRIORIDAD.get(h["seccion"], 3), -len(h["fuentes"]), h["orden"])):
+        # Comillas, dos puntos y separadores del JSON cuentan como unos pocos tokens por hecho
+        costo = estimar_tokens(hecho["campo"] + _entrada(hecho)) + 3
+        if usados + costo <= presupuesto:
+            conservados.append(hecho)
+            usados += costo
+    return sorted(conservados, key=lambda h: h["orden"]), recortados
+
+
+def _registro(hechos: List[dict]) -> dict:
+    """Registro canónico: sección -> campo -> hecho (o lista de hechos si el campo tiene varios)."""
+    registro = {}
+    for hecho in hechos:
+        registro.setdefault(hecho["seccion"], {}).setdefault(hecho["campo"], []).append(_entrada(hecho))
+    salida = {}
+    for seccion in sorted(registro, key=lambda s: (_PRIORIDAD.get(s, 3), s)):
+        campos = registro[seccion]
+        if list(campos) == [seccion]:
+            # Secciones que son una lista (las declaraciones con su marca de tiempo)
+            salida[seccion] = campos[seccion]
+            continue
+        salida[seccion] = {campo: valores[0] if len(valores) == 1 else valores for campo, valores in campos.items()}
+    return salida
+
+
+def compactar_evidencia(res_map: dict, presupuesto: Optional[int] = None) -> Tuple[str, str, dict]:
+    """
+    Normaliza la salida de cada modalidad en un registro canónico (vehículos, placas, posiciones,
+    maniobras, declaraciones, escena), fusiona los hechos repetidos entre fuentes y aplica el
+    presupuesto de tokens. Devuelve (json_visual, json_transcripcion, reporte): los hechos que
+    alguna fuente objetiva respalda van al JSON visual; los solo testimoniales, al de transcripciones.
+    """
+    presupuesto = presupuesto or EVIDENCIA_PRESUPUESTO_TOKENS
+    hechos = []
+    for nombre in sorted(res_map):
+        _extraer_hechos(res_map[nombre], _fuente(nombre), [], hechos)
+    unicos = _fusionar(hechos)
+    conservados, recortados = _aplicar_presupuesto(unicos, presupuesto)
+
+    objetivos = [h for h in conservados if not all(_es_testimonial(f) for f in h["fuentes"])]
+    testimoniales = [h for h in conservados if all(_es_testimonial(f) for f in h["fuentes"])]
+    json_visual = json.dumps({"formato": _FORMATO, **_registro(objetivos)}, ensure_ascii=False) if objetivos else "N/A"
+    json_transcripcion = json.dumps(_registro(testimoniales), ensure_ascii=False) if testimoniales else "N/A"
+    reporte = {
+        "hechos_extraidos": len(hechos),
+        "hechos_unicos": len(unicos),
+        "descartados_por_presupuesto": len(unicos) - len(conservados),
+        "recortados": recortados,
+    }
+    return json_visual, json_transcripcion, reporte
+
+
+def preparar_evidencia_marcus(res_map: dict) -> Tuple[str, str, dict]:
+    """Evidencia para Marcus (compactada si EVIDENCIA_COMPACTA) y reporte con los tokens antes y después."""
+    json_visual, json_transcripcion = evidencia_completa(res_map)
+    tokens_antes = estimar_tokens(json_visual) + estimar_tokens(json_transcripcion)
+    reporte = {"compacta": False, "tokens_antes": tokens_antes}
+    if EVIDENCIA_COMPACTA and res_map:
+        compacto_visual, compacto_transcripcion, detalle = compactar_evidencia(res_map)
+        reporte.update(detalle)
+        # En casos mínimos las fuentes y el formato pesan más que lo que se ahorra: se envía la evidencia completa
+        if estimar_tokens(compacto_visual) + estimar_tokens(compacto_transcripcion) < tokens_antes:
+            json_visual, json_transcripcion = compacto_visual, compacto_transcripcion
+            reporte["compacta"] = True
+    reporte["tokens_despues"] = estimar_tokens(json_visual) + estimar_tokens(json_transcripcion)
+    metricas.EVIDENCIA_TOKENS.labels("antes").observe(reporte["tokens_antes"])
+    metricas.EVIDENCIA_TOKENS.labels("despues").observe(reporte["tokens_despues"])
+    return json_visual, json_transcripcion, reporte
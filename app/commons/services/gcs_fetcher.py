@@ -0,0 +1,168 @@
+import os
+import asyncio
+import functools
+import contextvars
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app.commons.services import metricas
+from app.commons.services.llm_scheduler import timeout_restante
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+
+# Tamaño del pool HTTP del cliente y del pool de hilos de descarga
+GCS_POOL_SIZE = int(os.environ.get("GCS_POOL_SIZE", "32"))
+GCS_MAX_PARALLEL_DOWNLOADS = int(os.environ.get("GCS_MAX_PARALLEL_DOWNLOADS", "8"))
+# Timeout de cada solicitud a GCS; dentro de un caso se acota además al plazo restante de la etapa
+GCS_TIMEOUT_S = float(os.environ.get("GCS_TIMEOUT_S", "60"))
+
+_client: Optional["storage.Client"] = None
+_client_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4096)
+def parse_gcs_uri(uri_gcs: str) -> Tuple[str, str]:
+    """Separa una URI gs://bucket/ruta/objeto en (bucket, objeto)."""
+    if not uri_gcs or not uri_gcs.startswith("gs://"):
+        raise ValueError(f"URI de GCS inválida: {uri_gcs}")
+    bucket_name, _, blob_name = uri_gcs[len("gs://"):].partition("/")
+    if not bucket_name or not blob_name:
+        raise ValueError(f"URI de GCS inválida: {uri_gcs}")
+    return bucket_name, blob_name
+
+
+def get_storage_client() -> "storage.Client":
+    """
+    Cliente de Storage compartido por todo el proceso.
+    Se crea una sola vez sobre una sesión autenticada propia, con un pool de
+    conexiones amplio para que las descargas concurrentes reutilicen los sockets TLS.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Importación diferida: google.cloud.storage no pesa en el arranque del proceso
+                import google.auth
+                import requests
+                from google.auth.transport.requests import AuthorizedSession
+                from google.cloud import storage
+
+                credenciales, proyecto = google.auth.default(scopes=storage.Client.SCOPE)
+                sesion = AuthorizedSession(credenciales)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=GCS_POOL_SIZE, pool_maxsize=GCS_POOL_SIZE)
+                sesion.mount("https://", adapter)
+                # Sin proyecto en las credenciales, el cliente lo resuelve como siempre (variables de entorno)
+                opciones = {"project": proyecto} if proyecto else {}
+                _client = storage.Client(credentials=credenciales, _http=sesion, **opciones)
+    return _client
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=GCS_MAX_PARALLEL_DOWNLOADS, thread_name_prefix="gcs-fetch")
+                metricas.POOL_TAMANO.labels("gcs").set(GCS_MAX_PARALLEL_DOWNLOADS)
+    return _executor
+
+
+def get_blob(uri_gcs: str) -> "storage.Blob":
+    bucket_name, blob_name = parse_gcs_uri(uri_gcs)
+    return get_storage_client().bucket(bucket_name).blob(blob_name)
+
+
+def descargar_blob(uri_gcs: str) -> bytes:
+    """Descarga un objeto de GCS con el cliente compartido."""
+    try:
+        timeout = timeout_restante(GCS_TIMEOUT_S, f"descargar {uri_gcs}")
+        with metricas.cronometro(metricas.DESCARGA_GCS_S):
+            data = get_blob(uri_gcs).download_as_bytes(timeout=timeout)
+    except Exception as e:
+        metricas.registrar_error("gcs", e)
+        raise
+    metricas.DESCARGA_GCS_BYTES.inc(len(data))
+    return data
+
+
+def en_paralelo(funcion, elementos: list, max_paralelo: Optional[int] = None) -> list:
+    """
+    Aplica `funcion` a cada elemento en el pool compartido y devuelve los resultados
+    en el mismo orden. `max_paralelo` limita las operaciones simultáneas del lote;
+    el pool global nunca supera GCS_MAX_PARALLEL_DOWNLOADS.
+    Además de las descargas, lo usan otras operaciones bloqueantes sobre evidencia ya
+    descargada (p. ej. las llamadas por fragmento de PDF); `funcion` no debe esperar
+    otro lote de este mismo pool.
+    """
+    if not elementos:
+        return []
+    if len(elementos) == 1:
+        return [funcion(elementos[0])]
+
+    limite = max(1, min(max_paralelo or GCS_MAX_PARALLEL_DOWNLOADS, len(elementos)))
+    executor = _get_executor()
+    resultados = [None] * len(elementos)
+    pendientes = list(enumerate(elementos))
+    en_vuelo = {}
+
+    # Ventana deslizante: nunca hay más de `limite` operaciones de este lote en vuelo
+    while pendientes or en_vuelo:
+        while pendientes and len(en_vuelo) < limite:
+            idx, elemento = pendientes.pop(0)
+            # Cada tarea lleva una copia del contexto: el plazo del caso llega al hilo del pool
+            en_vuelo[executor.submit(contextvars.copy_context().run, metricas.tarea_en_pool("gcs", funcion), elemento)] = idx
+        terminados, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+        for futuro in terminados:
+            resultados[en_vuelo.pop(futuro)] = futuro.result()
+
+    return resultados
+
+
+def descargar_blobs(uris_gcs: List[str], max_paralelo: Optional[int] = None) -> List[bytes]:
+    """Descarga varios objetos de GCS en paralelo, en el orden de las URIs."""
+    return en_paralelo(descargar_blob, uris_gcs, max_paralelo)
+
+
+def leer_metadatos_blob(uri_gcs: str) -> "storage.Blob":
+    """Consulta solo los metadatos del objeto (generation, md5, tamaño, content_type)."""
+    blob = get_blob(uri_gcs)
+    blob.reload(timeout=timeout_restante(GCS_TIMEOUT_S, f"consultar {uri_gcs}"))
+    return blob
+
+
+def leer_metadatos_blobs(uris_gcs: List[str], max_paralelo: Optional[int] = None) -> List["storage.Blob"]:
+    return en_paralelo(leer_metadatos_blob, uris_gcs, max_paralelo)
+
+
+async def ejecutar_en_pool_gcs(funcion, *args):
+    """
+    Ejecuta una operación bloqueante de GCS en el pool propio del fetcher,
+    sin pasar por el limitador de hilos de AnyIO que usa run_in_threadpool.
+    `funcion` no debe esperar otro lote de este mismo pool (descargar_blobs, leer_metadatos_blobs):
+    con todos los hilos ocupados así, ninguno avanzaría. Para eso está asyncio.to_thread.
+    A diferencia de to_thread, run_in_executor no propaga el contexto: se copia para que el plazo del caso llegue.
+    """
+    loop = asyncio.get_running_loop()
+    tarea = metricas.tarea_en_pool("gcs", functools.partial(funcion, *args))
+    return await loop.run_in_executor(_get_executor(), contextvars.copy_context().run, tarea)
+
+
+async def descargar_blob_async(uri_gcs: str) -> bytes:
+    return await ejecutar_en_pool_gcs(descargar_blob, uri_gcs)
+
+
+async def descargar_blobs_async(uris_gcs: List[str], max_paralelo: Optional[int] = None) -> List[bytes]:
+    """Versión asíncrona de `descargar_blobs`: mismo orden y mismo tope por lote."""
+    limite = asyncio.Semaphore(max(1, max_paralelo or GCS_MAX_PARALLEL_DOWNLOADS))
+
+    async def _descargar(uri):
+        async with limite:
+            return await descargar_blob_async(uri)
+
+    return list(await asyncio.gather(*(_descargar(uri) for uri in uris_gcs)))
@@ -0,0 +1,141 @@
+import io
+import os
+import logging
+from typing import List, Tuple
+
+
+# Normalización de las fotos antes de la extracción visual (opcional):
+#   IMAGE_PREPROCESS=1 activa la etapa
+#   IMAGE_MAX_PIXELES: presupuesto de píxeles por imagen (ancho x alto)
+#   IMAGE_CALIDAD_JPEG: calidad de la recompresión
+#   IMAGE_DISTANCIA_DUPLICADO: bits distintos (de 64) del dHash para considerar dos fotos casi iguales
+IMAGE_PREPROCESS = os.environ.get("IMAGE_PREPROCESS", "0") == "1"
+IMAGE_MAX_PIXELES = int(os.environ.get("IMAGE_MAX_PIXELES", str(1600 * 1200)))
+IMAGE_CALIDAD_JPEG = int(os.environ.get("IMAGE_CALIDAD_JPEG", "80"))
+IMAGE_DISTANCIA_DUPLICADO = int(os.environ.get("IMAGE_DISTANCIA_DUPLICADO", "6"))
+
+_LADO_HASH = 8
+_ORIENTACION_EXIF = 0x0112
+
+
+def opciones_preproceso() -> dict:
+    """Opciones vigentes; forman parte de la llave del caché de resultados."""
+    return {
+        "max_pixeles": IMAGE_MAX_PIXELES,
+        "calidad_jpeg": IMAGE_CALIDAD_JPEG,
+        "distancia_duplicado": IMAGE_DISTANCIA_DUPLICADO,
+    }
+
+
+def _abrir(data: bytes):
+    """Abre la imagen con la orientación EXIF ya aplicada; indica si hubo que rotarla."""
+    from PIL import Image, ImageOps
+
+    imagen = Image.open(io.BytesIO(data))
+    imagen.load()
+    # Las fotos de celular suelen venir rotadas por EXIF: se aplica la orientación a los píxeles
+    rotada = imagen.getexif().get(_ORIENTACION_EXIF, 1) != 1
+    return ImageOps.exif_transpose(imagen), rotada
+
+
+def normalizar_imagen(imagen, rotada: bool, data: bytes, mime: str) -> Tuple[bytes, str]:
+    """Reduce la imagen al presupuesto de píxeles y la recomprime en JPEG si resulta más liviana."""
+    from PIL import Image
+
+    original_sin_cambios = not rotada
+    ancho, alto = imagen.size
+    if ancho * alto > IMAGE_MAX_PIXELES:
+        escala = (IMAGE_MAX_PIXELES / (ancho * alto)) ** 0.5
+        imagen = imagen.resize((max(1, int(ancho * escala)), max(1, int(alto * escala))), Image.LANCZOS)
+        original_sin_cambios = False
+
+    if imagen.mode != "RGB":
+        # La transparencia se aplana sobre blanco (JPEG no la admite)
+        fondo = Image.new("RGB", imagen.size, (255, 255, 255))
+        fondo.paste(imagen, mask=imagen.getchannel("A") if "A" in imagen.getbands() else None)
+        imagen = fondo
+
+    salida = io.BytesIO()
+    imagen.save(salida, format="JPEG", quality=IMAGE_CALIDAD_JPEG, optimize=True)
+    comprimida = salida.getvalue()
+    # Una foto ya liviana y bien orientada se envía tal cual
+    if original_sin_cambios and len(comprimida) >= len(data):
+        return data, mime
+    return comprimida, "image/jpeg"
+
+
+def dhash(imagenes: list):
+    """
+    Hash perceptual por diferencias (dHash) de 64 bits de cada imagen, calculado
+    en bloque con numpy: matriz (n, 8) de uint8.
+    """
+    import numpy as np
+    from PIL import Image
+
+    miniaturas = np.stack([
+        np.asarray(imagen.convert("L").resize((_LADO_HASH + 1, _LADO_HASH), Image.BILINEAR), dtype=np.int16)
+        for imagen in imagenes
+    ])
+    bits = miniaturas[:, :, 1:] > miniaturas[:, :, :-1]
+    return np.packbits(bits.reshape(len(imagenes), -1), axis=1)
+
+
+def distancias_hamming(hashes):
+    """Distancia de Hamming entre todos los pares de hashes: matriz (n, n)."""
+    import numpy as np
+    return np.unpackbits(hashes[:, None, :] ^ hashes[None, :, :], axis=-1).sum(axis=-1)
+
+
+def indices_sin_duplicados(imagenes: list, distancia_max: int) -> List[int]:
+    """
+    Índices de las imágenes que se conservan. De cada grupo de fotos casi iguales
+    se queda la de mayor resolución; el orden original se respeta.
+    """
+    if len(imagenes) < 2:
+        return list(range(len(imagenes)))
+    distancias = distancias_hamming(dhash(imagenes))
+    por_resolucion = sorted(range(len(imagenes)), key=lambda i: imagenes[i].size[0] * imagenes[i].size[1], reverse=True)
+    conservadas = []
+    for i in por_resolucion:
+        if all(distancias[i, j] > distancia_max for j in conservadas):
+            conservadas.append(i)
+    return sorted(conservadas)
+
+
+def preprocesar_imagenes(uris_gcs: List[str], lista_bytes: List[bytes], mimes: List[str]) -> Tuple[List[Tuple[bytes, str]], dict]:
+    """
+    Normaliza las imágenes del lote y descarta las casi duplicadas. Los PDF y los
+    formatos que Pillow no puede abrir (p. ej. HEIC) se envían sin cambios.
+    Devuelve los pares (bytes, mime) a enviar y un reporte del ahorro.
+    """
+    abiertas = {}
+    for i, (uri, data, mime) in enumerate(zip(uris_gcs, lista_bytes, mimes)):
+        if not mime.startswith("image/"):
+            continue
+        try:
+            abiertas[i] = _abrir(data)
+        except Exception as e:
+            logging.warning(f"⚠️ [VISUAL_PREP] No se pudo abrir {uri} ({mime}), se envía sin cambios: {e}")
+
+    indices = list(abiertas)
+    conservadas = {indices[k] for k in indices_sin_duplicados([abiertas[i][0] for i in indices], IMAGE_DISTANCIA_DUPLICADO)}
+
+    salida = []
+    for i, (data, mime) in enumerate(zip(lista_bytes, mimes)):
+        if i not in abiertas:
+            salida.append((data, mime))
+        elif i in conservadas:
+            imagen, rotada = abiertas[i]
+            salida.append(normalizar_imagen(imagen, rotada, data, mime))
+
+    bytes_original = sum(len(data) for data in lista_bytes)
+    bytes_final = sum(len(data) for data, _ in salida)
+    reporte = {
+        "recibidas": len(lista_bytes),
+        "enviadas": len(salida),
+        "duplicadas_descartadas": len(abiertas) - len(conservadas),
+        "bytes_original": bytes_original,
+        "bytes_final": bytes_final,
+        "bytes_ahorrados": bytes_original - bytes_final,
+    }
+    return salida, reporte
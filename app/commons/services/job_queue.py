@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+from contextlib import closing
+from typing import Optional
+
+
+# Cola persistente local de casos (SQLite): no requiere broker externo y sobrevive
+# a reinicios del worker. Varios procesos uvicorn pueden compartir el mismo archivo.
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "/tmp/motor_jobs.sqlite3")
+JOBS_LEASE_S = float(os.environ.get("JOBS_LEASE_S", "120"))
+JOBS_MAX_INTENTOS = int(os.environ.get("JOBS_MAX_INTENTOS", "3"))
+
+PENDIENTE = "pendiente"
+EN_PROCESO = "en_proceso"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    case_id TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progreso TEXT NOT NULL DEFAULT '{}',
+    resultado TEXT,
+    error TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_hasta REAL,
+    creado REAL NOT NULL,
+    actualizado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_estado_creado ON jobs (estado, creado);
+"""
+
+
+class JobQueue:
+    """
+    Cola de trabajos sobre SQLite con reclamo por lease:
+    - `reclamar` toma el trabajo pendiente más antiguo, o uno en proceso cuyo lease
+      venció (worker caído o reiniciado), de forma atómica entre procesos.
+    - El worker renueva el lease mientras procesa; al agotar JOBS_MAX_INTENTOS el
+      trabajo queda fallido.
+    - Renovar, registrar progreso, completar y fallar exigen que el trabajo siga en
+      proceso a nombre del worker: un worker cuyo lease venció ya no puede escribirlo.
+    Todas las operaciones son bloqueantes y cortas: desde asyncio se llaman con to_thread.
+    """
+
+    def __init__(self, ruta: str = JOBS_DB_PATH, lease_s: float = JOBS_LEASE_S, max_intentos: int = JOBS_MAX_INTENTOS):
+        self.ruta = ruta
+        self.lease_s = lease_s
+        self.max_intentos = max_intentos
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with closing(self._conectar()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_ESQUEMA)
+
+    def _conectar(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def encolar(self, case_id: str, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        ahora = time.time()
+        with closing(self._conectar()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, case_id, estado, payload, creado, actualizado) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, case_id, PENDIENTE, json.dumps(payload, ensure_ascii=False), ahora, ahora),
+            )
+        return job_id
+
+    def reclamar(self, worker: str) -> Optional[dict]:
+        ahora = time.time()
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            fila = conn.execute(
+                "SELECT * FROM jobs WHERE estado = ? OR (estado = ? AND lease_hasta < ?) ORDER BY creado LIMIT 1",
+                (PENDIENTE, EN_PROCESO, ahora),
+            ).fetchone()
+            if fila is None:
+                conn.execute("COMMIT")
+                return None
+
+            if fila["intentos"] >= self.max_intentos:
+                conn.execute(
+                    "UPDATE jobs SET estado = ?, error = ?, worker = NULL, lease_hasta = NULL, actualizado = ? WHERE id = ?",
+                    (FALLIDO, fila["error"] or "Se agotaron los intentos (el worker se detuvo durante el proceso)", ahora, fila["id"]),
+                )
+                conn.execute("COMMIT")
+                return self.reclamar(worker)
+
+            conn.execute(
+                "UPDATE jobs SET estado = ?, worker = ?, lease_hasta = ?, intentos = intentos + 1, actualizado = ? WHERE id = ?",
+                (EN_PROCESO, worker, ahora + self.lease_s, ahora, fila["id"]),
+            )
+            conn.execute("COMMIT")
+            job = self._a_dict(fila)
+            job["intentos"] += 1
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    # Las escrituras del worker solo aplican mientras el trabajo siga siendo suyo: si su lease
+    # venció y otro worker lo reclamó, no pisan el progreso ni el resultado del nuevo dueño.
+    # Devuelven False en ese caso (el worker debe abandonar el trabajo).
+    _ES_DEL_WORKER = "id = ? AND worker = ? AND estado = ?"
+
+    def renovar(self, job_id: str, worker: str) -> bool:
+        with closing(self._conectar()) as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET lease_hasta = ? WHERE {self._ES_DEL_WORKER}",
+                (time.time() + self.lease_s, job_id, worker, EN_PROCESO),
+            )
+        return cursor.rowcount > 0
+
+    def actualizar_progreso(self, job_id: str, worker: str, progreso: dict) -> bool:
+        with closing(self._conectar()) as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET progreso = ?, actualizado = ? WHERE {self._ES_DEL_WORKER}",
+                (json.dumps(progreso, ensure_ascii=False), time.time(), job_id, worker, EN_PROCESO),
+            )
+        return cursor.rowcount > 0
+
+    def completar(self, job_id: str, worker: str, resultado: dict) -> bool:
+        with closing(self._conectar()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET estado = ?, resultado = ?, error = NULL, worker = NULL, lease_hasta = NULL, actualizado = ? "
+                f"WHERE {self._ES_DEL_WORKER}",
+                (COMPLETADO, json.dumps(resultado, ensure_ascii=False), time.time(), job_id, worker, EN_PROCESO),
+            )
+        return cursor.rowcount > 0
+
+    def fallar(self, job_id: str, worker: str, error: str) -> bool:
+        """Registra el error; el trabajo vuelve a la cola si le quedan intentos."""
+        with closing(self._conectar()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET estado = CASE WHEN intentos >= ? THEN ? ELSE ? END, error = ?, worker = NULL, "
+                f"lease_hasta = NULL, actualizado = ? WHERE {self._ES_DEL_WORKER}",
+                (self.max_intentos, FALLIDO, PENDIENTE, error, time.time(), job_id, worker, EN_PROCESO),
+            )
+        return cursor.rowcount > 0
+
+    def obtener(self, job_id: str) -> Optional[dict]:
+        with closing(self._conectar()) as conn:
+            fila = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._a_dict(fila) if fila else None
+
+    def contar_por_estado(self) -> dict:
+        with closing(self._conectar()) as conn:
+            filas = conn.execute("SELECT estado, COUNT(*) AS total FROM jobs GROUP BY estado").fetchall()
+        return {fila["estado"]: fila["total"] for fila in filas}
+
+    @staticmethod
+    def _a_dict(fila: sqlite3.Row) -> dict:
+        job = dict(fila)
+        job["payload"] = json.loads(job["payload"])
+        job["progreso"] = json.loads(job["progreso"] or "{}")
+        job["resultado"] = json.loads(job["resultado"]) if job["resultado"] else None
+        return job
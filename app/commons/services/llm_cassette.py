@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Optional, Tuple
+
+from app.commons.services.context_cache import prefijo_cacheado
+
+
+# Grabación y reproducción de las llamadas al modelo (cassette JSONL):
+#   LLM_CASSETTE=record guarda cada solicitud (huella) con su respuesta, uso de tokens y latencia
+#   LLM_CASSETTE=replay responde desde la grabación, sin llamar a Vertex ni consumir cuota
+#   LLM_CASSETTE_PATH: archivo de la grabación
+#   LLM_CASSETTE_LATENCIA=1: en replay, espera la latencia observada al grabar
+# La huella cubre modelo, parámetros de generación, texto y contenido de cada medio
+# (bytes o URI, según GEMINI_MEDIA_MODE al grabar): la evidencia debe seguir siendo legible.
+LLM_CASSETTE = os.environ.get("LLM_CASSETTE", "").strip().lower()
+LLM_CASSETTE_PATH = os.environ.get("LLM_CASSETTE_PATH", "/tmp/llm_cassette.jsonl")
+LLM_CASSETTE_LATENCIA = os.environ.get("LLM_CASSETTE_LATENCIA", "0") == "1"
+
+MODO_GRABAR = "record"
+MODO_REPRODUCIR = "replay"
+
+
+class CassetteSinGrabacion(Exception):
+    """La solicitud no está en la grabación (cambió el prompt, la evidencia o los parámetros)."""
+
+
+def _actualizar_con_parte(h, parte):
+    if isinstance(parte, str):
+        h.update(b"texto\0" + parte.encode("utf-8"))
+        return
+    raw = getattr(parte, "_raw_part", None)
+    if raw is None:
+        h.update(b"otro\0" + repr(parte).encode("utf-8"))
+    elif raw.inline_data.data:
+        # Se resume el contenido: la huella no crece con el tamaño del medio
+        h.update(b"bytes\0" + raw.inline_data.mime_type.encode() + hashlib.sha256(raw.inline_data.data).digest())
+    elif raw.file_data.file_uri:
+        h.update(b"uri\0" + raw.file_data.mime_type.encode() + raw.file_data.file_uri.encode())
+    else:
+        h.update(b"texto\0" + raw.text.encode("utf-8"))
+    h.update(b"\0")
+
+
+def huella_solicitud(model_name: str, model, contents, generation_config: dict) -> str:
+    """
+    Identidad de la solicitud. Un modelo enlazado a un prefijo en el caché de contexto
+    produce la misma huella que el prompt completo, así la grabación sirve con o sin caché.
+    """
+    h = hashlib.sha256()
+    h.update(model_name.encode() + b"\0")
+    h.update(json.dumps(generation_config or {}, sort_keys=True, default=str).encode() + b"\0")
+    partes = contents if isinstance(contents, list) else [contents]
+    prefijo = prefijo_cacheado(model)
+    if prefijo and partes and isinstance(partes[0], str):
+        partes = [prefijo + partes[0], *partes[1:]]
+    for parte in partes:
+        _actualizar_con_parte(h, parte)
+    return h.hexdigest()
+
+
+def _uso_a_dict(respuesta) -> Optional[dict]:
+    uso = getattr(respuesta, "usage_metadata", None)
+    if uso is None:
+        return None
+    return {
+        "prompt_token_count": getattr(uso, "prompt_token_count", 0) or 0,
+        "candidates_token_count": getattr(uso, "candidates_token_count", 0) or 0,
+        "total_token_count": getattr(uso, "total_token_count", 0) or 0,
+    }
+
+
+class Cassette:
+    """
+    Archivo JSONL de interacciones con el modelo. Una misma huella puede tener varias
+    grabaciones (solicitudes repetidas): en replay se entregan en el orden grabado y
+    luego se repite la última.
+    """
+
+    def __init__(self, ruta: str, modo: str, con_latencia: bool):
+        self.ruta = ruta
+        self.modo = modo if modo in (MODO_GRABAR, MODO_REPRODUCIR) else ""
+        self.con_latencia = con_latencia
+        self._lock = threading.Lock()
+        self._grabaciones = None
+        self._entregadas = {}
+        self._stats = {"grabadas": 0, "reproducidas": 0, "sin_grabacion": 0}
+
+    @property
+    def activo(self) -> bool:
+        return bool(self.modo)
+
+    @property
+    def grabando(self) -> bool:
+        return self.modo == MODO_GRABAR
+
+    @property
+    def reproduciendo(self) -> bool:
+        return self.modo == MODO_REPRODUCIR
+
+    def grabar(self, huella: str, model_name: str, respuesta, latencia_s: float):
+        registro = {
+            "huella": huella,
+            "modelo": model_name,
+            "texto": respuesta.text,
+            "uso": _uso_a_dict(respuesta),
+            "latencia_s": round(latencia_s, 4),
+            "grabado": time.time(),
+        }
+        linea = json.dumps(registro, ensure_ascii=False) + "\n"
+        with self._lock:
+            directorio = os.path.dirname(self.ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            with open(self.ruta, "a", encoding="utf-8") as file:
+                file.write(linea)
+            self._stats["grabadas"] += 1
+
+    def _cargar(self):
+        grabaciones = {}
+        if os.path.exists(self.ruta):
+            with open(self.ruta, "r", encoding="utf-8") as file:
+                for linea in file:
+                    try:
+                        registro = json.loads(linea)
+                    except ValueError:
+                        continue  # última línea truncada por una interrupción
+                    grabaciones.setdefault(registro["huella"], []).append(registro)
+        total = sum(len(v) for v in grabaciones.values())
+        print(f"📼 [CASSETTE] {total} respuestas cargadas de {self.ruta}", flush=True)
+        return grabaciones
+
+    def reproducir(self, huella: str) -> Tuple[SimpleNamespace, float]:
+        """Respuesta grabada para la huella y los segundos que hay que esperar antes de entregarla."""
+        with self._lock:
+            if self._grabaciones is None:
+                self._grabaciones = self._cargar()
+            registros = self._grabaciones.get(huella)
+            if not registros:
+                self._stats["sin_grabacion"] += 1
+                raise CassetteSinGrabacion(f"Solicitud {huella[:12]} no está en {self.ruta}")
+            indice = self._entregadas.get(huella, 0)
+            self._entregadas[huella] = indice + 1
+            self._stats["reproducidas"] += 1
+        registro = registros[min(indice, len(registros) - 1)]
+        uso = SimpleNamespace(**registro["uso"]) if registro.get("uso") else None
+        respuesta = SimpleNamespace(text=registro["texto"], usage_metadata=uso)
+        return respuesta, (registro.get("latencia_s", 0.0) if self.con_latencia else 0.0)
+
+    def estadisticas(self) -> dict:
+        return {"modo": self.modo or "desactivado", "ruta": self.ruta, **self._stats}
+
+
+cassette = Cassette(LLM_CASSETTE_PATH, LLM_CASSETTE, LLM_CASSETTE_LATENCIA)
+if LLM_CASSETTE and not cassette.activo:
+    logging.warning(f"⚠️ [CASSETTE] LLM_CASSETTE={LLM_CASSETTE!r} no es 'record' ni 'replay': se ignora")
@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Optional
+
+from app.commons.services import metricas
+from app.commons.services.estadistica import percentil
+
+
+# Solicitudes duplicadas (hedging) para recortar la cola de latencia de Vertex (opcional, solo async):
+#   LLM_HEDGE=1 activa el hedging: si un intento no respondió al superar el umbral se envía un duplicado,
+#   gana la primera respuesta y la otra se cancela
+#   LLM_HEDGE_PERCENTIL: percentil de la latencia reciente (por modelo y modalidad) usado como umbral
+#   LLM_HEDGE_PRESUPUESTO: fracción máxima de llamadas extra sobre las primarias (0.05 = 5%)
+#   LLM_HEDGE_MIN_MUESTRAS: latencias observadas necesarias antes de duplicar
+#   LLM_HEDGE_VENTANA: latencias recientes que se conservan por modelo y modalidad
+#   LLM_HEDGE_UMBRAL_MIN_S: umbral mínimo (evita duplicar llamadas que ya son rápidas)
+#   LLM_HEDGE_MODALIDADES: modalidades en las que se duplica (las de extracción por defecto)
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTIL = float(os.environ.get("LLM_HEDGE_PERCENTIL", "0.9"))
+LLM_HEDGE_PRESUPUESTO = float(os.environ.get("LLM_HEDGE_PRESUPUESTO", "0.05"))
+LLM_HEDGE_MIN_MUESTRAS = int(os.environ.get("LLM_HEDGE_MIN_MUESTRAS", "20"))
+LLM_HEDGE_VENTANA = int(os.environ.get("LLM_HEDGE_VENTANA", "200"))
+LLM_HEDGE_UMBRAL_MIN_S = float(os.environ.get("LLM_HEDGE_UMBRAL_MIN_S", "1.0"))
+LLM_HEDGE_MODALIDADES = {
+    m.strip() for m in os.environ.get("LLM_HEDGE_MODALIDADES", "audio,visual,video").split(",") if m.strip()
+}
+
+
+class Hedger:
+    """
+    Decide cuándo duplicar un intento de llamada al modelo.
+    - El umbral es el percentil de las latencias recientes del modelo en esa modalidad.
+    - Un duplicado solo sale si no supera el presupuesto de llamadas extra y si la
+      cuota del modelo lo cubre sin esperar (duplicar bajo presión de cuota empeora la cola).
+    - Gana la primera respuesta correcta; el intento perdedor se cancela.
+    """
+
+    def __init__(self, activo: bool, percentil_umbral: float, presupuesto: float,
+                 min_muestras: int, ventana: int, umbral_min_s: float, modalidades: set):
+        self.activo = activo
+        self.percentil = percentil_umbral
+        self.presupuesto = presupuesto
+        self.min_muestras = min_muestras
+        self.ventana = ventana
+        self.umbral_min_s = umbral_min_s
+        self.modalidades = modalidades
+        self._lock = threading.Lock()
+        self._latencias = {}
+        self._stats = {
+            "primarias": 0, "disparadas": 0, "ganadas": 0,
+            "sin_presupuesto": 0, "sin_cuota": 0,
+        }
+
+    def aplica(self, modalidad: str) -> bool:
+        return self.activo and modalidad in self.modalidades
+
+    def observar(self, model_name: str, modalidad: str, latencia_s: float):
+        with self._lock:
+            muestras = self._latencias.get((model_name, modalidad))
+            if muestras is None:
+                muestras = self._latencias[(model_name, modalidad)] = deque(maxlen=self.ventana)
+            muestras.append(latencia_s)
+
+    def umbral(self, model_name: str, modalidad: str) -> Optional[float]:
+        """Segundos tras los que se duplica el intento; None mientras no haya muestras suficientes."""
+        with self._lock:
+            muestras = list(self._latencias.get((model_name, modalidad), ()))
+        if len(muestras) < self.min_muestras:
+            return None
+        return max(self.umbral_min_s, percentil(muestras, self.percentil))
+
+    def _autorizar(self, limites, tokens_estimados: int) -> bool:
+        with self._lock:
+            if self._stats["disparadas"] + 1 > self.presupuesto * self._stats["primarias"]:
+                self._stats["sin_presupuesto"] += 1
+                return False
+        if limites.reservar(tokens_estimados) > 0:
+            limites.cancelar(tokens_estimados)
+            with self._lock:
+                self._stats["sin_cuota"] += 1
+            return False
+        with self._lock:
+            self._stats["disparadas"] += 1
+        return True
+
+    async def ejecutar_async(self, model_name: str, modalidad: str, intento, limites, tokens_estimados: int):
+        """
+        Ejecuta `intento` (corrutina sin argumentos) con un posible duplicado.
+        Se aplica por intento, dentro del scheduler: la espera de cuota y el backoff no cuentan
+        para el umbral, y un error del intento ganador sigue el camino normal de reintentos.
+        """
+        with self._lock:
+            self._stats["primarias"] += 1
+        t_inicio = time.perf_counter()
+        primaria = asyncio.ensure_future(intento())
+        umbral = self.umbral(model_name, modalidad)
+        if umbral is not None:
+            try:
+                hechas, _ = await asyncio.wait({primaria}, timeout=umbral)
+            except asyncio.CancelledError:
+                # asyncio.wait no cancela lo que espera: el caso se canceló y el intento no debe quedar huérfano
+                primaria.cancel()
+                raise
+            if not hechas and self._autorizar(limites, tokens_estimados):
+                metricas.HEDGES_LLM.labels(model_name, modalidad, "disparada").inc()
+                print(f"🪞 [HEDGE:{model_name}] {modalidad} sin respuesta tras {umbral:.1f}s, se envía un duplicado", flush=True)
+                return await self._carrera(model_name, modalidad, intento, primaria, limites, tokens_estimados, t_inicio)
+            elif not hechas:
+                metricas.HEDGES_LLM.labels(model_name, modalidad, "denegada").inc()
+
+        respuesta = await primaria
+        self.observar(model_name, modalidad, time.perf_counter() - t_inicio)
+        return respuesta
+
+    async def _carrera(self, model_name, modalidad, intento, primaria, limites, tokens_estimados, t_inicio):
+        t_duplicado = time.perf_counter()
+        duplicado = asyncio.ensure_future(self._intento_duplicado(intento, limites, tokens_estimados))
+        pendientes = {primaria, duplicado}
+        error = None
+        try:
+            while pendientes:
+                hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in hechas:
+                    if tarea.exception() is not None:
+                        error = tarea.exception()
+                        continue
+                    gano_duplicado = tarea is duplicado
+                    if gano_duplicado:
+                        with self._lock:
+                            self._stats["ganadas"] += 1
+                        metricas.HEDGES_LLM.labels(model_name, modalidad, "ganada").inc()
+                    inicio = t_duplicado if gano_duplicado else t_inicio
+                    self.observar(model_name, modalidad, time.perf_counter() - inicio)
+                    return tarea.result()
+            raise error
+        finally:
+            for tarea in pendientes:
+                tarea.cancel()
+
+    @staticmethod
+    async def _intento_duplicado(intento, limites, tokens_estimados: int):
+        # La cuota ya se reservó al autorizar; se corrige con el consumo real como en el scheduler
+        respuesta = await intento()
+        limites.registrar_consumo(tokens_estimados, respuesta)
+        return respuesta
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            llaves = list(self._latencias)
+        umbrales = {}
+        for model_name, modalidad in llaves:
+            umbral = self.umbral(model_name, modalidad)
+            umbrales[f"{model_name}/{modalidad}"] = round(umbral, 3) if umbral is not None else None
+        extra = stats["disparadas"] / stats["primarias"] if stats["primarias"] else 0.0
+        return {
+            "activo": self.activo,
+            **stats,
+            "fraccion_extra": round(extra, 4),
+            "tasa_victoria": round(stats["ganadas"] / stats["disparadas"], 4) if stats["disparadas"] else 0.0,
+            "umbrales_s": umbrales,
+        }
+
+
+hedger = Hedger(
+    LLM_HEDGE,
+    percentil_umbral=LLM_HEDGE_PERCENTIL,
+    presupuesto=LLM_HEDGE_PRESUPUESTO,
+    min_muestras=LLM_HEDGE_MIN_MUESTRAS,
+    ventana=LLM_HEDGE_VENTANA,
+    umbral_min_s=LLM_HEDGE_UMBRAL_MIN_S,
+    modalidades=LLM_HEDGE_MODALIDADES,
+)
@@ -0,0 +1,125 @@
+import os
+import time
+import asyncio
+import threading
+
+from app.commons.services import metricas
+from app.commons.services.llm_cassette import cassette, huella_solicitud
+from app.commons.services.llm_hedging import hedger
+from app.commons.services.llm_scheduler import scheduler, estimar_tokens, timeout_restante, PresupuestoAgotado
+
+
+# Límite de llamadas simultáneas en vuelo por modelo dentro del proceso.
+#   LLM_MAX_CONCURRENCY: valor por defecto para todos los modelos
+#   LLM_MAX_CONCURRENCY_<MODELO>: por modelo, p. ej. LLM_MAX_CONCURRENCY_GEMINI_2_5_PRO
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "256"))
+
+_semaforos = {}
+_semaforos_lock = threading.Lock()
+
+
+def nombre_modelo(model) -> str:
+    # Los modelos enlazados a contenido cacheado traen el nombre completo del recurso
+    nombre = getattr(model, "_model_name", None) or type(model).__name__
+    return nombre.split("/")[-1]
+
+
+def limite_concurrencia(model_name: str) -> int:
+    variable = "LLM_MAX_CONCURRENCY_" + "".join(c if c.isalnum() else "_" for c in model_name).upper()
+    return int(os.environ.get(variable, LLM_MAX_CONCURRENCY))
+
+
+def _semaforo(model_name: str) -> asyncio.Semaphore:
+    # Los semáforos de asyncio pertenecen a un event loop: se indexan por loop y modelo
+    llave = (id(asyncio.get_running_loop()), model_name)
+    semaforo = _semaforos.get(llave)
+    if semaforo is None:
+        with _semaforos_lock:
+            semaforo = _semaforos.setdefault(llave, asyncio.Semaphore(limite_concurrencia(model_name)))
+    return semaforo
+
+
+def invocar_modelo(model, contents, generation_config: dict, labels: dict):
+    """
+    Llamada bloqueante al modelo (scripts y jobs), con cuota y reintentos del scheduler.
+    Con LLM_CASSETTE=replay la respuesta sale de la grabación, sin cuota ni red.
+    """
+    model_name = nombre_modelo(model)
+    huella = huella_solicitud(model_name, model, contents, generation_config) if cassette.activo else None
+
+    def _intento():
+        metricas.LLM_EN_VUELO.labels(model_name).inc()
+        t_inicio = time.perf_counter()
+        try:
+            respuesta = model.generate_content(contents, generation_config=generation_config, labels=labels)
+        finally:
+            metricas.LLM_EN_VUELO.labels(model_name).dec()
+        if cassette.grabando:
+            cassette.grabar(huella, model_name, respuesta, time.perf_counter() - t_inicio)
+        return respuesta
+
+    try:
+        with metricas.cronometro(metricas.LLAMADA_LLM_S, model_name, metricas.modalidad_actual()):
+            if cassette.reproduciendo:
+                respuesta, espera = cassette.reproducir(huella)
+                time.sleep(espera)
+            else:
+                respuesta = scheduler.ejecutar(model_name, _intento, estimar_tokens(contents))
+    except Exception as e:
+        metricas.registrar_error("llm", e)
+        raise
+    metricas.registrar_tokens(model_name, respuesta)
+    return respuesta
+
+
+async def invocar_modelo_async(model, contents, generation_config: dict, labels: dict):
+    """
+    Llamada nativa asíncrona al modelo. No ocupa un hilo mientras espera la
+    respuesta; el número de llamadas en vuelo por modelo se acota con un semáforo
+    que solo se ocupa durante cada intento (no durante las esperas de cuota o backoff).
+    Con LLM_HEDGE=1 cada intento puede duplicarse si tarda más que la latencia habitual.
+    """
+    model_name = nombre_modelo(model)
+    huella = huella_solicitud(model_name, model, contents, generation_config) if cassette.activo else None
+    # Latencia de cada intento que respondió. Con hedging pueden responder la primaria y el
+    # duplicado: solo se graba en el cassette la respuesta que se devuelve, una vez
+    latencias = {}
+
+    async def _intento():
+        async with _semaforo(model_name):
+            # Plazo de la etapa del caso: al vencer se cancela la llamada y se libera el cupo del semáforo
+            timeout = timeout_restante(motivo=f"llamar a {model_name}")
+            metricas.LLM_EN_VUELO.labels(model_name).inc()
+            t_inicio = time.perf_counter()
+            try:
+                respuesta = await asyncio.wait_for(
+                    model.generate_content_async(contents, generation_config=generation_config, labels=labels), timeout
+                )
+            except asyncio.TimeoutError:
+                raise PresupuestoAgotado(f"{model_name} no respondió dentro del plazo del caso ({timeout:.1f}s)")
+            finally:
+                metricas.LLM_EN_VUELO.labels(model_name).dec()
+        latencias[id(respuesta)] = time.perf_counter() - t_inicio
+        return respuesta
+
+    modalidad = metricas.modalidad_actual()
+    tokens = estimar_tokens(contents)
+    llamada = _intento
+    if hedger.aplica(modalidad):
+        async def llamada():
+            return await hedger.ejecutar_async(model_name, modalidad, _intento, scheduler.limites(model_name), tokens)
+
+    try:
+        with metricas.cronometro(metricas.LLAMADA_LLM_S, model_name, modalidad):
+            if cassette.reproduciendo:
+                respuesta, espera = cassette.reproducir(huella)
+                await asyncio.sleep(espera)
+            else:
+                respuesta = await scheduler.ejecutar_async(model_name, llamada, tokens)
+                if cassette.grabando:
+                    await asyncio.to_thread(cassette.grabar, huella, model_name, respuesta, latencias[id(respuesta)])
+    except Exception as e:
+        metricas.registrar_error("llm", e)
+        raise
+    metricas.registrar_tokens(model_name, respuesta)
+    return respuesta
@@ -1,6 +1,4 @@
-import vertexai
 import time
-from vertexai.generative_models import GenerativeModel
 from app.commons.services.miscelaneous import load_llm_parameters
 
 
@@ -10,6 +8,10 @@ def load_llms():
     Se usa print para mayor velocidad de log en GCP.
     """
     t_init = time.perf_counter()
+    # Importación diferida: el SDK de Vertex es el módulo más pesado del arranque
+    import vertexai
+    from vertexai.generative_models import GenerativeModel
+
     PROJECT_ID = "sb-iapatrimoniales-dev"
     LOCATION = "us-central1"
 
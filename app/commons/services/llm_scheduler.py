@@ -0,0 +1,279 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from typing import Optional
+
+from functools import lru_cache
+
+from app.commons.services import metricas
+from app.commons.services.miscelaneous import load_llm_parameters
+
+
+# Reintentos ante cuota agotada / servicio no disponible en Vertex
+LLM_MAX_REINTENTOS = int(os.environ.get("LLM_MAX_REINTENTOS", "5"))
+LLM_BACKOFF_BASE_S = float(os.environ.get("LLM_BACKOFF_BASE_S", "1.0"))
+LLM_BACKOFF_MAX_S = float(os.environ.get("LLM_BACKOFF_MAX_S", "32.0"))
+
+# Tokens que se reservan por cada parte de medio (audio, imagen, video, PDF) al
+# estimar el consumo de una solicitud antes de enviarla; se corrige con usage_metadata.
+TOKENS_ESTIMADOS_POR_MEDIO = int(os.environ.get("LLM_TOKENS_ESTIMADOS_POR_MEDIO", "2000"))
+
+
+@lru_cache(maxsize=1)
+def errores_reintentables() -> tuple:
+    # google.api_core se importa al primer error: no pesa en el arranque del proceso
+    from google.api_core import exceptions as gapi_exceptions
+    return (
+        gapi_exceptions.ResourceExhausted,     # 429 / RESOURCE_EXHAUSTED
+        gapi_exceptions.TooManyRequests,
+        gapi_exceptions.ServiceUnavailable,    # 503
+        gapi_exceptions.InternalServerError,   # 500
+        gapi_exceptions.GatewayTimeout,        # 504
+    )
+
+
+_deadline_caso: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline_caso", default=None)
+
+
+class PresupuestoAgotado(Exception):
+    """El caso no tiene tiempo restante para esperar cuota o reintentar."""
+
+
+def fijar_deadline_caso(segundos: float):
+    """Fija el deadline del caso en el contexto actual (se hereda en las tareas asyncio)."""
+    return _deadline_caso.set(time.monotonic() + segundos)
+
+
+def limpiar_deadline_caso(token):
+    _deadline_caso.reset(token)
+
+
+def acotar_deadline(segundos: float):
+    """
+    Fija el plazo de una etapa del caso: el menor entre el deadline vigente y `segundos`
+    desde ahora. Se deshace con `limpiar_deadline_caso`.
+    """
+    limite = time.monotonic() + segundos
+    deadline = _deadline_caso.get()
+    return _deadline_caso.set(limite if deadline is None else min(deadline, limite))
+
+
+def tiempo_restante() -> Optional[float]:
+    deadline = _deadline_caso.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def timeout_restante(maximo: Optional[float] = None, motivo: str = "continuar") -> Optional[float]:
+    """
+    Timeout para una operación de red: el tiempo restante del caso, acotado por `maximo`.
+    Si el plazo ya venció lanza PresupuestoAgotado sin iniciar la operación.
+    """
+    restante = tiempo_restante()
+    if restante is None:
+        return maximo
+    if restante <= 0:
+        raise PresupuestoAgotado(f"Sin presupuesto de tiempo del caso para {motivo}")
+    return restante if maximo is None else min(maximo, restante)
+
+
+class TokenBucket:
+    """
+    Cubeta de tokens con reserva anticipada: `reservar` descuenta siempre y
+    devuelve cuánto hay que esperar para que la reserva quede cubierta.
+    """
+
+    def __init__(self, capacidad: float, tasa_por_s: float):
+        self.capacidad = capacidad
+        self.tasa_por_s = tasa_por_s
+        self._disponibles = capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _rellenar(self, ahora: float):
+        self._disponibles = min(self.capacidad, self._disponibles + (ahora - self._ultimo) * self.tasa_por_s)
+        self._ultimo = ahora
+
+    def reservar(self, cantidad: float) -> float:
+        with self._lock:
+            self._rellenar(time.monotonic())
+            self._disponibles -= min(cantidad, self.capacidad)
+            if self._disponibles >= 0:
+                return 0.0
+            return -self._disponibles / self.tasa_por_s
+
+    def devolver(self, cantidad: float):
+        with self._lock:
+            self._rellenar(time.monotonic())
+            self._disponibles = min(self.capacidad, self._disponibles + cantidad)
+
+    def ajustar(self, diferencia: float):
+        """Corrige una reserva con el consumo real (positivo = se consumió más de lo estimado)."""
+        if diferencia > 0:
+            self.reservar(diferencia)
+        elif diferencia < 0:
+            self.devolver(-diferencia)
+
+
+class LimitesModelo:
+    """Límites de un modelo (RPM y TPM) leídos de `rate_limits` en llm_parameters.json."""
+
+    def __init__(self, model_name: str):
+        limites = load_llm_parameters(model_name).get("rate_limits", {})
+        rpm = limites.get("requests_per_minute")
+        tpm = limites.get("tokens_per_minute")
+        self.solicitudes = TokenBucket(rpm, rpm / 60.0) if rpm else None
+        self.tokens = TokenBucket(tpm, tpm / 60.0) if tpm else None
+
+    def reservar(self, tokens: int) -> float:
+        espera = 0.0
+        if self.solicitudes:
+            espera = max(espera, self.solicitudes.reservar(1))
+        if self.tokens:
+            espera = max(espera, self.tokens.reservar(tokens))
+        return espera
+
+    def cancelar(self, tokens: int):
+        if self.solicitudes:
+            self.solicitudes.devolver(1)
+        if self.tokens:
+            self.tokens.devolver(tokens)
+
+    def registrar_consumo(self, estimados: int, respuesta):
+        uso = getattr(respuesta, "usage_metadata", None)
+        reales = getattr(uso, "total_token_count", None) if uso is not None else None
+        if self.tokens and reales:
+            self.tokens.ajustar(reales - estimados)
+
+
+def estimar_tokens(contents) -> int:
+    """Estimación gruesa de tokens de entrada (≈4 caracteres por token de texto)."""
+    partes = contents if isinstance(contents, list) else [contents]
+    total = 0
+    for parte in partes:
+        if isinstance(parte, str):
+            total += len(parte) // 4
+        else:
+            try:
+                total += len(parte.text) // 4
+            except (AttributeError, TypeError):
+                # Parte de medio (inline_data / file_data)
+                total += TOKENS_ESTIMADOS_POR_MEDIO
+    return max(total, 1)
+
+
+def pista_reintento(error: Exception) -> Optional[float]:
+    """Segundos de espera sugeridos por el servidor (RetryInfo, Retry-After o mensaje)."""
+    for detalle in getattr(error, "details", None) or []:
+        retry_delay = getattr(detalle, "retry_delay", None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+
+    respuesta = getattr(error, "response", None)
+    cabeceras = getattr(respuesta, "headers", None) or {}
+    if "Retry-After" in cabeceras:
+        try:
+            return float(cabeceras["Retry-After"])
+        except ValueError:
+            pass
+
+    coincidencia = re.search(r"retry (?:after|in) (\d+(?:\.\d+)?)\s*s", str(error), re.IGNORECASE)
+    if coincidencia:
+        return float(coincidencia.group(1))
+    return None
+
+
+class ModelScheduler:
+    """
+    Planificador central de llamadas a Gemini:
+    - espera cuota en las cubetas RPM/TPM del modelo antes de enviar,
+    - reintenta 429/5xx con backoff exponencial con jitter respetando la pista del servidor,
+    - nunca espera más allá del deadline del caso (`fijar_deadline_caso`).
+    """
+
+    def __init__(self):
+        self._limites = {}
+        self._lock = threading.Lock()
+
+    def limites(self, model_name: str) -> LimitesModelo:
+        limites = self._limites.get(model_name)
+        if limites is None:
+            with self._lock:
+                limites = self._limites.setdefault(model_name, LimitesModelo(model_name))
+        return limites
+
+    @staticmethod
+    def _espera_reintento(intento: int, error: Exception) -> float:
+        backoff = random.uniform(0, min(LLM_BACKOFF_MAX_S, LLM_BACKOFF_BASE_S * (2 ** intento)))
+        pista = pista_reintento(error)
+        return max(backoff, pista) if pista is not None else backoff
+
+    @staticmethod
+    def _verificar_presupuesto(espera: float, motivo: str, error: Optional[Exception] = None):
+        restante = tiempo_restante()
+        if restante is not None and espera >= restante:
+            mensaje = f"Sin presupuesto de tiempo del caso para {motivo} ({espera:.1f}s > {max(restante, 0):.1f}s)"
+            if error is not None:
+                raise PresupuestoAgotado(f"{mensaje}: {error}") from error
+            raise PresupuestoAgotado(mensaje)
+
+    def ejecutar(self, model_name: str, llamada, tokens_estimados: int):
+        limites = self.limites(model_name)
+        intento = 0
+        while True:
+            espera = limites.reservar(tokens_estimados)
+            if espera > 0:
+                try:
+                    self._verificar_presupuesto(espera, "esperar cuota")
+                except PresupuestoAgotado:
+                    limites.cancelar(tokens_estimados)
+                    raise
+                time.sleep(espera)
+            try:
+                respuesta = llamada()
+                limites.registrar_consumo(tokens_estimados, respuesta)
+                return respuesta
+            except errores_reintentables() as e:
+                if intento >= LLM_MAX_REINTENTOS:
+                    raise
+                espera = self._espera_reintento(intento, e)
+                self._verificar_presupuesto(espera, "reintentar", e)
+                metricas.REINTENTOS_LLM.labels(model_name, type(e).__name__).inc()
+                logging.warning(f"🔁 [{model_name}] {type(e).__name__}, reintento {intento + 1} en {espera:.1f}s")
+                time.sleep(espera)
+                intento += 1
+
+    async def ejecutar_async(self, model_name: str, llamada, tokens_estimados: int):
+        limites = self.limites(model_name)
+        intento = 0
+        while True:
+            espera = limites.reservar(tokens_estimados)
+            if espera > 0:
+                try:
+                    self._verificar_presupuesto(espera, "esperar cuota")
+                except PresupuestoAgotado:
+                    limites.cancelar(tokens_estimados)
+                    raise
+                await asyncio.sleep(espera)
+            try:
+                respuesta = await llamada()
+                limites.registrar_consumo(tokens_estimados, respuesta)
+                return respuesta
+            except errores_reintentables() as e:
+                if intento >= LLM_MAX_REINTENTOS:
+                    raise
+                espera = self._espera_reintento(intento, e)
+                self._verificar_presupuesto(espera, "reintentar", e)
+                metricas.REINTENTOS_LLM.labels(model_name, type(e).__name__).inc()
+                logging.warning(f"🔁 [{model_name}] {type(e).__name__}, reintento {intento + 1} en {espera:.1f}s")
+                await asyncio.sleep(espera)
+                intento += 1
+
+
+scheduler = ModelScheduler()
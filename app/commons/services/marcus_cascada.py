@@ -0,0 +1,105 @@
+import os
+from typing import Any, List, Optional
+
+
+# Cascada Flash -> Pro para la adjudicación Marcus (opcional):
+#   MARCUS_CASCADA=1 activa la cascada: Flash adjudica primero y el caso pasa a Pro solo si hace falta
+#   MARCUS_CASCADA_CONFIANZA_MIN: confianza mínima (global y nivel de certeza por vehículo) que se acepta de Flash
+#   MARCUS_CASCADA_IMPACTO_MAX: impacto máximo de las inconsistencias críticas que se acepta de Flash
+#   MARCUS_CASCADA_ACEPTAR_COMPARTIDA=1: acepta de Flash las responsabilidades compartidas (por defecto se escalan)
+MARCUS_CASCADA = os.environ.get("MARCUS_CASCADA", "0") == "1"
+MARCUS_CASCADA_CONFIANZA_MIN = os.environ.get("MARCUS_CASCADA_CONFIANZA_MIN", "alta").strip().lower()
+MARCUS_CASCADA_IMPACTO_MAX = os.environ.get("MARCUS_CASCADA_IMPACTO_MAX", "menor").strip().lower()
+MARCUS_CASCADA_ACEPTAR_COMPARTIDA = os.environ.get("MARCUS_CASCADA_ACEPTAR_COMPARTIDA", "0") == "1"
+
+# Escalas del esquema de salida del prompt de Marcus, de menor a mayor
+NIVELES_CONFIANZA = ["muy_baja", "baja", "media", "alta", "muy_alta"]
+NIVELES_IMPACTO = ["ninguno", "menor", "moderado", "significativo"]
+COHERENCIA_CONFLICTIVA = {"inconsistencias_significativas", "contradictorio"}
+_SIN_CIRCUNSTANCIA = {"", "null", "none", "n/a", "indeterminable", "indeterminado", "no_identificable"}
+
+
+def opciones_cascada() -> dict:
+    return {
+        "confianza_min": MARCUS_CASCADA_CONFIANZA_MIN,
+        "impacto_max": MARCUS_CASCADA_IMPACTO_MAX,
+        "aceptar_compartida": MARCUS_CASCADA_ACEPTAR_COMPARTIDA,
+    }
+
+
+def nivel_en_escala(valor: Any, escala: List[str]) -> Optional[int]:
+    """Posición del valor en la escala ('alta 85-95%' -> índice de 'alta'); None si no se reconoce."""
+    if not isinstance(valor, str) or not valor.strip():
+        return None
+    token = valor.strip().lower().split()[0].rstrip(",.;")
+    return escala.index(token) if token in escala else None
+
+
+def _porcentaje(valor: Any) -> Optional[float]:
+    try:
+        return float(str(valor).strip().rstrip("%"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _es_error(resultado: Any) -> bool:
+    # Forma con la que Procesar_circunstancias reporta JSON inválido o fallos de la llamada
+    return isinstance(resultado, dict) and "error" in resultado and set(resultado) <= {"error", "raw"}
+
+
+def motivos_escalamiento(resultado: Any) -> List[str]:
+    """
+    Razones para no aceptar la adjudicación de Flash. Lista vacía: Flash decide.
+    Se escala ante JSON inválido, confianza o certeza por debajo del mínimo, falta de
+    circunstancia para algún vehículo, conflicto entre vehículos (responsabilidad
+    indeterminada o compartida, porcentajes que no cuadran con la determinación)
+    y fuentes contradictorias.
+    """
+    if not isinstance(resultado, dict) or _es_error(resultado):
+        return ["json_invalido"]
+
+    motivos = []
+    confianza_min = NIVELES_CONFIANZA.index(MARCUS_CASCADA_CONFIANZA_MIN) if MARCUS_CASCADA_CONFIANZA_MIN in NIVELES_CONFIANZA else 3
+    impacto_max = NIVELES_IMPACTO.index(MARCUS_CASCADA_IMPACTO_MAX) if MARCUS_CASCADA_IMPACTO_MAX in NIVELES_IMPACTO else 1
+    conclusion = resultado.get("conclusion_general_del_caso") or {}
+
+    confianza = nivel_en_escala(conclusion.get("confianza_decision_global"), NIVELES_CONFIANZA)
+    if confianza is None or confianza < confianza_min:
+        motivos.append("confianza_global_baja")
+
+    vehiculos = resultado.get("analisis_por_vehiculo") or {}
+    if not isinstance(vehiculos, dict) or not vehiculos:
+        motivos.append("sin_analisis_por_vehiculo")
+        vehiculos = {}
+    for nombre, analisis in vehiculos.items():
+        analisis = analisis if isinstance(analisis, dict) else {}
+        certeza = nivel_en_escala((analisis.get("justificacion_asignacion") or {}).get("nivel_certeza"), NIVELES_CONFIANZA)
+        if certeza is None or certeza < confianza_min:
+            motivos.append(f"certeza_baja_{nombre}")
+        circunstancia = (analisis.get("circunstancia_marcus") or {}).get("id")
+        if circunstancia is None or str(circunstancia).strip().lower() in _SIN_CIRCUNSTANCIA:
+            motivos.append(f"sin_circunstancia_{nombre}")
+
+    determinacion = str(conclusion.get("determinacion_responsabilidad_primaria") or "").strip().lower()
+    if not determinacion or determinacion.startswith("indeterminada"):
+        motivos.append("responsabilidad_indeterminada")
+    elif determinacion.startswith("compartida") and not MARCUS_CASCADA_ACEPTAR_COMPARTIDA:
+        motivos.append("responsabilidad_compartida")
+
+    porcentajes = conclusion.get("porcentaje_responsabilidad") or {}
+    a, b = _porcentaje(porcentajes.get("vehiculo_a")), _porcentaje(porcentajes.get("vehiculo_b"))
+    if a is not None and b is not None:
+        if abs(a + b - 100) > 1:
+            motivos.append("porcentajes_no_suman_100")
+        elif (determinacion == "vehiculo_a" and a <= b) or (determinacion == "vehiculo_b" and b <= a):
+            motivos.append("porcentajes_contradicen_determinacion")
+
+    coherencia = str((resultado.get("resumen_fuentes_informacion") or {}).get("coherencia_fuentes") or "").strip().lower()
+    if coherencia in COHERENCIA_CONFLICTIVA:
+        motivos.append("fuentes_contradictorias")
+
+    impacto = nivel_en_escala((conclusion.get("inconsistencias_criticas") or {}).get("impacto_en_conclusion"), NIVELES_IMPACTO)
+    if impacto is not None and impacto > impacto_max:
+        motivos.append("inconsistencias_criticas")
+
+    return motivos
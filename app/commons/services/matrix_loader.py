@@ -1,10 +1,31 @@
-import pandas as pd
+import os
+import sys
+import json
+import hashlib
+from typing import List, Optional
+
+
+# Artefacto precompilado de la matriz (JSON): evita importar pandas/openpyxl al arrancar.
+# Se genera en el build con `python -m app.commons.services.matrix_loader <ruta_excel>`.
+MARCUS_MATRIX_ARTIFACT = os.environ.get("MARCUS_MATRIX_ARTIFACT")
+VERSION_ARTEFACTO = 1
 
-def cargar_matriz_marcus(ruta_excel: str, hoja: str = "Descripción") -> str:
-    """
-    Carga la hoja de circunstancias del Excel de Marcus y genera un string legible como contexto para el LLM.
-    Incluye también el Código Nacional de Tránsito como parte del razonamiento normativo.
-    """
+
+def ruta_artefacto(ruta_excel: str) -> str:
+    return MARCUS_MATRIX_ARTIFACT or os.path.splitext(ruta_excel)[0] + ".json"
+
+
+def hash_archivo(ruta: str) -> str:
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as file:
+        for bloque in iter(lambda: file.read(1 << 20), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def leer_filas_excel(ruta_excel: str, hoja: str = "Descripción") -> List[dict]:
+    """Lee la hoja de circunstancias del Excel (único punto que requiere pandas)."""
+    import pandas as pd
 
     # Leer la hoja
     df = pd.read_excel(ruta_excel, sheet_name=hoja)
@@ -20,13 +41,76 @@ def cargar_matriz_marcus(ruta_excel: str, hoja: str = "Descripción") -> str:
     if not {"id", "codigo", "descripcion"}.issubset(df.columns):
         raise ValueError("La hoja debe contener las columnas 'CIRCUNSTANCIAS', 'CÓDIGO NACIONAL DE TRÁNSITO' y 'DESCRIPCION CESVI'.")
 
-    # Crear texto de contexto
-    texto_contexto = "Estas son las 15 circunstancias definidas por Marcus, con su justificación legal y técnica:\n\n"
-    for _, fila in df.iterrows():
-        texto_contexto += (
+    # Se guardan como texto tal como se renderizan en el contexto
+    return [
+        {"id": str(fila["id"]), "codigo": str(fila["codigo"]), "descripcion": str(fila["descripcion"])}
+        for fila in df[["id", "codigo", "descripcion"]].to_dict("records")
+    ]
+
+
+def renderizar_contexto(filas: List[dict]) -> str:
+    """Genera el string legible que se entrega como contexto al LLM."""
+    partes = ["Estas son las 15 circunstancias definidas por Marcus, con su justificación legal y técnica:\n\n"]
+    for fila in filas:
+        partes.append(
             f"{fila['id']}:\n"
             f"- Descripción CESVI: {fila['descripcion']}\n"
             f"- Fundamento legal (Código Nacional de Tránsito): {fila['codigo']}\n\n"
         )
+    return "".join(partes).strip()
+
+
+def compilar_matriz_marcus(ruta_excel: str, hoja: str = "Descripción", destino: Optional[str] = None) -> str:
+    """Compila el Excel en el artefacto JSON (filas estructuradas + contexto renderizado)."""
+    filas = leer_filas_excel(ruta_excel, hoja)
+    destino = destino or ruta_artefacto(ruta_excel)
+    artefacto = {
+        "version": VERSION_ARTEFACTO,
+        "sha256_excel": hash_archivo(ruta_excel),
+        "hoja": hoja,
+        "filas": filas,
+        "contexto": renderizar_contexto(filas),
+    }
+    with open(destino, "w", encoding="utf-8") as file:
+        json.dump(artefacto, file, ensure_ascii=False, indent=2)
+    return destino
+
+
+def _leer_artefacto(ruta_excel: str, hoja: str) -> Optional[dict]:
+    """Devuelve el artefacto si existe y corresponde al Excel actual; None si hay que recompilar."""
+    ruta = ruta_artefacto(ruta_excel)
+    if not os.path.exists(ruta):
+        return None
+    try:
+        with open(ruta, "r", encoding="utf-8") as file:
+            artefacto = json.load(file)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ [MATRIZ] Artefacto ilegible {ruta}: {e}", flush=True)
+        return None
+
+    if artefacto.get("version") != VERSION_ARTEFACTO or artefacto.get("hoja") != hoja:
+        return None
+    # Si el Excel no viene en la imagen se confía en el artefacto; si viene, debe coincidir su hash
+    if os.path.exists(ruta_excel) and artefacto.get("sha256_excel") != hash_archivo(ruta_excel):
+        print(f"⚠️ [MATRIZ] El artefacto {ruta} está desactualizado respecto al Excel", flush=True)
+        return None
+    return artefacto
+
+
+def cargar_matriz_marcus(ruta_excel: str, hoja: str = "Descripción") -> str:
+    """
+    Carga la hoja de circunstancias del Excel de Marcus y genera un string legible como contexto para el LLM.
+    Incluye también el Código Nacional de Tránsito como parte del razonamiento normativo.
+    Usa el artefacto precompilado cuando está vigente y solo lee el Excel como respaldo.
+    """
+    artefacto = _leer_artefacto(ruta_excel, hoja)
+    if artefacto is not None:
+        return artefacto["contexto"]
+
+    print(f"📄 [MATRIZ] Leyendo Excel {ruta_excel} (sin artefacto vigente)", flush=True)
+    return renderizar_contexto(leer_filas_excel(ruta_excel, hoja))
+
 
-    return texto_contexto.strip()
+if __name__ == "__main__":
+    excel = sys.argv[1] if len(sys.argv) > 1 else "app/utils/Descripción Circunstancias.xlsx"
+    print(f"✅ [MATRIZ] Artefacto generado: {compilar_matriz_marcus(excel)}", flush=True)
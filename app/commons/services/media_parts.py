@@ -0,0 +1,192 @@
+import os
+import logging
+import mimetypes
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from app.commons.services.gcs_fetcher import descargar_blobs, descargar_blobs_async, leer_metadatos_blob, ejecutar_en_pool_gcs
+from app.commons.services.llm_invoker import invocar_modelo, invocar_modelo_async
+
+
+# Modo de envío de la evidencia a Gemini, configurable por modalidad:
+#   GEMINI_MEDIA_MODE_AUDIO / _VISUAL / _VIDEO = "uri" | "bytes"
+# Si no se define la variable de la modalidad se usa GEMINI_MEDIA_MODE (por defecto "bytes").
+MODO_URI = "uri"
+MODO_BYTES = "bytes"
+
+
+@lru_cache(maxsize=1)
+def errores_lectura_uri() -> tuple:
+    """
+    Errores con los que Vertex indica que no pudo leer el objeto referenciado
+    (permisos del agente de servicio, bucket en otra región, objeto inexistente, etc.)
+    """
+    from google.api_core import exceptions as gapi_exceptions
+    return (
+        gapi_exceptions.PermissionDenied,
+        gapi_exceptions.InvalidArgument,
+        gapi_exceptions.NotFound,
+        gapi_exceptions.FailedPrecondition,
+    )
+
+
+_MIME_POR_EXTENSION = {
+    ".pdf": "application/pdf",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".heic": "image/heic",
+    ".heif": "image/heif",
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".m4a": "audio/mp4",
+    ".aac": "audio/aac",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".flac": "audio/flac",
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".avi": "video/x-msvideo",
+    ".webm": "video/webm",
+    ".3gp": "video/3gpp",
+    ".mkv": "video/x-matroska",
+}
+
+_MIME_POR_DEFECTO = {
+    "audio": "audio/mpeg",
+    "visual": "image/jpeg",
+    "video": "video/mp4",
+}
+
+
+def modo_envio(modalidad: str) -> str:
+    modo = os.environ.get(f"GEMINI_MEDIA_MODE_{modalidad.upper()}") or os.environ.get("GEMINI_MEDIA_MODE", MODO_BYTES)
+    return MODO_URI if modo.strip().lower() == MODO_URI else MODO_BYTES
+
+
+def sniff_mime(data: bytes, modalidad: Optional[str] = None) -> Optional[str]:
+    """Detecta el tipo MIME real a partir de la firma del contenido."""
+    if not data:
+        return None
+    cabecera = data[:16]
+
+    if cabecera.startswith(b"%PDF"):
+        return "application/pdf"
+    if cabecera.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if cabecera.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if cabecera.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if cabecera.startswith(b"RIFF") and cabecera[8:12] == b"WEBP":
+        return "image/webp"
+    if cabecera.startswith(b"RIFF") and cabecera[8:12] == b"WAVE":
+        return "audio/wav"
+    if cabecera.startswith(b"RIFF") and cabecera[8:12] == b"AVI ":
+        return "video/x-msvideo"
+    if cabecera.startswith(b"ID3") or cabecera[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    if cabecera[:2] in (b"\xff\xf1", b"\xff\xf9"):
+        return "audio/aac"
+    if cabecera.startswith(b"OggS"):
+        return "audio/ogg"
+    if cabecera.startswith(b"fLaC"):
+        return "audio/flac"
+    if cabecera.startswith(b"\x1aE\xdf\xa3"):
+        return "video/webm"
+    if cabecera[4:8] == b"ftyp":
+        marca = cabecera[8:12]
+        if marca in (b"heic", b"heix", b"mif1", b"msf1"):
+            return "image/heic"
+        if marca == b"qt  ":
+            return "video/quicktime"
+        if marca in (b"3gp4", b"3gp5", b"3gp6", b"3g2a"):
+            return "video/3gpp"
+        if marca in (b"M4A ", b"M4B ") or modalidad == "audio":
+            return "audio/mp4"
+        return "video/mp4"
+    return None
+
+
+def detectar_mime(uri: str, data: Optional[bytes] = None, modalidad: Optional[str] = None) -> str:
+    """
+    Tipo MIME de un objeto de evidencia. Prioriza la firma del contenido; sin
+    bytes usa la extensión y, si no es concluyente, el content_type del objeto en GCS.
+    """
+    mime = sniff_mime(data, modalidad) if data is not None else None
+    if mime:
+        return mime
+
+    extension = os.path.splitext(uri.lower())[1]
+    mime = _MIME_POR_EXTENSION.get(extension) or mimetypes.guess_type(uri)[0]
+    if mime and mime != "application/octet-stream":
+        return mime
+
+    if data is None and uri.startswith("gs://"):
+        try:
+            blob = leer_metadatos_blob(uri)
+            if blob.content_type and blob.content_type != "application/octet-stream":
+                return blob.content_type
+        except Exception as e:
+            logging.warning(f"⚠️ No se pudo leer el content_type de {uri}: {e}")
+
+    return _MIME_POR_DEFECTO.get(modalidad, "application/octet-stream")
+
+
+def partes_por_referencia(uris_gcs: List[str], modalidad: str) -> list:
+    """Partes que Gemini lee directamente desde GCS; los bytes no pasan por el proceso."""
+    from vertexai.generative_models import Part
+    return [Part.from_uri(uri=uri, mime_type=detectar_mime(uri, modalidad=modalidad)) for uri in uris_gcs]
+
+
+def _partes_desde_bytes(uris_gcs: List[str], lista_bytes: List[bytes], modalidad: str) -> list:
+    from vertexai.generative_models import Part
+    return [
+        Part.from_data(data=data, mime_type=detectar_mime(uri, data, modalidad))
+        for uri, data in zip(uris_gcs, lista_bytes)
+    ]
+
+
+def partes_desde_datos(datos: List[Tuple[bytes, str]]) -> list:
+    """Partes en línea a partir de pares (bytes, mime) ya preparados en el proceso."""
+    from vertexai.generative_models import Part
+    return [Part.from_data(data=data, mime_type=mime) for data, mime in datos]
+
+
+def partes_en_linea(uris_gcs: List[str], modalidad: str) -> list:
+    """Partes con los bytes descargados (en paralelo) desde GCS."""
+    return _partes_desde_bytes(uris_gcs, descargar_blobs(uris_gcs), modalidad)
+
+
+async def partes_en_linea_async(uris_gcs: List[str], modalidad: str) -> list:
+    return _partes_desde_bytes(uris_gcs, await descargar_blobs_async(uris_gcs), modalidad)
+
+
+def generar_con_medios(model, prompt: str, uris_gcs: List[str], modalidad: str, generation_config: dict, labels: dict):
+    """
+    Invoca el modelo con el prompt y la evidencia de `uris_gcs`.
+    En modo "uri" envía referencias gs:// y, si Vertex no puede leer alguno de los
+    objetos, repite la llamada automáticamente con los bytes en línea.
+    """
+    if modo_envio(modalidad) == MODO_URI:
+        try:
+            return invocar_modelo(model, [prompt, *partes_por_referencia(uris_gcs, modalidad)], generation_config, labels)
+        except errores_lectura_uri() as e:
+            logging.warning(f"⚠️ [{modalidad.upper()}] Gemini no pudo leer la evidencia por URI, se envían bytes: {e}")
+
+    return invocar_modelo(model, [prompt, *partes_en_linea(uris_gcs, modalidad)], generation_config, labels)
+
+
+async def generar_con_medios_async(model, prompt: str, uris_gcs: List[str], modalidad: str, generation_config: dict, labels: dict):
+    """Versión asíncrona de `generar_con_medios` (descarga y llamada al modelo sin bloquear el loop)."""
+    if modo_envio(modalidad) == MODO_URI:
+        try:
+            # La detección de MIME puede consultar metadatos en GCS: se hace en el pool del fetcher
+            partes = await ejecutar_en_pool_gcs(partes_por_referencia, uris_gcs, modalidad)
+            return await invocar_modelo_async(model, [prompt, *partes], generation_config, labels)
+        except errores_lectura_uri() as e:
+            logging.warning(f"⚠️ [{modalidad.upper()}] Gemini no pudo leer la evidencia por URI, se envían bytes: {e}")
+
+    partes = await partes_en_linea_async(uris_gcs, modalidad)
+    return await invocar_modelo_async(model, [prompt, *partes], generation_config, labels)
@@ -0,0 +1,180 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+
+# Métricas de operación en formato Prometheus (GET /metrics).
+#   PROMETHEUS_MULTIPROC_DIR: con varios workers de uvicorn, directorio compartido donde
+#   cada proceso escribe sus métricas; /metrics las agrega. Lo fija y lo vacía iniciar_api.py
+#   antes de lanzar uvicorn; los scripts de un solo proceso no lo usan.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if PROMETHEUS_MULTIPROC_DIR:
+    # prometheus_client decide el modo multiproceso al importarse: el directorio debe existir antes
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+
+# Buckets en segundos: de descargas cortas a casos de varios minutos
+_BUCKETS_S = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 240, 480, 900)
+
+DESCARGA_GCS_S = Histogram(
+    "marcus_gcs_descarga_segundos", "Duración de cada descarga de un objeto de GCS.",
+    buckets=_BUCKETS_S,
+)
+DESCARGA_GCS_BYTES = Counter("marcus_gcs_descarga_bytes_total", "Bytes descargados de GCS.")
+
+LLAMADA_LLM_S = Histogram(
+    "marcus_llm_llamada_segundos", "Duración de cada invocación al modelo (incluye espera de cuota y reintentos).",
+    ["modelo", "modalidad"], buckets=_BUCKETS_S,
+)
+TOKENS_LLM = Counter(
+    "marcus_llm_tokens_total", "Tokens reportados en usage_metadata.",
+    ["modelo", "modalidad", "tipo"],
+)
+LLM_EN_VUELO = Gauge(
+    "marcus_llm_en_vuelo", "Intentos de llamada al modelo en curso.",
+    ["modelo"], multiprocess_mode="livesum",
+)
+REINTENTOS_LLM = Counter(
+    "marcus_llm_reintentos_total", "Reintentos ante 429/5xx.",
+    ["modelo", "clase"],
+)
+HEDGES_LLM = Counter(
+    "marcus_llm_hedges_total", "Solicitudes duplicadas por latencia (disparada | ganada | denegada por presupuesto o cuota).",
+    ["modelo", "modalidad", "resultado"],
+)
+VIOLACIONES_ESQUEMA = Counter(
+    "marcus_llm_violaciones_esquema_total", "Respuestas fuera del esquema de salida (corregida con reintento | persistente).",
+    ["esquema", "desenlace"],
+)
+
+MODALIDAD_S = Histogram(
+    "marcus_modalidad_segundos", "Duración de la extracción de cada modalidad del caso.",
+    ["modalidad", "ok"], buckets=_BUCKETS_S,
+)
+ADJUDICACION_S = Histogram(
+    "marcus_adjudicacion_segundos", "Duración del razonamiento Marcus.",
+    buckets=_BUCKETS_S,
+)
+ADJUDICACION_NIVEL = Counter(
+    "marcus_adjudicacion_nivel_total", "Adjudicaciones por nivel que decidió el caso (flash | pro).",
+    ["nivel"],
+)
+ESCALAMIENTOS_MARCUS = Counter(
+    "marcus_escalamientos_total", "Motivos por los que la cascada pasó el caso de Flash a Pro.",
+    ["motivo"],
+)
+EVIDENCIA_TOKENS = Histogram(
+    "marcus_evidencia_tokens", "Tokens estimados de la evidencia del caso para Marcus (antes | despues de compactar).",
+    ["fase"], buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000),
+)
+CASO_S = Histogram(
+    "marcus_caso_segundos", "Duración total del caso.",
+    ["resultado"], buckets=_BUCKETS_S,
+)
+CASOS_EN_VUELO = Gauge("marcus_casos_en_vuelo", "Casos en procesamiento.", multiprocess_mode="livesum")
+
+POOL_OCUPADOS = Gauge(
+    "marcus_pool_hilos_ocupados", "Hilos del pool ejecutando una tarea.",
+    ["pool"], multiprocess_mode="livesum",
+)
+POOL_EN_COLA = Gauge(
+    "marcus_pool_tareas_en_cola", "Tareas esperando un hilo libre (saturación del pool).",
+    ["pool"], multiprocess_mode="livesum",
+)
+POOL_TAMANO = Gauge(
+    "marcus_pool_hilos_max", "Tamaño configurado del pool.",
+    ["pool"], multiprocess_mode="liveall",
+)
+
+ERRORES = Counter(
+    "marcus_errores_total", "Errores por etapa y clase de excepción.",
+    ["etapa", "clase"],
+)
+
+# Modalidad en curso: la fijan el pipeline y la adjudicación para etiquetar las llamadas al modelo
+_modalidad: contextvars.ContextVar[str] = contextvars.ContextVar("modalidad_metricas", default="otra")
+
+
+def modalidad_de(nombre: str) -> str:
+    """IA_AUDIO_FLASH_0 -> audio, IA_VISUAL_PRO -> visual, IA_VIDEO_PRO_1 -> video."""
+    for modalidad in ("audio", "visual", "video"):
+        if modalidad.upper() in nombre:
+            return modalidad
+    return nombre.lower()
+
+
+@contextmanager
+def en_modalidad(modalidad: str):
+    token = _modalidad.set(modalidad)
+    try:
+        yield
+    finally:
+        _modalidad.reset(token)
+
+
+def modalidad_actual() -> str:
+    return _modalidad.get()
+
+
+def registrar_tokens(model_name: str, respuesta):
+    uso = getattr(respuesta, "usage_metadata", None)
+    if uso is None:
+        return
+    modalidad = modalidad_actual()
+    entrada = getattr(uso, "prompt_token_count", 0) or 0
+    salida = getattr(uso, "candidates_token_count", 0) or 0
+    if entrada:
+        TOKENS_LLM.labels(model_name, modalidad, "entrada").inc(entrada)
+    if salida:
+        TOKENS_LLM.labels(model_name, modalidad, "salida").inc(salida)
+
+
+def registrar_error(etapa: str, error: BaseException):
+    ERRORES.labels(etapa, type(error).__name__).inc()
+
+
+@contextmanager
+def cronometro(histograma, *etiquetas: str):
+    t_inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histograma.labels(*etiquetas) if etiquetas else histograma).observe(time.perf_counter() - t_inicio)
+
+
+def tarea_en_pool(pool: str, funcion):
+    """
+    Envuelve una tarea enviada a un ThreadPoolExecutor para medir cuánto espera
+    en cola y cuántos hilos están ocupados. Se llama al momento de enviarla.
+    """
+    POOL_EN_COLA.labels(pool).inc()
+
+    def _ejecutar(*args, **kwargs):
+        POOL_EN_COLA.labels(pool).dec()
+        POOL_OCUPADOS.labels(pool).inc()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            POOL_OCUPADOS.labels(pool).dec()
+
+    return _ejecutar
+
+
+def marcar_proceso_terminado():
+    """Al apagar un worker: sus gauges en vivo dejan de sumarse en /metrics."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def exportar() -> tuple:
+    """Cuerpo y content-type de la respuesta de /metrics."""
+    registro: Optional[CollectorRegistry] = None
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    return (generate_latest(registro) if registro else generate_latest()), CONTENT_TYPE_LATEST
@@ -0,0 +1,47 @@
+import io
+import os
+from typing import List, Tuple
+
+
+# División de PDFs en fragmentos de páginas para extraerlos en paralelo (opcional):
+#   VISUAL_PDF_SPLIT=1 activa la división
+#   VISUAL_PDF_PAGINAS_POR_FRAGMENTO: páginas por llamada al modelo
+#   VISUAL_PDF_MAX_PARALELO: llamadas simultáneas por caso
+VISUAL_PDF_SPLIT = os.environ.get("VISUAL_PDF_SPLIT", "0") == "1"
+VISUAL_PDF_PAGINAS_POR_FRAGMENTO = int(os.environ.get("VISUAL_PDF_PAGINAS_POR_FRAGMENTO", "2"))
+VISUAL_PDF_MAX_PARALELO = int(os.environ.get("VISUAL_PDF_MAX_PARALELO", "4"))
+
+
+def opciones_division() -> dict:
+    return {"paginas_por_fragmento": VISUAL_PDF_PAGINAS_POR_FRAGMENTO}
+
+
+def rangos_paginas(total: int, por_fragmento: int) -> List[Tuple[int, int]]:
+    """Rangos (inicio, fin) 1-indexados e inclusivos que cubren el documento."""
+    por_fragmento = max(1, por_fragmento)
+    return [(inicio, min(inicio + por_fragmento - 1, total)) for inicio in range(1, total + 1, por_fragmento)]
+
+
+def dividir_pdf(data: bytes, por_fragmento: int = VISUAL_PDF_PAGINAS_POR_FRAGMENTO) -> Tuple[int, List[Tuple[Tuple[int, int], bytes]]]:
+    """
+    Separa el PDF en fragmentos de `por_fragmento` páginas.
+    Devuelve el total de páginas y la lista de (rango, bytes del fragmento);
+    un documento que cabe en un solo fragmento se devuelve sin reescribir.
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    lector = PdfReader(io.BytesIO(data))
+    total = len(lector.pages)
+    rangos = rangos_paginas(total, por_fragmento)
+    if len(rangos) <= 1:
+        return total, [((1, total), data)]
+
+    fragmentos = []
+    for inicio, fin in rangos:
+        escritor = PdfWriter()
+        for indice in range(inicio - 1, fin):
+            escritor.add_page(lector.pages[indice])
+        salida = io.BytesIO()
+        escritor.write(salida)
+        fragmentos.append(((inicio, fin), salida.getvalue()))
+    return total, fragmentos
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+
+import yaml
+
+
+BASE_PATH = Path(__file__).parent.parent.parent
+PROMPTS_PATH = BASE_PATH / "utils" / "prompts_generales.yaml"
+LLM_PARAMETERS_PATH = BASE_PATH / "config" / "llm_parameters.json"
+RESPONSE_SCHEMAS_PATH = BASE_PATH / "config" / "response_schemas.json"
+
+
+class _ArchivoCacheado:
+    """
+    Contenido parseado de un archivo de configuración, con el mtime y el hash
+    del contenido crudo en el momento de la lectura.
+    """
+
+    def __init__(self, ruta: Path, parser):
+        self.ruta = ruta
+        self.parser = parser
+        self.datos = {}
+        self.mtime = None
+        self.hash = ""
+
+    def cargar(self):
+        # El mtime se toma antes de leer: si el archivo cambia durante la lectura,
+        # la próxima revisión ve un mtime distinto y vuelve a cargarlo
+        mtime = os.stat(self.ruta).st_mtime
+        with open(self.ruta, "rb") as file:
+            crudo = file.read()
+        self.datos = self.parser(crudo.decode("utf-8")) or {}
+        self.mtime = mtime
+        self.hash = hashlib.sha256(crudo).hexdigest()
+
+    def cambio_en_disco(self) -> bool:
+        try:
+            return os.stat(self.ruta).st_mtime != self.mtime
+        except OSError:
+            return False
+
+
+class PromptRegistry:
+    """
+    Registro de proceso para los prompts del YAML, los parámetros de los LLM y los
+    esquemas de salida estructurada.
+    Parsea cada archivo una sola vez y sirve el contenido desde memoria.
+    Con PROMPTS_HOT_RELOAD=1 revisa el mtime en cada consulta (como máximo cada
+    PROMPTS_RELOAD_INTERVAL_S segundos) y recarga si el archivo cambió.
+    """
+
+    def __init__(
+            self,
+            prompts_path: Path = PROMPTS_PATH,
+            llm_parameters_path: Path = LLM_PARAMETERS_PATH,
+            response_schemas_path: Path = RESPONSE_SCHEMAS_PATH
+    ):
+        self._lock = threading.Lock()
+        self._prompts = _ArchivoCacheado(prompts_path, yaml.safe_load)
+        self._parametros = _ArchivoCacheado(llm_parameters_path, json.loads)
+        self._esquemas = _ArchivoCacheado(response_schemas_path, json.loads)
+        self._cargado = False
+        self._ultima_revision = 0.0
+        self.hot_reload = os.environ.get("PROMPTS_HOT_RELOAD", "0") == "1"
+        self.intervalo_revision = float(os.environ.get("PROMPTS_RELOAD_INTERVAL_S", "2"))
+
+    def cargar(self):
+        """Lee y parsea los archivos. Se invoca en el arranque del proceso."""
+        with self._lock:
+            self._cargar()
+
+    def _cargar(self):
+        self._prompts.cargar()
+        self._parametros.cargar()
+        self._esquemas.cargar()
+        self._cargado = True
+        self._ultima_revision = time.monotonic()
+        print(f"📚 [PROMPTS] Registro cargado (versión {self.version[:12]})", flush=True)
+
+    def _asegurar_actualizado(self):
+        if not self._cargado:
+            with self._lock:
+                if not self._cargado:
+                    self._cargar()
+            return
+        if not self.hot_reload:
+            return
+
+        ahora = time.monotonic()
+        if ahora - self._ultima_revision < self.intervalo_revision:
+            return
+
+        with self._lock:
+            self._ultima_revision = ahora
+            for archivo in (self._prompts, self._parametros, self._esquemas):
+                if archivo.cambio_en_disco():
+                    try:
+                        archivo.cargar()
+                        print(f"🔄 [PROMPTS] Recargado {archivo.ruta.name} (versión {self.version[:12]})", flush=True)
+                    except Exception as e:
+                        # Se conserva la versión anterior si el archivo quedó inválido a mitad de edición
+                        print(f"⚠️ [PROMPTS] No se pudo recargar {archivo.ruta.name}: {e}", flush=True)
+
+    def prompt(self, prompt_type: str) -> str:
+        self._asegurar_actualizado()
+        return self._prompts.datos.get(prompt_type, "")
+
+    def parametros(self, model_name: str) -> dict:
+        self._asegurar_actualizado()
+        return self._parametros.datos.get(model_name, {})
+
+    def esquemas(self) -> dict:
+        """Esquemas de salida por nombre de prompt (sin resolver referencias)."""
+        self._asegurar_actualizado()
+        return self._esquemas.datos
+
+    @property
+    def version(self) -> str:
+        """
+        Hash del contenido de prompts, parámetros y esquemas. Sirve como llave de caché:
+        cambia cuando cambia cualquiera de los archivos.
+        """
+        return hashlib.sha256(f"{self._prompts.hash}:{self._parametros.hash}:{self._esquemas.hash}".encode()).hexdigest()
+
+    def version_prompt(self, prompt_type: str) -> str:
+        """Hash de un prompt individual, para cachés que dependen de uno solo."""
+        return hashlib.sha256(self.prompt(prompt_type).encode("utf-8")).hexdigest()
+
+
+registry = PromptRegistry()
+
+
+def get_prompt_version() -> str:
+    registry._asegurar_actualizado()
+    return registry.version
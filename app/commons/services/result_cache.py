@@ -0,0 +1,303 @@
+import os
+import json
+import base64
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from app.commons.services.gcs_fetcher import leer_metadatos_blobs
+from app.commons.services.prompt_registry import registry
+from app.commons.services.llm_invoker import nombre_modelo
+
+
+# Configuración del caché de resultados por medio:
+#   MEDIA_CACHE_BACKEND = memory | disk | none
+#   MEDIA_CACHE_MAX_MB, MEDIA_CACHE_TTL_S, MEDIA_CACHE_DIR
+MEDIA_CACHE_BACKEND = os.environ.get("MEDIA_CACHE_BACKEND", "memory").lower()
+MEDIA_CACHE_MAX_MB = float(os.environ.get("MEDIA_CACHE_MAX_MB", "256"))
+MEDIA_CACHE_TTL_S = float(os.environ.get("MEDIA_CACHE_TTL_S", str(7 * 24 * 3600)))
+MEDIA_CACHE_DIR = os.environ.get("MEDIA_CACHE_DIR", "/tmp/motor_media_cache")
+
+
+class MemoriaLRU:
+    """Backend en memoria: LRU acotado por bytes, con expiración por TTL."""
+
+    def __init__(self, max_bytes: int, ttl_s: float):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._datos = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.desalojos = 0
+
+    def get(self, llave: str) -> Optional[str]:
+        with self._lock:
+            entrada = self._datos.get(llave)
+            if entrada is None:
+                return None
+            valor, expira, tamano = entrada
+            if expira < time.time():
+                del self._datos[llave]
+                self._bytes -= tamano
+                return None
+            self._datos.move_to_end(llave)
+            return valor
+
+    def set(self, llave: str, valor: str):
+        tamano = len(valor.encode("utf-8"))
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._datos.pop(llave, None)
+            if anterior is not None:
+                self._bytes -= anterior[2]
+            self._datos[llave] = (valor, time.time() + self.ttl_s, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes and self._datos:
+                _, (_, _, tamano_viejo) = self._datos.popitem(last=False)
+                self._bytes -= tamano_viejo
+                self.desalojos += 1
+
+    def tamano_bytes(self) -> int:
+        return self._bytes
+
+
+class DiscoStore:
+    """
+    Backend en disco: un archivo JSON por llave dentro de `directorio`.
+    Cuando se supera `max_bytes` se desalojan los archivos usados hace más tiempo.
+    """
+
+    def __init__(self, directorio: str, max_bytes: int, ttl_s: float):
+        self.directorio = Path(directorio)
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._bytes = sum(p.stat().st_size for p in self.directorio.glob("*.json"))
+        self.desalojos = 0
+
+    def _ruta(self, llave: str) -> Path:
+        return self.directorio / f"{llave}.json"
+
+    def get(self, llave: str) -> Optional[str]:
+        ruta = self._ruta(llave)
+        try:
+            with open(ruta, "r", encoding="utf-8") as file:
+                entrada = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if entrada.get("expira", 0) < time.time():
+            self._eliminar(ruta)
+            return None
+        # Se actualiza el atime/mtime para que el desalojo sea LRU
+        try:
+            os.utime(ruta, None)
+        except OSError:
+            pass
+        return entrada.get("valor")
+
+    def set(self, llave: str, valor: str):
+        contenido = json.dumps({"valor": valor, "expira": time.time() + self.ttl_s}, ensure_ascii=False)
+        tamano = len(contenido.encode("utf-8"))
+        if tamano > self.max_bytes:
+            return
+        ruta = self._ruta(llave)
+        temporal = ruta.with_suffix(".tmp")
+        with self._lock:
+            if ruta.exists():
+                self._bytes -= ruta.stat().st_size
+            with open(temporal, "w", encoding="utf-8") as file:
+                file.write(contenido)
+            os.replace(temporal, ruta)
+            self._bytes += tamano
+            if self._bytes > self.max_bytes:
+                self._desalojar()
+
+    def _eliminar(self, ruta: Path):
+        with self._lock:
+            try:
+                tamano = ruta.stat().st_size
+                ruta.unlink()
+                self._bytes -= tamano
+            except OSError:
+                pass
+
+    def _desalojar(self):
+        archivos = sorted(self.directorio.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for ruta in archivos:
+            if self._bytes <= self.max_bytes:
+                break
+            try:
+                tamano = ruta.stat().st_size
+                ruta.unlink()
+                self._bytes -= tamano
+                self.desalojos += 1
+            except OSError:
+                pass
+
+    def tamano_bytes(self) -> int:
+        return self._bytes
+
+
+class ResultCache:
+    """Caché de resultados de extracción con contadores de aciertos y fallos."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.aciertos = 0
+        self.fallos = 0
+        self.escrituras = 0
+        # Los extractores consultan desde varios hilos a la vez
+        self._lock_contadores = threading.Lock()
+
+    @property
+    def activo(self) -> bool:
+        return self.backend is not None
+
+    def get(self, llave: Optional[str]) -> Optional[str]:
+        if not self.activo or llave is None:
+            return None
+        valor = self.backend.get(llave)
+        with self._lock_contadores:
+            if valor is None:
+                self.fallos += 1
+            else:
+                self.aciertos += 1
+        return valor
+
+    def set(self, llave: Optional[str], valor: str):
+        if not self.activo or llave is None or not isinstance(valor, str):
+            return
+        self.backend.set(llave, valor)
+        with self._lock_contadores:
+            self.escrituras += 1
+
+    def obtener_o_calcular(self, llave: Optional[str], calcular: Callable[[], str]) -> str:
+        en_cache = self.get(llave)
+        if en_cache is not None:
+            return en_cache
+        valor = calcular()
+        self.set(llave, valor)
+        return valor
+
+    def estadisticas(self) -> dict:
+        with self._lock_contadores:
+            aciertos, fallos, escrituras = self.aciertos, self.fallos, self.escrituras
+        consultas = aciertos + fallos
+        return {
+            "backend": type(self.backend).__name__ if self.backend else "ninguno",
+            "aciertos": aciertos,
+            "fallos": fallos,
+            "escrituras": escrituras,
+            "tasa_aciertos": round(aciertos / consultas, 4) if consultas else 0.0,
+            "desalojos": getattr(self.backend, "desalojos", 0),
+            "tamano_bytes": self.backend.tamano_bytes() if self.backend else 0,
+        }
+
+
+def _crear_backend():
+    max_bytes = int(MEDIA_CACHE_MAX_MB * 1024 * 1024)
+    if MEDIA_CACHE_BACKEND == "none":
+        return None
+    if MEDIA_CACHE_BACKEND == "disk":
+        try:
+            return DiscoStore(MEDIA_CACHE_DIR, max_bytes, MEDIA_CACHE_TTL_S)
+        except OSError as e:
+            logging.warning(f"⚠️ No se pudo usar el caché en disco ({e}), se usa memoria.")
+    return MemoriaLRU(max_bytes, MEDIA_CACHE_TTL_S)
+
+
+result_cache = ResultCache(_crear_backend())
+
+
+def identidad_bytes(data: bytes) -> str:
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def identidad_md5(data: bytes) -> str:
+    """La misma identidad que `identidades_contenido` obtiene del md5 de GCS, calculada sobre bytes ya descargados."""
+    return "md5:" + base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+def identidades_contenido(uris_gcs: List[str]) -> Optional[List[str]]:
+    """
+    Identidad de contenido de cada objeto, tomada de los metadatos de GCS sin
+    descargarlo: el md5 (igual para la misma grabación en rutas distintas) o, si
+    el objeto es compuesto y no lo tiene, ruta + generation.
+    Devuelve None si no se pudieron leer los metadatos.
+    """
+    try:
+        blobs = leer_metadatos_blobs(list(uris_gcs))
+    except Exception as e:
+        logging.warning(f"⚠️ [CACHE] No se pudo leer la identidad de la evidencia: {e}")
+        return None
+
+    identidades = []
+    for uri, blob in zip(uris_gcs, blobs):
+        if blob.md5_hash:
+            identidades.append(f"md5:{blob.md5_hash}")
+        elif blob.generation:
+            identidades.append(f"gen:{uri}#{blob.generation}")
+        else:
+            return None
+    return identidades
+
+
+def llave_resultado(
+        modalidad: str,
+        identidades: Optional[List[str]],
+        prompt_type: str,
+        model,
+        generation_config: dict,
+        extra: Optional[dict] = None
+) -> Optional[str]:
+    """
+    Llave del resultado de extracción: identidad del contenido + versión del
+    prompt + nombre del modelo + parámetros de generación (+ `extra`, p. ej. las
+    opciones de preprocesamiento que transforman la evidencia antes de enviarla).
+    """
+    if not result_cache.activo or not identidades:
+        return None
+    material = {
+        "modalidad": modalidad,
+        "contenido": identidades,
+        "prompt": registry.version_prompt(prompt_type),
+        "modelo": nombre_modelo(model),
+        "generacion": generation_config,
+    }
+    if extra:
+        material["extra"] = extra
+    return hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def llave_para_uris(
+        modalidad: str,
+        uris_gcs: List[str],
+        prompt_type: str,
+        model,
+        generation_config: dict,
+        extra: Optional[dict] = None
+) -> Optional[str]:
+    """Atajo para las funciones de extracción: solo consulta GCS si el caché está activo."""
+    if not result_cache.activo:
+        return None
+    return llave_resultado(modalidad, identidades_contenido(uris_gcs), prompt_type, model, generation_config, extra)
+
+
+def llave_para_bytes(
+        modalidad: str,
+        lista_bytes: List[bytes],
+        prompt_type: str,
+        model,
+        generation_config: dict,
+        extra: Optional[dict] = None
+) -> Optional[str]:
+    """Como `llave_para_uris`, para evidencia ya descargada: sin consultar los metadatos en GCS."""
+    if not result_cache.activo:
+        return None
+    return llave_resultado(modalidad, [identidad_md5(data) for data in lista_bytes], prompt_type, model, generation_config, extra)
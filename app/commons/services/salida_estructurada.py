@@ -0,0 +1,217 @@
+import os
+import json
+import copy
+import logging
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+from app.commons.services import metricas
+from app.commons.services.prompt_registry import registry
+
+
+# Salida estructurada de los modelos: esquemas de app/config/response_schemas.json,
+# indexados por el nombre del prompt del YAML.
+#   LLM_RESPONSE_SCHEMA=0 no envía response_schema a Vertex (el JSON lo pide solo el prompt)
+#   LLM_SCHEMA_REINTENTOS: reintentos dirigidos cuando la respuesta no cumple el esquema
+LLM_RESPONSE_SCHEMA = os.environ.get("LLM_RESPONSE_SCHEMA", "1") == "1"
+LLM_SCHEMA_REINTENTOS = int(os.environ.get("LLM_SCHEMA_REINTENTOS", "1"))
+
+_TIPOS_PY = {
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "object": dict,
+    "array": list,
+}
+_MAX_VIOLACIONES_NOTA = 10
+
+
+def _resolver(nodo: Any, definiciones: dict) -> Any:
+    """Sustituye {"$ref": "nombre"} por la definición de `_definiciones` (recursivo)."""
+    if isinstance(nodo, dict):
+        if "$ref" in nodo:
+            return _resolver(copy.deepcopy(definiciones[nodo["$ref"]]), definiciones)
+        return {k: _resolver(v, definiciones) for k, v in nodo.items()}
+    if isinstance(nodo, list):
+        return [_resolver(v, definiciones) for v in nodo]
+    return nodo
+
+
+@lru_cache(maxsize=32)
+def _esquema_resuelto(nombre: str, version: str) -> Optional[dict]:
+    esquemas = registry.esquemas()
+    if nombre not in esquemas:
+        return None
+    return _resolver(esquemas[nombre], esquemas.get("_definiciones", {}))
+
+
+def esquema(nombre: str) -> Optional[dict]:
+    """Esquema del prompt `nombre`, con las referencias resueltas; None si no tiene."""
+    esquemas = registry.esquemas()
+    return _esquema_resuelto(nombre, registry.version) if nombre in esquemas else None
+
+
+class RespuestaFueraDeEsquema(Exception):
+    """
+    La respuesta sigue sin cumplir el esquema tras los reintentos dirigidos. Las extracciones
+    la reportan como error de la modalidad y no la guardan en el caché de resultados.
+    """
+
+    def __init__(self, nombre: str, respuesta, violaciones: List[str]):
+        super().__init__(f"La respuesta de '{nombre}' no cumple el esquema de salida: {'; '.join(violaciones[:3])}")
+        self.respuesta = respuesta
+        self.violaciones = violaciones
+
+
+def _admite_nulo(nodo: dict) -> bool:
+    # Las hojas aceptan null salvo indicación contraria: los prompts piden null para datos ausentes
+    return nodo.get("nullable", nodo["type"] not in ("object", "array"))
+
+
+def esquema_vertex(nodo: dict) -> dict:
+    """Traduce el esquema al formato de response_schema de Vertex (type_ en mayúsculas, orden de propiedades)."""
+    salida = {"type_": nodo["type"].upper()}
+    if _admite_nulo(nodo):
+        salida["nullable"] = True
+    if "enum" in nodo:
+        salida["enum"] = list(nodo["enum"])
+    if "description" in nodo:
+        salida["description"] = nodo["description"]
+    if nodo["type"] == "object":
+        propiedades = nodo.get("properties", {})
+        salida["properties"] = {campo: esquema_vertex(sub) for campo, sub in propiedades.items()}
+        # El modelo genera en el orden del esquema: el razonamiento antes de la conclusión, como en el prompt
+        salida["property_ordering"] = list(propiedades)
+        if nodo.get("required"):
+            salida["required"] = list(nodo["required"])
+    elif nodo["type"] == "array":
+        salida["items"] = esquema_vertex(nodo["items"])
+    return salida
+
+
+def con_esquema(generation_config: dict, nombre: str) -> dict:
+    """generation_config con respuesta JSON restringida al esquema del prompt (si existe y está activo)."""
+    esq = esquema(nombre) if LLM_RESPONSE_SCHEMA else None
+    if esq is None:
+        return generation_config
+    return {**generation_config, "response_mime_type": "application/json", "response_schema": esquema_vertex(esq)}
+
+
+def parsear_json(texto: Optional[str]) -> Tuple[Optional[Any], Optional[Exception]]:
+    """
+    Parser de una sola pasada: quita un fence de código envolvente (modelos sin modo
+    estructurado) y hace un único json.loads. Devuelve (objeto, error).
+    """
+    if texto is None:
+        return None, ValueError("Respuesta vacía")
+    texto = texto.strip()
+    if texto.startswith("```"):
+        texto = texto.split("\n", 1)[1] if "\n" in texto else ""
+        if texto.rstrip().endswith("```"):
+            texto = texto.rstrip()[:-3]
+    try:
+        return json.loads(texto), None
+    except ValueError as e:
+        return None, e
+
+
+def validar(valor: Any, nodo: dict, ruta: str = "$") -> List[str]:
+    """Violaciones del valor respecto al esquema (lista vacía si lo cumple)."""
+    if valor is None:
+        return [] if _admite_nulo(nodo) else [f"{ruta}: null no permitido"]
+    tipo = nodo["type"]
+    if not isinstance(valor, _TIPOS_PY[tipo]) or (isinstance(valor, bool) and tipo in ("number", "integer")):
+        return [f"{ruta}: se esperaba {tipo}, llegó {type(valor).__name__}"]
+
+    violaciones = []
+    if "enum" in nodo and valor not in nodo["enum"]:
+        violaciones.append(f"{ruta}: {valor!r} no es uno de {nodo['enum']}")
+    if tipo == "object":
+        for campo in nodo.get("required", []):
+            if campo not in valor:
+                violaciones.append(f"{ruta}.{campo}: campo obligatorio ausente")
+        for campo, sub in nodo.get("properties", {}).items():
+            if campo in valor:
+                violaciones += validar(valor[campo], sub, f"{ruta}.{campo}")
+    elif tipo == "array":
+        for i, item in enumerate(valor):
+            violaciones += validar(item, nodo["items"], f"{ruta}[{i}]")
+    return violaciones
+
+
+def validar_respuesta(texto: Optional[str], nombre: str) -> Tuple[Optional[Any], List[str]]:
+    """Parsea la respuesta y la valida contra el esquema del prompt: (datos, violaciones)."""
+    datos, error = parsear_json(texto)
+    if error is not None:
+        return None, [f"$: JSON inválido ({error})"]
+    esq = esquema(nombre)
+    return datos, (validar(datos, esq) if esq is not None else [])
+
+
+def nota_correccion(violaciones: List[str]) -> str:
+    """Texto que se agrega al prompt en el reintento dirigido."""
+    lista = "\n".join(f"- {v}" for v in violaciones[:_MAX_VIOLACIONES_NOTA])
+    return (
+        "\n\n### CORRECCIÓN DE FORMATO ###\n"
+        "Una respuesta anterior a esta misma solicitud no cumplió el esquema de salida:\n"
+        f"{lista}\n"
+        "Responde de nuevo con el objeto JSON completo, corrigiendo esos puntos."
+    )
+
+
+def _registrar_resultado(nombre: str, intento: int, violaciones: List[str]) -> bool:
+    """Indica si hay que reintentar; registra el desenlace en métricas y logs."""
+    if not violaciones:
+        if intento:
+            metricas.VIOLACIONES_ESQUEMA.labels(nombre, "corregida").inc()
+        return False
+    if intento >= LLM_SCHEMA_REINTENTOS:
+        metricas.VIOLACIONES_ESQUEMA.labels(nombre, "persistente").inc()
+        logging.warning(f"⚠️ [ESQUEMA:{nombre}] La respuesta sigue fuera del esquema: {violaciones[:3]}")
+        return False
+    print(f"🧩 [ESQUEMA:{nombre}] Respuesta fuera del esquema ({len(violaciones)} violaciones), reintento dirigido", flush=True)
+    return True
+
+
+def generar_validado(nombre: str, generar):
+    """
+    Ejecuta `generar(nota)` (devuelve la respuesta del modelo) y, solo si la respuesta
+    viola el esquema del prompt, la repite con la nota de corrección. Si agotados los
+    LLM_SCHEMA_REINTENTOS sigue fuera del esquema, lanza RespuestaFueraDeEsquema.
+    Los errores de red o cuota no pasan por aquí: los reintenta el scheduler.
+    """
+    respuesta = generar("")
+    if esquema(nombre) is None:
+        return respuesta
+    for intento in range(LLM_SCHEMA_REINTENTOS + 1):
+        _, violaciones = validar_respuesta(respuesta.text, nombre)
+        if not _registrar_resultado(nombre, intento, violaciones):
+            break
+        respuesta = generar(nota_correccion(violaciones))
+    if violaciones:
+        raise RespuestaFueraDeEsquema(nombre, respuesta, violaciones)
+    return respuesta
+
+
+async def generar_validado_async(nombre: str, generar):
+    """Variante asíncrona de `generar_validado`: `generar(nota)` devuelve un awaitable."""
+    respuesta = await generar("")
+    if esquema(nombre) is None:
+        return respuesta
+    for intento in range(LLM_SCHEMA_REINTENTOS + 1):
+        _, violaciones = validar_respuesta(respuesta.text, nombre)
+        if not _registrar_resultado(nombre, intento, violaciones):
+            break
+        respuesta = await generar(nota_correccion(violaciones))
+    if violaciones:
+        raise RespuestaFueraDeEsquema(nombre, respuesta, violaciones)
+    return respuesta
+
+
+def datos_modalidad(resultado: Any) -> Any:
+    """Resultado de una modalidad como datos: el JSON parseado, o el valor tal cual si no es JSON."""
+    if not isinstance(resultado, str):
+        return resultado
+    datos, error = parsear_json(resultado)
+    return resultado if error is not None else datos
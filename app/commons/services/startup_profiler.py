@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import builtins
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+
+# Perfil del arranque en frío del proceso.
+#   STARTUP_PROFILE=1 registra además el tiempo de importación de cada módulo
+#   (tiene un costo pequeño en cada import, por eso no está activo por defecto).
+STARTUP_PROFILE = os.environ.get("STARTUP_PROFILE", "0") == "1"
+
+
+class StartupProfiler:
+    """
+    Registra la duración de cada paso de `cargar_recursos_proactivamente` y,
+    en modo perfil, el tiempo acumulado y propio de cada módulo importado.
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.etapas = {}
+        self.importaciones = {}
+        self.listo_s: Optional[float] = None
+        self.habilitado = False
+        self._pila = threading.local()
+        self._import_original = None
+
+    def instalar(self):
+        """Envuelve `__import__` para medir los módulos que se cargan desde este punto."""
+        if self.habilitado:
+            return
+        self.habilitado = True
+        self._import_original = builtins.__import__
+        builtins.__import__ = self._import_cronometrado
+
+    def _import_cronometrado(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Solo interesan las importaciones absolutas de módulos aún no cargados
+        if level != 0 or name in sys.modules:
+            return self._import_original(name, globals, locals, fromlist, level)
+
+        # Pila por hilo con el tiempo de los imports hijos de cada import en curso
+        pila = getattr(self._pila, "hijos", None)
+        if pila is None:
+            pila = self._pila.hijos = []
+        pila.append(0.0)
+        t_inicio = time.perf_counter()
+        try:
+            return self._import_original(name, globals, locals, fromlist, level)
+        finally:
+            acumulado = time.perf_counter() - t_inicio
+            hijos = pila.pop()
+            if pila:
+                pila[-1] += acumulado
+            self.importaciones[name] = {"acumulado_s": round(acumulado, 4), "propio_s": round(acumulado - hijos, 4)}
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        t_inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nombre] = round(time.perf_counter() - t_inicio, 3)
+
+    def marcar_listo(self):
+        self.listo_s = round(time.perf_counter() - self.t0, 3)
+
+    def resumen(self, top: int = 30) -> dict:
+        mas_lentos = sorted(self.importaciones.items(), key=lambda kv: kv[1]["acumulado_s"], reverse=True)[:top]
+        return {
+            "perfil_importaciones": self.habilitado,
+            "listo_s": self.listo_s,
+            "etapas_s": self.etapas,
+            "importaciones": dict(mas_lentos),
+        }
+
+
+startup_profiler = StartupProfiler()
+
+if STARTUP_PROFILE:
+    startup_profiler.instalar()
@@ -0,0 +1,189 @@
+import os
+import json
+import glob
+import asyncio
+import tempfile
+import multiprocessing
+import threading
+import subprocess
+from typing import List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# Preprocesamiento de video con ffmpeg antes de enviarlo a Gemini (opcional):
+#   VIDEO_PREPROCESS=1 activa la etapa
+#   VIDEO_MAX_ALTO / VIDEO_FPS: resolución vertical y cuadros por segundo objetivo
+#   VIDEO_RECORTAR_ESTATICOS=1 elimina los tramos sin cambios (mpdecimate)
+#   VIDEO_KEYFRAMES: número máximo de cuadros clave JPEG que se adjuntan (0 = ninguno)
+#   VIDEO_EXTRAER_AUDIO=1 separa la pista de audio para transcribirla por la ruta de audio
+#   VIDEO_PROCESOS: tamaño del pool de procesos de transcodificación
+VIDEO_PREPROCESS = os.environ.get("VIDEO_PREPROCESS", "0") == "1"
+VIDEO_MAX_ALTO = int(os.environ.get("VIDEO_MAX_ALTO", "480"))
+VIDEO_FPS = float(os.environ.get("VIDEO_FPS", "5"))
+VIDEO_RECORTAR_ESTATICOS = os.environ.get("VIDEO_RECORTAR_ESTATICOS", "1") == "1"
+VIDEO_KEYFRAMES = int(os.environ.get("VIDEO_KEYFRAMES", "0"))
+VIDEO_EXTRAER_AUDIO = os.environ.get("VIDEO_EXTRAER_AUDIO", "0") == "1"
+VIDEO_PROCESOS = int(os.environ.get("VIDEO_PROCESOS", "2"))
+VIDEO_FFMPEG_TIMEOUT_S = float(os.environ.get("VIDEO_FFMPEG_TIMEOUT_S", "300"))
+
+# Fallos con los que se envía el video original en lugar de la versión reducida
+# (ffmpeg ausente, archivo corrupto, tiempo agotado o proceso del pool caído).
+# SubprocessError cubre CalledProcessError y TimeoutExpired; OSError, el binario ausente
+# o sin permisos. Otros errores son fallos de código y no se ocultan.
+ERRORES_FFMPEG = (subprocess.SubprocessError, OSError, BrokenProcessPool)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def opciones_preproceso() -> dict:
+    """Opciones vigentes; forman parte de la llave del caché de resultados."""
+    return {
+        "max_alto": VIDEO_MAX_ALTO,
+        "fps": VIDEO_FPS,
+        "recortar_estaticos": VIDEO_RECORTAR_ESTATICOS,
+        "keyframes": VIDEO_KEYFRAMES,
+        "extraer_audio": VIDEO_EXTRAER_AUDIO,
+    }
+
+
+def _ejecutar(comando: List[str]) -> subprocess.CompletedProcess:
+    return subprocess.run(comando, capture_output=True, check=True, timeout=VIDEO_FFMPEG_TIMEOUT_S)
+
+
+def sondear(ruta: str) -> dict:
+    """Duración, resolución, fps y presencia de audio según ffprobe."""
+    salida = _ejecutar([
+        "ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", ruta,
+    ])
+    try:
+        info = json.loads(salida.stdout or b"{}")
+        video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), {})
+        num, _, den = (video.get("avg_frame_rate") or "0/1").partition("/")
+        return {
+            "duracion_s": float(info.get("format", {}).get("duration") or 0.0),
+            "ancho": int(video.get("width") or 0),
+            "alto": int(video.get("height") or 0),
+            "fps": float(num) / float(den) if float(den or 0) else 0.0,
+            "codec": video.get("codec_name"),
+            "tiene_audio": any(s.get("codec_type") == "audio" for s in info.get("streams", [])),
+        }
+    except ValueError as e:
+        # Salida de ffprobe ilegible (archivo corrupto): se trata como un fallo de ffprobe
+        raise subprocess.SubprocessError(f"ffprobe devolvió una salida ilegible: {e}") from e
+
+
+def _filtro_video(sondeo: dict, opciones: dict) -> str:
+    filtros = []
+    if sondeo["fps"] > opciones["fps"]:
+        filtros.append(f"fps={opciones['fps']}")
+    if opciones["recortar_estaticos"]:
+        # Descarta cuadros casi idénticos al anterior y compacta las marcas de tiempo
+        filtros += ["mpdecimate", "setpts=N/FRAME_RATE/TB"]
+    if sondeo["alto"] > opciones["max_alto"]:
+        filtros.append(f"scale=-2:{opciones['max_alto']}")
+    return ",".join(filtros)
+
+
+def _transcodificar(entrada: str, salida: str, sondeo: dict, opciones: dict) -> bool:
+    filtro = _filtro_video(sondeo, opciones)
+    if not filtro:
+        return False
+    comando = ["ffmpeg", "-v", "error", "-y", "-i", entrada, "-vf", filtro]
+    if opciones["recortar_estaticos"]:
+        # Con tramos recortados el audio quedaría desfasado: va por la pista separada
+        comando += ["-an", "-vsync", "vfr"]
+    else:
+        comando += ["-c:a", "aac", "-b:a", "64k", "-ac", "1"]
+    comando += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "28", "-movflags", "+faststart", salida]
+    _ejecutar(comando)
+    return True
+
+
+def _extraer_keyframes(entrada: str, directorio: str, maximo: int, max_alto: int) -> List[bytes]:
+    patron = os.path.join(directorio, "keyframe_%03d.jpg")
+    _ejecutar([
+        "ffmpeg", "-v", "error", "-y", "-skip_frame", "nokey", "-i", entrada,
+        "-vf", f"scale=-2:'min({max_alto},ih)'", "-vsync", "vfr", "-frames:v", str(maximo), "-q:v", "4", patron,
+    ])
+    keyframes = []
+    for ruta in sorted(glob.glob(os.path.join(directorio, "keyframe_*.jpg"))):
+        with open(ruta, "rb") as file:
+            keyframes.append(file.read())
+    return keyframes
+
+
+def _extraer_audio(entrada: str, salida: str) -> bytes:
+    _ejecutar(["ffmpeg", "-v", "error", "-y", "-i", entrada, "-vn", "-ac", "1", "-ar", "16000", "-c:a", "libmp3lame", "-b:a", "48k", salida])
+    with open(salida, "rb") as file:
+        return file.read()
+
+
+def preprocesar_video_bytes(data: bytes, opciones: dict) -> dict:
+    """
+    Sondea, reduce y recorta el video. Se ejecuta en un proceso del pool.
+    Si la versión reducida no es más liviana se conserva el original.
+    """
+    with tempfile.TemporaryDirectory(prefix="video_prep_") as directorio:
+        entrada = os.path.join(directorio, "entrada")
+        with open(entrada, "wb") as file:
+            file.write(data)
+
+        sondeo = sondear(entrada)
+        resultado = {"sondeo": sondeo, "bytes_original": len(data), "video": data, "mime": None, "keyframes": [], "audio": None}
+
+        salida = os.path.join(directorio, "salida.mp4")
+        if _transcodificar(entrada, salida, sondeo, opciones):
+            with open(salida, "rb") as file:
+                reducido = file.read()
+            if reducido and len(reducido) < len(data):
+                resultado["video"] = reducido
+                resultado["mime"] = "video/mp4"
+
+        if opciones["keyframes"] > 0:
+            resultado["keyframes"] = _extraer_keyframes(entrada, directorio, opciones["keyframes"], opciones["max_alto"])
+        if opciones["extraer_audio"] and sondeo["tiene_audio"]:
+            resultado["audio"] = _extraer_audio(entrada, os.path.join(directorio, "audio.mp3"))
+
+        resultado["bytes_final"] = len(resultado["video"])
+        return resultado
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # "spawn": un fork del proceso con hilos de gRPC/HTTP activos no es seguro;
+                # el hijo solo importa este módulo (biblioteca estándar)
+                _pool = ProcessPoolExecutor(max_workers=VIDEO_PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _descartar_pool(pool: ProcessPoolExecutor):
+    # Un pool roto (proceso hijo muerto, p. ej. por OOM) no acepta más trabajos: se recrea
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def preprocesar_video(data: bytes) -> dict:
+    pool = _get_pool()
+    try:
+        return pool.submit(preprocesar_video_bytes, data, opciones_preproceso()).result()
+    except BrokenProcessPool:
+        _descartar_pool(pool)
+        raise
+
+
+async def preprocesar_video_async(data: bytes) -> dict:
+    """La transcodificación corre en otro proceso: no bloquea el event loop ni compite por el GIL."""
+    pool = _get_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, preprocesar_video_bytes, data, opciones_preproceso())
+    except BrokenProcessPool:
+        _descartar_pool(pool)
+        raise
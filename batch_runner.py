@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Re-adjudicación masiva de casos desde un archivo JSONL de CaseRequest.")
+    parser.add_argument("--input", default="requests.jsonl", help="Archivo JSONL de entrada ('-' para stdin).")
+    parser.add_argument("--output", default="resultados.jsonl", help="Archivo JSONL de salida (se escribe a medida que termina cada caso).")
+    parser.add_argument("--concurrencia-casos", type=int, default=8, help="Casos procesados en paralelo.")
+    parser.add_argument("--concurrencia-modelo", type=int, default=None, help="Llamadas simultáneas por modelo (LLM_MAX_CONCURRENCY; LLM_MAX_CONCURRENCY_<MODELO> sigue aplicando).")
+    parser.add_argument("--no-reanudar", action="store_true", help="Reprocesa también los casos ya completados en la salida.")
+    return parser.parse_args()
+
+
+def leer_completados(ruta_salida: str) -> set:
+    """case_id que ya terminaron con éxito en una corrida anterior."""
+    completados = set()
+    if not os.path.exists(ruta_salida):
+        return completados
+    with open(ruta_salida, "r", encoding="utf-8") as file:
+        for linea in file:
+            try:
+                registro = json.loads(linea)
+            except ValueError:
+                continue  # última línea truncada por una interrupción
+            if registro.get("ok"):
+                completados.add(registro.get("case_id"))
+    return completados
+
+
+def leer_entrada(ruta_entrada: str):
+    archivo = sys.stdin if ruta_entrada == "-" else open(ruta_entrada, "r", encoding="utf-8")
+    try:
+        for numero, linea in enumerate(archivo, start=1):
+            if linea.strip():
+                yield numero, linea
+    finally:
+        if archivo is not sys.stdin:
+            archivo.close()
+
+
+async def main():
+    args = parse_args()
+    if args.concurrencia_modelo:
+        # Debe fijarse antes de importar los módulos que leen la configuración
+        os.environ["LLM_MAX_CONCURRENCY"] = str(args.concurrencia_modelo)
+
+    from app.commons.services.estadistica import percentil
+    from app.commons.services.llm_manager import load_llms
+    from app.commons.services.matrix_loader import cargar_matriz_marcus
+    from app.commons.services.prompt_registry import registry as prompt_registry
+    from app.Funciones.Procesar_circunstancias import preparar_cache_marcus
+    from app.Funciones.pipeline_caso import CaseRequest, ejecutar_caso
+
+    # Recursos cargados una sola vez para todo el lote
+    prompt_registry.cargar()
+    llms = load_llms()
+    contexto_marcus = cargar_matriz_marcus("app/utils/Descripción Circunstancias.xlsx")
+    preparar_cache_marcus(llms, contexto_marcus)
+
+    completados = set() if args.no_reanudar else leer_completados(args.output)
+    if completados:
+        print(f"⏭️ [BATCH] {len(completados)} casos ya completados en {args.output}, se omiten", flush=True)
+
+    limite = asyncio.Semaphore(args.concurrencia_casos)
+    lock_salida = asyncio.Lock()
+    latencias = []
+    fallos = {"pipeline": 0, "entrada_invalida": 0}
+    contadores = {"ok": 0, "omitidos": 0}
+
+    salida = open(args.output, "a", encoding="utf-8")
+
+    async def escribir(registro: dict):
+        async with lock_salida:
+            salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            salida.flush()
+
+    async def procesar(request):
+        async with limite:
+            t_inicio = time.perf_counter()
+            try:
+                respuesta = await ejecutar_caso(request, llms, contexto_marcus)
+                latencia = time.perf_counter() - t_inicio
+                ok = "error" not in (respuesta.get("resultado") or {})
+                registro = {"case_id": request.case_id, "ok": ok, "latencia_s": round(latencia, 3), "respuesta": respuesta}
+            except Exception as e:
+                latencia = time.perf_counter() - t_inicio
+                ok = False
+                registro = {"case_id": request.case_id, "ok": False, "latencia_s": round(latencia, 3), "error": str(e)}
+
+            latencias.append(latencia)
+            if ok:
+                contadores["ok"] += 1
+            else:
+                fallos["pipeline"] += 1
+                print(f"❌ [BATCH] Caso {request.case_id} falló", flush=True)
+            await escribir(registro)
+
+    t_lote = time.perf_counter()
+    tareas = set()
+    vistos = set()
+    try:
+        for numero, linea in leer_entrada(args.input):
+            try:
+                request = CaseRequest(**json.loads(linea))
+            except Exception as e:
+                fallos["entrada_invalida"] += 1
+                print(f"⚠️ [BATCH] Línea {numero} inválida: {e}", flush=True)
+                continue
+            if request.case_id in completados or request.case_id in vistos:
+                contadores["omitidos"] += 1
+                continue
+            vistos.add(request.case_id)
+
+            # Se acota también la cantidad de tareas creadas para no cargar todo el archivo en memoria
+            while len(tareas) >= args.concurrencia_casos * 2:
+                _, tareas = await asyncio.wait(tareas, return_when=asyncio.FIRST_COMPLETED)
+            tareas.add(asyncio.create_task(procesar(request)))
+
+        if tareas:
+            await asyncio.wait(tareas)
+    finally:
+        salida.close()
+
+    duracion = time.perf_counter() - t_lote
+    procesados = len(latencias)
+    print("\n" + "=" * 50)
+    print("📊 [BATCH] RESUMEN")
+    print("=" * 50)
+    print(f"   - Procesados: {procesados} (ok: {contadores['ok']}, omitidos por reanudación: {contadores['omitidos']})")
+    print(f"   - Fallos: pipeline={fallos['pipeline']}, entrada_invalida={fallos['entrada_invalida']}")
+    print(f"   - Duración: {duracion:.1f}s | Throughput: {procesados / duracion * 60 if duracion else 0:.1f} casos/min")
+    print(f"   - Latencia p50: {percentil(latencias, 0.50):.2f}s | p95: {percentil(latencias, 0.95):.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
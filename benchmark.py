@@ -0,0 +1,434 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import hashlib
+import statistics
+
+
+# Benchmark offline de la API: mainAPI corre en el mismo proceso contra dobles locales
+# de storage.Client y GenerativeModel, sin credenciales ni proyecto de Vertex.
+# Cada escenario fija latencias (log-normales: mediana y p95), tasas de error y tamaños de
+# la evidencia, y se ejecuta con concurrencia fija (lazo cerrado) o tasa de llegada (Poisson).
+ESCENARIOS_POR_DEFECTO = [
+    {
+        "nombre": "caso_tipico_c8",
+        "modo": "concurrencia",
+        "concurrencia": 8,
+        "casos": 64,
+        "evidencia": {"visuales": 3, "audios": 1, "videos": 1},
+    },
+    {
+        "nombre": "caso_tipico_c32",
+        "modo": "concurrencia",
+        "concurrencia": 32,
+        "casos": 128,
+        "evidencia": {"visuales": 3, "audios": 1, "videos": 1},
+    },
+    {
+        "nombre": "llegadas_4_por_s",
+        "modo": "tasa",
+        "tasa_por_s": 4,
+        "casos": 80,
+        "evidencia": {"visuales": 4, "audios": 2, "videos": 0},
+    },
+    {
+        "nombre": "errores_5pct",
+        "modo": "concurrencia",
+        "concurrencia": 16,
+        "casos": 64,
+        "modelo": {"tasa_error": 0.05},
+        "evidencia": {"visuales": 2, "audios": 1, "videos": 1},
+    },
+]
+
+# Valores por defecto de cada escenario (latencias en segundos, tamaños en bytes)
+BASE_ESCENARIO = {
+    "modo": "concurrencia",
+    "concurrencia": 8,
+    "tasa_por_s": 2.0,
+    "casos": 32,
+    "gcs": {"mediana_s": 0.04, "p95_s": 0.15, "tasa_error": 0.0},
+    "modelo": {"mediana_s": 1.5, "p95_s": 4.0, "tasa_error": 0.0, "tokens_salida": 600},
+    "marcus": {"mediana_s": 4.0, "p95_s": 9.0},
+    "tamanos": {"visual": 400_000, "audio": 1_500_000, "video": 8_000_000},
+    "evidencia": {"visuales": 2, "audios": 1, "videos": 1},
+}
+
+# Firmas para que la detección de MIME por contenido funcione como con archivos reales
+_CABECERAS = {
+    "visual": b"\xff\xd8\xff\xe0\x00\x10JFIF\x00",
+    "audio": b"ID3\x04\x00\x00\x00\x00\x00\x00",
+    "video": b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00",
+}
+_EXTENSIONES = {"visual": "jpg", "audio": "mp3", "video": "mp4"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark offline de mainAPI con GCS y Gemini simulados.")
+    parser.add_argument("--escenarios", default=None, help="JSON con la lista de escenarios (por defecto, los integrados).")
+    parser.add_argument("--solo", nargs="*", default=None, help="Nombres de los escenarios a ejecutar.")
+    parser.add_argument("--escala-tiempo", type=float, default=1.0, help="Multiplica todas las latencias simuladas (p. ej. 0.1 para una corrida rápida).")
+    parser.add_argument("--sin-cuotas", action="store_true", help="Desactiva los límites RPM/TPM del scheduler (mide solo la sobrecarga de la API).")
+    parser.add_argument("--calentamiento", type=int, default=2, help="Casos previos sin medir (imports diferidos, pools, cachés de prompts).")
+    parser.add_argument("--semilla", type=int, default=7, help="Semilla de las distribuciones simuladas.")
+    parser.add_argument("--salida", default=None, help="Archivo JSON donde guardar el reporte.")
+    parser.add_argument("--base", default=None, help="Reporte anterior contra el que se comparan p95 y throughput.")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="Regresión máxima aceptada respecto a --base (fracción).")
+    return parser.parse_args()
+
+
+def combinar(base: dict, escenario: dict) -> dict:
+    combinado = {}
+    for llave in set(base) | set(escenario):
+        valor = escenario.get(llave, base.get(llave))
+        if isinstance(base.get(llave), dict) and isinstance(valor, dict):
+            valor = {**base[llave], **valor}
+        combinado[llave] = valor
+    return combinado
+
+
+class Latencia:
+    """Distribución log-normal definida por su mediana y su p95."""
+
+    def __init__(self, rng: random.Random, mediana_s: float, p95_s: float, escala: float):
+        self.rng = rng
+        self.mu = math.log(max(mediana_s, 1e-6) * escala)
+        self.sigma = max(0.0, math.log(max(p95_s, mediana_s) / max(mediana_s, 1e-6)) / 1.645)
+
+    def muestra(self) -> float:
+        return self.rng.lognormvariate(self.mu, self.sigma)
+
+
+# --- Dobles de Google Cloud Storage ---
+
+class BlobSimulado:
+    def __init__(self, almacen: "StorageSimulado", bucket: str, nombre: str):
+        self.almacen = almacen
+        self.name = nombre
+        self.modalidad = nombre.split("/")[-2] if nombre.count("/") >= 1 else "visual"
+        self.size = almacen.tamanos.get(self.modalidad, 100_000)
+        self.md5_hash = hashlib.md5(f"{bucket}/{nombre}".encode()).hexdigest()
+        self.generation = 1
+        self.content_type = None
+
+    def reload(self, **kwargs):
+        time.sleep(self.almacen.latencia.muestra() / 4)
+
+    def download_as_bytes(self, **kwargs) -> bytes:
+        time.sleep(self.almacen.latencia.muestra())
+        if self.almacen.rng.random() < self.almacen.tasa_error:
+            from google.api_core import exceptions
+            raise exceptions.ServiceUnavailable("GCS simulado no disponible")
+        cabecera = _CABECERAS.get(self.modalidad, b"")
+        return cabecera + b"\x00" * max(0, self.size - len(cabecera))
+
+
+class BucketSimulado:
+    def __init__(self, almacen: "StorageSimulado", nombre: str):
+        self.almacen = almacen
+        self.name = nombre
+
+    def blob(self, nombre: str) -> BlobSimulado:
+        return BlobSimulado(self.almacen, self.name, nombre)
+
+
+class StorageSimulado:
+    """Reemplaza a storage.Client: mismas llamadas que usa gcs_fetcher."""
+
+    def __init__(self, rng: random.Random, gcs: dict, tamanos: dict, escala: float):
+        self.rng = rng
+        self.latencia = Latencia(rng, gcs["mediana_s"], gcs["p95_s"], escala)
+        self.tasa_error = gcs["tasa_error"]
+        self.tamanos = tamanos
+
+    def bucket(self, nombre: str) -> BucketSimulado:
+        return BucketSimulado(self, nombre)
+
+
+# --- Dobles de Vertex AI ---
+
+class UsoSimulado:
+    def __init__(self, entrada: int, salida: int):
+        self.prompt_token_count = entrada
+        self.candidates_token_count = salida
+        self.total_token_count = entrada + salida
+
+
+class RespuestaSimulada:
+    def __init__(self, texto: str, uso: UsoSimulado):
+        self.text = texto
+        self.usage_metadata = uso
+
+
+def respuesta_segun_esquema(esquema: dict):
+    """Respuesta mínima que cumple un response_schema de Vertex (la primera opción de cada enum)."""
+    tipo = esquema["type_"]
+    if "enum" in esquema:
+        return esquema["enum"][0]
+    if tipo == "OBJECT":
+        return {campo: respuesta_segun_esquema(sub) for campo, sub in esquema.get("properties", {}).items()}
+    if tipo == "ARRAY":
+        return [respuesta_segun_esquema(esquema["items"])]
+    return {"STRING": "x" * 40, "NUMBER": 0.0, "INTEGER": 0, "BOOLEAN": False}[tipo]
+
+
+class ModeloSimulado:
+    """
+    Reemplaza a GenerativeModel: generate_content y generate_content_async con latencia y errores simulados.
+    Las solicitudes solo de texto (la adjudicación Marcus) usan `latencia_texto` si se indica.
+    """
+
+    def __init__(self, nombre: str, rng: random.Random, latencia: Latencia, tasa_error: float, tokens_salida: int, latencia_texto: Latencia = None):
+        self._model_name = nombre
+        self.rng = rng
+        self.latencia = latencia
+        self.latencia_texto = latencia_texto
+        self.tasa_error = tasa_error
+        self.tokens_salida = tokens_salida
+
+    def _espera(self, contents) -> float:
+        solo_texto = isinstance(contents, str) or all(isinstance(parte, str) for parte in contents)
+        return (self.latencia_texto if solo_texto and self.latencia_texto else self.latencia).muestra()
+
+    def _responder(self, contents, generation_config=None):
+        if self.rng.random() < self.tasa_error:
+            from google.api_core import exceptions
+            raise exceptions.ServiceUnavailable("Vertex simulado no disponible")
+        from app.commons.services.llm_scheduler import estimar_tokens
+        esquema = (generation_config or {}).get("response_schema")
+        if esquema is not None:
+            # Con salida estructurada la respuesta cumple el esquema, como en Vertex
+            texto = json.dumps(respuesta_segun_esquema(esquema), ensure_ascii=False)
+        else:
+            texto = json.dumps({"modelo": self._model_name, "simulado": True, "hallazgos": ["x" * 40] * 5})
+        return RespuestaSimulada(texto, UsoSimulado(estimar_tokens(contents), self.tokens_salida))
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        time.sleep(self._espera(contents))
+        return self._responder(contents, generation_config)
+
+    async def generate_content_async(self, contents, generation_config=None, **kwargs):
+        await asyncio.sleep(self._espera(contents))
+        return self._responder(contents, generation_config)
+
+
+def instalar_dobles(escenario: dict, rng: random.Random, escala: float) -> dict:
+    """Conecta los dobles al fetcher de GCS y arma los recursos de modelos como load_llms."""
+    from app.commons.services import gcs_fetcher
+    from app.commons.services.miscelaneous import load_llm_parameters
+
+    gcs_fetcher._client = StorageSimulado(rng, escenario["gcs"], escenario["tamanos"], escala)
+    modelo, marcus = escenario["modelo"], escenario["marcus"]
+    latencia_modelo = Latencia(rng, modelo["mediana_s"], modelo["p95_s"], escala)
+    latencia_marcus = Latencia(rng, marcus["mediana_s"], marcus["p95_s"], escala)
+    return {
+        "gemini_pro": ModeloSimulado("gemini-2.5-pro", rng, latencia_modelo, modelo["tasa_error"], modelo["tokens_salida"], latencia_marcus),
+        "gemini_flash": ModeloSimulado("gemini-2.5-flash", rng, latencia_modelo, modelo["tasa_error"], modelo["tokens_salida"]),
+        "config": {
+            "labels": {"billing-tag": "benchmark"},
+            "params_pro": load_llm_parameters("gemini-2.5-pro").get("model_parameters", {}),
+            "params_flash": load_llm_parameters("gemini-2.5-flash").get("model_parameters", {}),
+        },
+    }
+
+
+def ajustar_cuotas(escala: float, sin_cuotas: bool):
+    """
+    Las cuotas RPM/TPM del scheduler se escalan igual que las latencias simuladas,
+    para que una corrida acelerada conserve la proporción entre cuota y duración.
+    """
+    from app.commons.services.llm_scheduler import scheduler
+
+    for model_name in ("gemini-2.5-pro", "gemini-2.5-flash"):
+        limites = scheduler.limites(model_name)
+        if sin_cuotas:
+            limites.solicitudes = limites.tokens = None
+            continue
+        for cubeta in (limites.solicitudes, limites.tokens):
+            if cubeta is not None:
+                cubeta.tasa_por_s /= escala
+
+
+def construir_caso(escenario: str, indice: int, evidencia: dict) -> dict:
+    # Rutas únicas por caso: cada caso es un fallo del caché de resultados, como en producción
+    def _uris(modalidad, cantidad):
+        return [f"gs://bench/{escenario}/c{indice}/{modalidad}/{n}.{_EXTENSIONES[modalidad]}" for n in range(cantidad)]
+
+    return {
+        "case_id": f"{escenario}-{indice}",
+        "urls_visuales": _uris("visual", evidencia.get("visuales", 0)),
+        "urls_audios": _uris("audio", evidencia.get("audios", 0)),
+        "urls_videos": _uris("video", evidencia.get("videos", 0)),
+    }
+
+
+def rss_mb() -> float:
+    """Memoria residente actual del proceso (Linux)."""
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+async def muestrear_memoria(pico: dict, intervalo_s: float = 0.05):
+    while True:
+        pico["rss_mb"] = max(pico["rss_mb"], rss_mb())
+        await asyncio.sleep(intervalo_s)
+
+
+async def ejecutar_escenario(cliente, escenario: dict, rng: random.Random) -> dict:
+    from app.commons.services.estadistica import percentil
+
+    latencias, estados = [], {}
+    casos = [construir_caso(escenario["nombre"], i, escenario["evidencia"]) for i in range(escenario["casos"])]
+
+    async def _enviar(caso):
+        t_inicio = time.perf_counter()
+        try:
+            respuesta = await cliente.post("/process-case", json=caso)
+            estado = str(respuesta.status_code)
+            if respuesta.status_code == 200 and respuesta.json().get("errores_modalidades"):
+                estado = "200_con_errores_modalidad"
+        except Exception as e:
+            estado = type(e).__name__
+        latencias.append(time.perf_counter() - t_inicio)
+        estados[estado] = estados.get(estado, 0) + 1
+
+    pico = {"rss_mb": rss_mb()}
+    rss_inicial = pico["rss_mb"]
+    muestreo = asyncio.create_task(muestrear_memoria(pico))
+    t_inicio = time.perf_counter()
+
+    if escenario["modo"] == "tasa":
+        # Lazo abierto: llegadas de Poisson, independientes de cuánto tarde la API
+        tareas = []
+        for caso in casos:
+            tareas.append(asyncio.create_task(_enviar(caso)))
+            await asyncio.sleep(rng.expovariate(escenario["tasa_por_s"]))
+        await asyncio.gather(*tareas)
+    else:
+        # Lazo cerrado: `concurrencia` clientes que envían el siguiente caso al terminar el anterior
+        cola = iter(casos)
+
+        async def _cliente():
+            for caso in cola:
+                await _enviar(caso)
+
+        await asyncio.gather(*(_cliente() for _ in range(escenario["concurrencia"])))
+
+    duracion = time.perf_counter() - t_inicio
+    muestreo.cancel()
+    return {
+        "escenario": escenario["nombre"],
+        "modo": escenario["modo"],
+        "concurrencia": escenario["concurrencia"] if escenario["modo"] != "tasa" else None,
+        "tasa_por_s": escenario["tasa_por_s"] if escenario["modo"] == "tasa" else None,
+        "casos": len(casos),
+        "duracion_s": round(duracion, 3),
+        "throughput_casos_s": round(len(casos) / duracion, 3) if duracion else 0.0,
+        "latencia_s": {
+            "media": round(statistics.mean(latencias), 3) if latencias else 0.0,
+            "p50": round(percentil(latencias, 0.50), 3),
+            "p90": round(percentil(latencias, 0.90), 3),
+            "p95": round(percentil(latencias, 0.95), 3),
+            "p99": round(percentil(latencias, 0.99), 3),
+            "max": round(max(latencias), 3) if latencias else 0.0,
+        },
+        "estados": estados,
+        "memoria_mb": {"rss_inicial": round(rss_inicial, 1), "rss_pico": round(pico["rss_mb"], 1)},
+    }
+
+
+def comparar_con_base(reportes: list, ruta_base: str, tolerancia: float) -> list:
+    """Regresiones de p95 o throughput respecto al reporte base, por escenario."""
+    with open(ruta_base, "r", encoding="utf-8") as file:
+        base = {r["escenario"]: r for r in json.load(file)["escenarios"]}
+    regresiones = []
+    for reporte in reportes:
+        previo = base.get(reporte["escenario"])
+        if previo is None:
+            continue
+        p95, p95_base = reporte["latencia_s"]["p95"], previo["latencia_s"]["p95"]
+        if p95_base and p95 > p95_base * (1 + tolerancia):
+            regresiones.append(f"{reporte['escenario']}: p95 {p95_base:.3f}s -> {p95:.3f}s")
+        thr, thr_base = reporte["throughput_casos_s"], previo["throughput_casos_s"]
+        if thr_base and thr < thr_base * (1 - tolerancia):
+            regresiones.append(f"{reporte['escenario']}: throughput {thr_base:.2f} -> {thr:.2f} casos/s")
+    return regresiones
+
+
+def imprimir_reporte(reporte: dict):
+    lat = reporte["latencia_s"]
+    print(
+        f"📊 [BENCH] {reporte['escenario']}: {reporte['casos']} casos en {reporte['duracion_s']:.1f}s | "
+        f"{reporte['throughput_casos_s']:.2f} casos/s | p50 {lat['p50']:.2f}s p95 {lat['p95']:.2f}s p99 {lat['p99']:.2f}s | "
+        f"RSS pico {reporte['memoria_mb']['rss_pico']:.0f}MB | estados {reporte['estados']}",
+        flush=True,
+    )
+
+
+async def main():
+    args = parse_args()
+    # Sin caché de contexto en Vertex: el prefijo Marcus no puede registrarse en los dobles
+    os.environ.setdefault("MARCUS_CONTEXT_CACHE", "0")
+
+    escenarios = ESCENARIOS_POR_DEFECTO
+    if args.escenarios:
+        with open(args.escenarios, "r", encoding="utf-8") as file:
+            escenarios = json.load(file)
+    escenarios = [combinar(BASE_ESCENARIO, e) for e in escenarios if not args.solo or e["nombre"] in args.solo]
+    if not escenarios:
+        print("❌ [BENCH] No hay escenarios para ejecutar", flush=True)
+        return 1
+
+    import httpx
+    import mainAPI
+    from app.commons.services.matrix_loader import cargar_matriz_marcus
+    from app.commons.services.prompt_registry import registry as prompt_registry
+
+    prompt_registry.cargar()
+    mainAPI.resources.CONTEXTO_MARCUS = cargar_matriz_marcus("app/utils/Descripción Circunstancias.xlsx")
+    ajustar_cuotas(args.escala_tiempo, args.sin_cuotas)
+
+    reportes = []
+    for escenario in escenarios:
+        rng = random.Random(args.semilla)
+        mainAPI.resources.LLMS = instalar_dobles(escenario, rng, args.escala_tiempo)
+        mainAPI.resources.IS_READY = True
+        print(f"🏋️ [BENCH] Escenario {escenario['nombre']} ({escenario['modo']})", flush=True)
+
+        # La API corre en este mismo proceso: sin red, el tiempo medido es el de mainAPI y app/Funciones
+        transporte = httpx.ASGITransport(app=mainAPI.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            if args.calentamiento and not reportes:
+                calentamiento = {**escenario, "nombre": "calentamiento", "modo": "concurrencia", "concurrencia": 1, "casos": args.calentamiento}
+                await ejecutar_escenario(cliente, calentamiento, rng)
+            reporte = await ejecutar_escenario(cliente, escenario, rng)
+        reportes.append(reporte)
+        imprimir_reporte(reporte)
+
+    resultado = {"escala_tiempo": args.escala_tiempo, "sin_cuotas": args.sin_cuotas, "semilla": args.semilla, "escenarios": reportes}
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as file:
+            json.dump(resultado, file, ensure_ascii=False, indent=2)
+        print(f"💾 [BENCH] Reporte guardado en {args.salida}", flush=True)
+
+    if args.base:
+        regresiones = comparar_con_base(reportes, args.base, args.tolerancia)
+        if regresiones:
+            for regresion in regresiones:
+                print(f"❌ [BENCH] Regresión: {regresion}", flush=True)
+            return 1
+        print(f"✅ [BENCH] Sin regresiones respecto a {args.base} (tolerancia {args.tolerancia:.0%})", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
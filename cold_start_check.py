@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+# Presupuesto de arranque en frío: importar la API y cargar la matriz sin tocar módulos pesados.
+# Se ejecuta en el build (cloudbuild.yaml) sobre la imagen recién construida.
+COLD_START_IMPORT_BUDGET_S = float(os.environ.get("COLD_START_IMPORT_BUDGET_S", "1.0"))
+
+# Módulos que no deben cargarse al importar mainAPI: se importan en la carga proactiva
+MODULOS_DIFERIDOS = ["vertexai", "google.cloud.aiplatform", "google.cloud.storage", "pandas", "openpyxl"]
+
+_MEDICION = """
+import sys, time, json
+t_inicio = time.perf_counter()
+import mainAPI
+t_import = time.perf_counter() - t_inicio
+cargados = [m for m in {diferidos!r} if m in sys.modules]
+
+from app.commons.services.matrix_loader import cargar_matriz_marcus, ruta_artefacto
+import os
+ruta_excel = "app/utils/Descripción Circunstancias.xlsx"
+t_inicio = time.perf_counter()
+cargar_matriz_marcus(ruta_excel)
+t_matriz = time.perf_counter() - t_inicio
+print(json.dumps({{
+    "import_s": t_import,
+    "matriz_s": t_matriz,
+    "cargados": cargados,
+    "artefacto": os.path.exists(ruta_artefacto(ruta_excel)),
+    "pandas_tras_matriz": "pandas" in sys.modules,
+}}))
+"""
+
+
+def medir() -> dict:
+    # Cada medición en un intérprete nuevo: es lo que paga una instancia al escalar desde cero
+    salida = subprocess.run(
+        [sys.executable, "-c", _MEDICION.format(diferidos=MODULOS_DIFERIDOS)],
+        capture_output=True, text=True, check=True,
+        env={**os.environ, "STARTUP_PROFILE": "0"},
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verifica el presupuesto de arranque en frío de la API.")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--presupuesto", type=float, default=COLD_START_IMPORT_BUDGET_S, help="Segundos máximos para importar mainAPI.")
+    args = parser.parse_args()
+
+    mediciones = [medir() for _ in range(args.repeticiones)]
+    import_s = statistics.median(m["import_s"] for m in mediciones)
+    matriz_s = statistics.median(m["matriz_s"] for m in mediciones)
+    ultima = mediciones[-1]
+
+    print(f"⏱️ [COLD_START] import mainAPI: {import_s:.3f}s (presupuesto {args.presupuesto:.3f}s)", flush=True)
+    print(f"⏱️ [COLD_START] matriz Marcus: {matriz_s:.3f}s (artefacto: {'sí' if ultima['artefacto'] else 'no'})", flush=True)
+
+    fallas = []
+    if import_s > args.presupuesto:
+        fallas.append(f"import mainAPI tardó {import_s:.3f}s")
+    if ultima["cargados"]:
+        fallas.append(f"módulos pesados importados al cargar mainAPI: {', '.join(ultima['cargados'])}")
+    if ultima["artefacto"] and ultima["pandas_tras_matriz"]:
+        fallas.append("la matriz se cargó con pandas pese a existir el artefacto")
+
+    if fallas:
+        for falla in fallas:
+            print(f"❌ [COLD_START] {falla}", flush=True)
+        sys.exit(1)
+    print("✅ [COLD_START] Dentro del presupuesto", flush=True)
+
+
+if __name__ == "__main__":
+    main()
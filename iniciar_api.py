@@ -0,0 +1,28 @@
+import os
+import sys
+import shutil
+
+
+# Arranque de la API en el contenedor (CMD del Dockerfile).
+#   PROMETHEUS_MULTIPROC_DIR: directorio donde los workers de uvicorn comparten sus métricas de /metrics.
+#   Solo la API lo usa: los jobs del mismo contenedor (job_runner.py, batch_runner.py) son un único
+#   proceso y exportan con el registro normal, sin dejar archivos en el directorio.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_metrics")
+
+UVICORN = ["-m", "uvicorn", "mainAPI:app", "--host", "0.0.0.0", "--port", "8080", "--workers", "2", "--timeout-keep-alive", "650"]
+
+
+def main():
+    # Se vacía antes de que arranque cualquier worker: los archivos de procesos de un arranque
+    # anterior seguirían sumándose en /metrics
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = PROMETHEUS_MULTIPROC_DIR
+    print(f"📈 [METRICAS] Directorio multiproceso limpio: {PROMETHEUS_MULTIPROC_DIR}", flush=True)
+
+    # uvicorn reemplaza a este proceso (las señales de Cloud Run le llegan directo)
+    os.execv(sys.executable, [sys.executable, *UVICORN, *sys.argv[1:]])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+
+# Cloud Run Jobs reparte las tareas de una ejecución con estas variables
+TASK_INDEX = int(os.environ.get("CLOUD_RUN_TASK_INDEX", "0"))
+TASK_COUNT = int(os.environ.get("CLOUD_RUN_TASK_COUNT", "1"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Job único multi-etapa: extracciones (audio/visual/video) → Marcus en un solo proceso.")
+    parser.add_argument("--casos", required=True, help="Manifiesto de CaseRequest (JSON con lista o JSONL), local o gs://.")
+    parser.add_argument("--artefactos", required=True, help="Directorio de artefactos, local o gs://bucket/prefijo.")
+    parser.add_argument("--concurrencia-casos", type=int, default=int(os.environ.get("JOB_CONCURRENCIA_CASOS", "4")))
+    return parser.parse_args()
+
+
+def leer_manifiesto(origen: str) -> list:
+    if origen.startswith("gs://"):
+        from app.commons.services.gcs_fetcher import descargar_blob
+        contenido = descargar_blob(origen).decode("utf-8")
+    else:
+        with open(origen, "r", encoding="utf-8") as file:
+            contenido = file.read()
+
+    contenido = contenido.strip()
+    if contenido.startswith("["):
+        return json.loads(contenido)
+    return [json.loads(linea) for linea in contenido.splitlines() if linea.strip()]
+
+
+async def procesar_caso(request, llms: dict, contexto_marcus: str, store) -> bool:
+    from app.Funciones.pipeline_caso import ejecutar_caso_eventos, nombres_modalidades
+
+    case_id = request.case_id
+    if await asyncio.to_thread(store.existe, f"{case_id}/veredicto.json"):
+        print(f"⏭️ [JOB] Caso {case_id} ya tiene veredicto, se omite", flush=True)
+        return True
+
+    # Extracciones que terminaron bien en una ejecución anterior de la tarea
+    previos = {}
+    for nombre in nombres_modalidades(request):
+        artefacto = await asyncio.to_thread(store.leer_json, f"{case_id}/{nombre}.json")
+        if artefacto is not None:
+            previos[nombre] = artefacto["resultado"]
+    if previos:
+        print(f"♻️ [JOB] Caso {case_id}: se reutilizan {len(previos)} extracciones previas", flush=True)
+
+    veredicto = None
+    async for evento in ejecutar_caso_eventos(request, llms, contexto_marcus, previos=previos):
+        if evento["evento"] == "modalidad" and evento["ok"] and evento["nombre"] not in previos:
+            await asyncio.to_thread(store.escribir_json, f"{case_id}/{evento['nombre']}.json", {
+                "nombre": evento["nombre"],
+                "latencia_s": evento["latencia_s"],
+                "resultado": evento["resultado"],
+            })
+        elif evento["evento"] == "veredicto":
+            veredicto = {k: v for k, v in evento.items() if k != "evento"}
+
+    if "error" in (veredicto.get("resultado") or {}):
+        # Sin veredicto persistido: el reintento de la tarea vuelve a evaluar con las extracciones guardadas
+        await asyncio.to_thread(store.escribir_json, f"{case_id}/error_marcus.json", veredicto)
+        print(f"❌ [JOB] Caso {case_id}: Marcus no entregó un veredicto válido", flush=True)
+        return False
+
+    ruta = await asyncio.to_thread(store.escribir_json, f"{case_id}/veredicto.json", veredicto)
+    print(f"✅ [JOB] Caso {case_id} → {ruta}", flush=True)
+    return True
+
+
+async def main():
+    args = parse_args()
+
+    from app.commons.services.artifact_store import ArtifactStore
+    from app.commons.services.llm_manager import load_llms
+    from app.commons.services.matrix_loader import cargar_matriz_marcus
+    from app.commons.services.prompt_registry import registry as prompt_registry
+    from app.Funciones.Procesar_circunstancias import preparar_cache_marcus
+    from app.Funciones.pipeline_caso import CaseRequest
+
+    casos = [CaseRequest(**caso) for caso in leer_manifiesto(args.casos)]
+    casos = casos[TASK_INDEX::TASK_COUNT]
+    print(f"📋 [JOB] Tarea {TASK_INDEX + 1}/{TASK_COUNT}: {len(casos)} casos", flush=True)
+
+    # Recursos cargados una sola vez para todos los casos de la tarea
+    prompt_registry.cargar()
+    llms = load_llms()
+    contexto_marcus = cargar_matriz_marcus("app/utils/Descripción Circunstancias.xlsx")
+    preparar_cache_marcus(llms, contexto_marcus)
+    store = ArtifactStore(args.artefactos)
+
+    limite = asyncio.Semaphore(args.concurrencia_casos)
+    fallidos = []
+
+    async def _con_limite(request):
+        async with limite:
+            try:
+                ok = await procesar_caso(request, llms, contexto_marcus, store)
+            except Exception as e:
+                print(f"❌ [JOB] Caso {request.case_id} falló: {e}", flush=True)
+                ok = False
+            if not ok:
+                fallidos.append(request.case_id)
+
+    t_inicio = time.perf_counter()
+    await asyncio.gather(*(_con_limite(request) for request in casos))
+    duracion = time.perf_counter() - t_inicio
+
+    store.escribir_json(f"_resumen/tarea_{TASK_INDEX}.json", {
+        "casos": len(casos),
+        "fallidos": fallidos,
+        "duracion_s": round(duracion, 2),
+    })
+    print(f"🏁 [JOB] {len(casos) - len(fallidos)}/{len(casos)} casos completados en {duracion:.1f}s", flush=True)
+
+    # Código de salida distinto de cero para que Cloud Run reintente la tarea (los casos completos se omiten)
+    if fallidos:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -15,6 +15,7 @@ from fastapi.concurrency import run_in_threadpool
 # --- TU PROYECTO ---
 from app.commons.services.llm_manager import load_llms
 from app.commons.services.matrix_loader import cargar_matriz_marcus
+from app.commons.services.prompt_registry import registry as prompt_registry
 
 from app.Funciones.procesar_audio import transcribir_audio_gemini
 from app.Funciones.procesar_imagen import procesar_evidencia_visual  # Función actualizada para bytes
@@ -35,6 +36,7 @@ async def lifespan(app: FastAPI):
 
     # 1) Carga independiente de LLMs (Flash y Pro)
     try:
+        prompt_registry.cargar()
         app.state.llms = load_llms()
         if not app.state.llms.get("gemini_flash") or not app.state.llms.get("gemini_pro"):
             raise RuntimeError("Faltan modelos Gemini en la configuración")
@@ -3,125 +3,203 @@ import time
 import json
 import traceback
 import asyncio
-from typing import List
-from pydantic import BaseModel
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+# Primero el perfilador: con STARTUP_PROFILE=1 mide también los imports siguientes
+from app.commons.services.startup_profiler import startup_profiler
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.concurrency import run_in_threadpool
-from google.cloud import storage
 
 from app.commons.services.llm_manager import load_llms
 from app.commons.services.matrix_loader import cargar_matriz_marcus
-from app.Funciones.procesar_audio import transcribir_audio_gemini
-from app.Funciones.procesar_imagen import procesar_evidencia_visual
-from app.Funciones.procesar_video import procesar_video_gemini
-from app.Funciones.Procesar_circunstancias import evaluar_circunstancias_marcus
+from app.commons.services.prompt_registry import registry as prompt_registry
+from app.commons.services.gcs_fetcher import get_storage_client
+from app.commons.services.result_cache import result_cache
+from app.commons.services import metricas
+from app.commons.services.llm_cassette import cassette
+from app.commons.services.llm_hedging import hedger
+from app.Funciones.Procesar_circunstancias import preparar_cache_marcus
+from app.commons.services.job_queue import JobQueue
+from app.Funciones.pipeline_caso import CaseRequest, ejecutar_caso, ejecutar_caso_eventos
+from app.Funciones.job_worker import JobWorkerPool
 
 
 class GlobalResources:
     LLMS = None
     CONTEXTO_MARCUS = None
     IS_READY = False
+    JOBS = None
+    JOB_WORKERS = None
 
 
 resources = GlobalResources()
 
+# Segundos sin eventos tras los cuales el stream envía un latido (evita cortes de proxies)
+STREAM_HEARTBEAT_S = float(os.environ.get("STREAM_HEARTBEAT_S", "15"))
+# Cada cuánto /process-case comprueba si el cliente sigue conectado (si se fue, el caso se cancela)
+DISCONNECT_POLL_S = float(os.environ.get("DISCONNECT_POLL_S", "1.0"))
+
 
 async def cargar_recursos_proactivamente():
     t_start = time.perf_counter()
     print("\n⚡ [SISTEMA] Iniciando carga proactiva de recursos...", flush=True)
     try:
-        resources.LLMS = await run_in_threadpool(load_llms)
-        resources.CONTEXTO_MARCUS = await run_in_threadpool(
-            cargar_matriz_marcus, "app/utils/Descripción Circunstancias.xlsx"
-        )
+        with startup_profiler.etapa("prompts"):
+            await run_in_threadpool(prompt_registry.cargar)
+        with startup_profiler.etapa("llms"):
+            resources.LLMS = await run_in_threadpool(load_llms)
+        with startup_profiler.etapa("storage_client"):
+            await run_in_threadpool(get_storage_client)
+        with startup_profiler.etapa("matriz_marcus"):
+            resources.CONTEXTO_MARCUS = await run_in_threadpool(
+                cargar_matriz_marcus, "app/utils/Descripción Circunstancias.xlsx"
+            )
+        with startup_profiler.etapa("cache_marcus"):
+            await run_in_threadpool(preparar_cache_marcus, resources.LLMS, resources.CONTEXTO_MARCUS)
         resources.IS_READY = True
+        startup_profiler.marcar_listo()
         print(f"✅ [SISTEMA] Recursos listos en {time.perf_counter() - t_start:.2f}s", flush=True)
+
+        # Los workers de la cola solo arrancan con los modelos y la matriz cargados
+        if resources.JOBS is not None:
+            resources.JOB_WORKERS = JobWorkerPool(resources.JOBS, lambda: (resources.LLMS, resources.CONTEXTO_MARCUS))
+            resources.JOB_WORKERS.iniciar()
     except Exception as e:
         print(f"❌ [SISTEMA_ERROR] Fallo en carga: {e}", flush=True)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # La cola se abre de inmediato: acepta casos incluso durante la carga inicial
+    try:
+        resources.JOBS = JobQueue()
+    except Exception as e:
+        print(f"⚠️ [JOBS] Cola persistente no disponible: {e}", flush=True)
     loader_task = asyncio.create_task(cargar_recursos_proactivamente())
     yield
     loader_task.cancel()
+    if resources.JOB_WORKERS is not None:
+        await resources.JOB_WORKERS.detener()
+    metricas.marcar_proceso_terminado()
 
 
 app = FastAPI(title="Motor Marcus - Centralizado", lifespan=lifespan)
 
 
-class CaseRequest(BaseModel):
-    case_id: str
-    urls_visuales: List[str] = []
-    urls_audios: List[str] = []
-    urls_videos: List[str] = []
+async def _vigilar_desconexion(http_request: Request, tarea: asyncio.Task, case_id: str):
+    """Cancela el caso si el cliente cierra la conexión: libera cuota, semáforos y descargas en curso."""
+    while not tarea.done():
+        if await http_request.is_disconnected():
+            print(f"🔌 [CASO: {case_id}] Cliente desconectado, se cancela el trabajo pendiente", flush=True)
+            tarea.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_S)
 
 
 @app.post("/process-case")
-async def process_case(request: CaseRequest):
+async def process_case(request: CaseRequest, http_request: Request):
     if not resources.IS_READY:
         raise HTTPException(status_code=503, detail="Motor en carga inicial.")
 
-    t_total_inicio = time.perf_counter()
     case_id = request.case_id
-    print(f"🚀 [CASO: {case_id}] Inicio de procesamiento multimodal", flush=True)
-
+    tarea = asyncio.create_task(ejecutar_caso(request, resources.LLMS, resources.CONTEXTO_MARCUS))
+    vigilante = asyncio.create_task(_vigilar_desconexion(http_request, tarea, case_id))
     try:
-        # 1. PROCESAMIENTO MULTIMEDIA (Flash para Audio, Pro para Video/Imagen)
-        tareas = []
-        nombres = []
-        tiempos_detalle = {}
-
-        if request.urls_visuales:
-            tareas.append(run_in_threadpool(procesar_evidencia_visual, request.urls_visuales, resources.LLMS))
-            nombres.append("IA_VISUAL_PRO")
-
-        if request.urls_audios:
-            for i, url in enumerate(request.urls_audios):
-                tareas.append(run_in_threadpool(transcribir_audio_gemini, url, resources.LLMS))
-                nombres.append(f"IA_AUDIO_FLASH_{i}")
-
-        if request.urls_videos:
-            for i, url in enumerate(request.urls_videos):
-                tareas.append(run_in_threadpool(procesar_video_gemini, url, resources.LLMS))
-                nombres.append(f"IA_VIDEO_PRO_{i}")
-
-        t_ia_parallel_start = time.perf_counter()
-        print(f"📡 [CASO: {case_id}] Lanzando tareas multimedia en paralelo...", flush=True)
-        resultados_lista = await asyncio.gather(*tareas)
-        tiempos_detalle["latencia_multimedia_paralela"] = f"{time.perf_counter() - t_ia_parallel_start:.2f}s"
-
-        res_map = dict(zip(nombres, resultados_lista))
-
-        # 2. RAZONAMIENTO MARCUS (Gemini Pro)
-        print(f"🧠 [CASO: {case_id}] Ejecutando análisis lógico Marcus...", flush=True)
-        t_marcus_start = time.perf_counter()
-
-        transcripciones = [v for k, v in res_map.items() if "AUDIO" in k]
-        videos_data = [v for k, v in res_map.items() if "VIDEO" in k]
-
-        resultado_final = await run_in_threadpool(
-            evaluar_circunstancias_marcus,
-            llms_resource=resources.LLMS,
-            contexto_marcus=resources.CONTEXTO_MARCUS,
-            json_visual=json.dumps({"estatica": res_map.get("IA_VISUAL_PRO", "N/A"), "videos": videos_data}),
-            json_transcripcion=" | ".join(transcripciones) if transcripciones else "N/A"
-        )
-        tiempos_detalle["latencia_razonamiento_marcus"] = f"{time.perf_counter() - t_marcus_start:.2f}s"
-
-        tiempos_detalle["latencia_total_api"] = f"{time.perf_counter() - t_total_inicio:.2f}s"
-        print(f"🏁 [CASO: {case_id}] Proceso terminado en {tiempos_detalle['latencia_total_api']}", flush=True)
-
-        return {
-            "ok": True,
-            "case_id": case_id,
-            "metricas_tiempos": tiempos_detalle,
-            "resultado": resultado_final
-        }
-
+        return await tarea
+    except asyncio.CancelledError:
+        if not tarea.cancelled():
+            tarea.cancel()
+            raise
+        # Nadie espera la respuesta: 499 solo queda en los logs de acceso
+        return JSONResponse(status_code=499, content={"ok": False, "error": "Cliente desconectado"})
     except Exception as e:
         print(f"❌ [CASO_ERROR: {case_id}] Error: {str(e)}", flush=True)
-        return JSONResponse(status_code=500, content={"ok": False, "error": str(e)})
\ No newline at end of file
+        return JSONResponse(status_code=500, content={"ok": False, "error": str(e)})
+    finally:
+        vigilante.cancel()
+
+
+def _serializar_evento(evento: dict, formato: str) -> str:
+    if formato == "sse":
+        if evento["evento"] == "latido":
+            return ": latido\n\n"
+        return f"event: {evento['evento']}\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+    return json.dumps(evento, ensure_ascii=False) + "\n"
+
+
+@app.post("/process-case/stream")
+async def process_case_stream(request: CaseRequest, formato: str = "ndjson"):
+    """
+    Variante en streaming de /process-case: emite cada resultado de modalidad al
+    terminar, los tiempos por etapa y al final el veredicto de Marcus.
+    formato=ndjson (una línea JSON por evento) o formato=sse (Server-Sent Events).
+    """
+    if not resources.IS_READY:
+        raise HTTPException(status_code=503, detail="Motor en carga inicial.")
+    if formato not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="formato debe ser 'ndjson' o 'sse'.")
+
+    case_id = request.case_id
+
+    async def _stream():
+        try:
+            async for evento in ejecutar_caso_eventos(request, resources.LLMS, resources.CONTEXTO_MARCUS, latido_s=STREAM_HEARTBEAT_S):
+                yield _serializar_evento(evento, formato)
+        except Exception as e:
+            print(f"❌ [CASO_ERROR: {case_id}] Error: {str(e)}", flush=True)
+            yield _serializar_evento({"evento": "error", "ok": False, "case_id": case_id, "error": str(e)}, formato)
+
+    media_type = "text/event-stream" if formato == "sse" else "application/x-ndjson"
+    return StreamingResponse(_stream(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/cases", status_code=202)
+async def submit_case(request: CaseRequest):
+    """Encola el caso y responde de inmediato con el id del trabajo."""
+    if resources.JOBS is None:
+        raise HTTPException(status_code=503, detail="Cola de casos no disponible.")
+    job_id = await asyncio.to_thread(resources.JOBS.encolar, request.case_id, request.model_dump())
+    if resources.JOB_WORKERS is not None:
+        resources.JOB_WORKERS.notificar()
+    return {"job_id": job_id, "case_id": request.case_id, "estado": "pendiente"}
+
+
+@app.get("/cases/{job_id}")
+async def get_case(job_id: str):
+    """Estado, progreso por etapa y resultado (cuando termina) de un trabajo."""
+    if resources.JOBS is None:
+        raise HTTPException(status_code=503, detail="Cola de casos no disponible.")
+    job = await asyncio.to_thread(resources.JOBS.obtener, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado.")
+    return {
+        "job_id": job["id"],
+        "case_id": job["case_id"],
+        "estado": job["estado"],
+        "intentos": job["intentos"],
+        "progreso": job["progreso"],
+        "resultado": job["resultado"],
+        "error": job["error"],
+        "creado": job["creado"],
+        "actualizado": job["actualizado"],
+    }
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return {**result_cache.estadisticas(), "cassette": cassette.estadisticas(), "hedging": hedger.estadisticas()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato Prometheus: latencias por etapa, tokens, casos en vuelo, pools y errores."""
+    cuerpo, content_type = metricas.exportar()
+    return Response(content=cuerpo, media_type=content_type)
+
+
+@app.get("/startup-profile")
+async def startup_profile(top: int = 30):
+    """Tiempos del arranque en frío: pasos de la carga inicial e imports más lentos (con STARTUP_PROFILE=1)."""
+    return {"listo": resources.IS_READY, **startup_profiler.resumen(top)}
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from app.commons.services import audio_largo
+
+
+@pytest.fixture(autouse=True)
+def parametros(monkeypatch):
+    monkeypatch.setattr(audio_largo, "AUDIO_FRAGMENTO_S", 100.0)
+    monkeypatch.setattr(audio_largo, "AUDIO_SOLAPE_S", 6.0)
+    monkeypatch.setattr(audio_largo, "AUDIO_TOLERANCIA_CORTE_S", 10.0)
+
+
+def _fragmento(desde, corte_inicio, corte_fin):
+    return {"desde_s": desde, "corte_inicio_s": corte_inicio, "corte_fin_s": corte_fin}
+
+
+def test_corte_se_mueve_al_silencio_mas_cercano():
+    # Silencio centrado en 96 (dentro de la tolerancia) y otro en 150 (fuera)
+    assert audio_largo.puntos_de_corte(250.0, [(95.0, 97.0), (149.0, 151.0)]) == [96.0, 196.0]
+
+
+def test_sin_silencios_corta_en_el_objetivo():
+    assert audio_largo.puntos_de_corte(230.0, []) == [100.0, 200.0]
+
+
+def test_cola_corta_no_genera_un_fragmento_propio():
+    # Lo que queda tras el último corte (< AUDIO_FRAGMENTO_S / 4) se une al fragmento anterior
+    assert audio_largo.puntos_de_corte(120.0, []) == []
+
+
+def test_union_elimina_repetidas_del_solape_y_alinea_hablantes():
+    fragmentos = [_fragmento(0.0, 0.0, 100.0), _fragmento(94.0, 100.0, 200.0)]
+    textos = [
+        json.dumps([
+            {"inicio_s": 10.0, "hablante": "A", "texto": "hola buenas"},
+            {"inicio_s": 97.0, "hablante": "A", "texto": "el otro vehículo frenó de golpe"},
+            {"inicio_s": 103.0, "hablante": "B", "texto": "yo venía despacio"},
+        ]),
+        # El segundo fragmento empieza en 94 s y etiqueta a los hablantes a su manera
+        json.dumps([
+            {"inicio_s": 3.0, "hablante": "HABLANTE_2", "texto": "el otro vehiculo frenó de golpe"},
+            {"inicio_s": 9.0, "hablante": "HABLANTE_1", "texto": "yo venía despacio"},
+            {"inicio_s": 30.0, "hablante": "HABLANTE_2", "texto": "eso es todo"},
+        ]),
+    ]
+
+    union = audio_largo.unir_transcripciones(fragmentos, textos)
+
+    assert [(s["inicio_s"], s["hablante"], s["texto"]) for s in union] == [
+        (10.0, "A", "hola buenas"),
+        (97.0, "A", "el otro vehículo frenó de golpe"),
+        (103.0, "B", "yo venía despacio"),
+        (124.0, "A", "eso es todo"),
+    ]
+
+
+def test_respuesta_fuera_de_formato_se_conserva_como_texto():
+    union = audio_largo.unir_transcripciones([_fragmento(0.0, 0.0, 100.0)], ["transcripción libre"])
+    assert union == [{"inicio_s": 0.0, "hablante": "DESCONOCIDO", "texto": "transcripción libre"}]
+
+
+def test_segmentos_con_inicio_invalido_se_descartan():
+    texto = json.dumps([{"inicio_s": "n/a", "hablante": "A", "texto": "x"}, {"inicio_s": 5, "hablante": "A", "texto": "y"}])
+    union = audio_largo.unir_transcripciones([_fragmento(0.0, 0.0, 100.0)], [texto])
+    assert [s["texto"] for s in union] == ["y"]
+
+
+def test_formato_de_la_transcripcion():
+    assert audio_largo.formatear_transcripcion([{"inicio_s": 125.7, "hablante": "A", "texto": "hola"}]) == "[02:05] A: hola"
+
+
+def test_salida_ilegible_de_ffprobe_cae_en_el_respaldo(monkeypatch):
+    monkeypatch.setattr(audio_largo, "_ejecutar", lambda comando: type("Salida", (), {"stdout": b"{}"})())
+    with pytest.raises(audio_largo.ERRORES_FFMPEG):
+        audio_largo.duracion("entrada")
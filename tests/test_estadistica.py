@@ -0,0 +1,22 @@
+import pytest
+
+from app.commons.services.estadistica import percentil
+
+
+@pytest.mark.parametrize("valores, q, esperado", [
+    (range(1, 11), 0.50, 5),
+    (range(1, 11), 0.90, 9),
+    (range(1, 101), 0.95, 95),
+    (range(1, 101), 0.99, 99),
+    (range(1, 21), 0.95, 19),
+    (range(1, 21), 1.00, 20),
+    (range(1, 21), 0.0, 1),
+    ([5], 0.9, 5),
+    ([3.5, 1.0, 2.0], 0.5, 2.0),
+])
+def test_percentil_por_rango_mas_cercano(valores, q, esperado):
+    assert percentil(valores, q) == esperado
+
+
+def test_sin_muestras():
+    assert percentil([], 0.95) == 0.0
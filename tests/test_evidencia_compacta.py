@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+from app.commons.services import evidencia_compacta
+from app.commons.services.evidencia_compacta import compactar_evidencia, preparar_evidencia_marcus, evidencia_completa
+from app.commons.services.llm_scheduler import estimar_tokens
+
+
+def _vehiculo(letra, **campos):
+    return {"analisis_por_vehiculo": {f"vehiculo_{letra}": campos}}
+
+
+def _hechos(json_compacto):
+    """Entradas del registro ("valor [fuentes]"), aplanadas."""
+    if json_compacto == "N/A":
+        return []
+    entradas = []
+
+    def recorrer(valor):
+        if isinstance(valor, dict):
+            for clave, sub in valor.items():
+                if clave != "formato":
+                    recorrer(sub)
+        elif isinstance(valor, list):
+            for item in valor:
+                recorrer(item)
+        else:
+            entradas.append(valor)
+
+    recorrer(json.loads(json_compacto))
+    return entradas
+
+
+@pytest.mark.parametrize("campo, visual, audio", [
+    ("señales_frenado_descritas", "El vehículo frenó antes del impacto", "El vehículo no frenó antes del impacto"),
+    ("movimiento_previo_al_conflicto", "cruzó la intersección con el semáforo en verde para su sentido de circulación",
+     "cruzó la intersección con el semáforo en rojo para su sentido de circulación"),
+    ("velocidad_impacto_estimada", "circulaba a 40 km/h", "circulaba a 80 km/h"),
+    ("maniobra_critica", "el vehículo B invadió el carril contrario al girar a la izquierda",
+     "el vehículo A invadió el carril contrario al girar a la izquierda"),
+])
+def test_hechos_contradictorios_no_se_fusionan(campo, visual, audio):
+    json_visual, json_transcripcion, reporte = compactar_evidencia({
+        "IA_VISUAL_PRO": _vehiculo("a", **{campo: visual}),
+        "IA_AUDIO_FLASH_0": _vehiculo("a", **{campo: audio}),
+    })
+    assert reporte["hechos_unicos"] == 2
+    # Cada versión conserva su fuente: el testimonio no aparece corroborado por la evidencia objetiva
+    assert _hechos(json_visual) == [f"{visual} [visual]"]
+    assert _hechos(json_transcripcion) == [f"{audio} [audio_0]"]
+
+
+def test_redaccion_que_amplia_a_otra_se_fusiona_con_ambas_fuentes():
+    json_visual, json_transcripcion, reporte = compactar_evidencia({
+        "IA_VISUAL_PRO": _vehiculo("a", patron_deformacion="Deformación frontal severa en el paragolpes delantero"),
+        "IA_VIDEO_PRO_0": _vehiculo("a", patron_deformacion="deformacion frontal severa en el paragolpes"),
+    })
+    assert reporte["hechos_unicos"] == 1
+    assert _hechos(json_visual) == ["Deformación frontal severa en el paragolpes delantero [video_0, visual]"]
+    assert json_transcripcion == "N/A"
+
+
+@pytest.mark.parametrize("placa_audio", ["abc 123", "ABC-123", "Abc123"])
+def test_placas_se_normalizan(placa_audio):
+    json_visual, json_transcripcion, reporte = compactar_evidencia({
+        "IA_VISUAL_PRO": _vehiculo("b", placa_visible="ABC-123"),
+        "IA_AUDIO_FLASH_0": _vehiculo("b", placa=placa_audio),
+    })
+    assert reporte["hechos_unicos"] == 1
+    assert json.loads(json_visual)["vehiculo_b"]["placa"].endswith("[audio_0, visual]")
+    assert json_transcripcion == "N/A"
+
+
+def test_placas_distintas_no_se_fusionan():
+    _, _, reporte = compactar_evidencia({
+        "IA_VISUAL_PRO": _vehiculo("b", placa="ABC-123"),
+        "IA_AUDIO_FLASH_0": _vehiculo("b", placa="ABC-128"),
+    })
+    assert reporte["hechos_unicos"] == 2
+
+
+def test_solo_se_descartan_los_marcadores_de_dato_ausente():
+    json_visual, _, reporte = compactar_evidencia({"IA_VISUAL_PRO": _vehiculo(
+        "a", placa="No visible", señales_frenado_descritas="Ninguna evidente", modelo_aproximado="desconocido",
+        año_aproximado=None, descripcion_general="N/A", orientacion_vehiculo="null", componentes_afectados="No aplica",
+    )})
+    assert reporte["hechos_extraidos"] == 3
+    assert json.loads(json_visual)["vehiculo_a"] == {
+        "placa": "No visible [visual]",
+        "frenado": "Ninguna evidente [visual]",
+        "modelo": "desconocido [visual]",
+    }
+
+
+def test_presupuesto_de_tokens_prioriza_los_vehiculos():
+    limitaciones = {"limitaciones_y_incertidumbres": [f"limitación número {i} de la evidencia disponible para el análisis" for i in range(40)]}
+    vehiculo = _vehiculo("a", placa="XYZ-987", maniobra_critica="giró a la izquierda sin ceder el paso al vehículo B")
+    res_map = {"IA_VISUAL_PRO": {**vehiculo, **limitaciones}}
+
+    json_visual, json_transcripcion, reporte = compactar_evidencia(res_map, presupuesto=150)
+
+    registro = json.loads(json_visual)
+    assert set(registro["vehiculo_a"]) == {"placa", "maniobra"}
+    assert 0 < len(registro.get("limitaciones", {}).get("limitaciones_y_incertidumbres", [])) < 40
+    assert reporte["descartados_por_presupuesto"] > 0
+    # El registro final queda cerca del presupuesto (la estimación por hecho incluye la sintaxis del JSON)
+    assert estimar_tokens(json_visual) <= 150 * 1.25
+    assert json_transcripcion == "N/A"
+
+
+def test_hechos_largos_se_recortan(monkeypatch):
+    monkeypatch.setattr(evidencia_compacta, "EVIDENCIA_MAX_CARACTERES_HECHO", 20)
+    json_visual, _, reporte = compactar_evidencia({"IA_VISUAL_PRO": _vehiculo("a", descripcion_general="sedán gris de cuatro puertas con vidrios polarizados")})
+    assert reporte["recortados"] == 1
+    assert json.loads(json_visual)["vehiculo_a"]["descripcion"] == "sedán gris de cuatro… [visual]"
+
+
+def test_compactacion_desactivada_envia_la_evidencia_completa(monkeypatch):
+    monkeypatch.setattr(evidencia_compacta, "EVIDENCIA_COMPACTA", False)
+    res_map = {"IA_VISUAL_PRO": _vehiculo("a", placa="ABC-123"), "IA_AUDIO_FLASH_0": "transcripción"}
+    json_visual, json_transcripcion, reporte = preparar_evidencia_marcus(res_map)
+    assert (json_visual, json_transcripcion) == evidencia_completa(res_map)
+    assert reporte["compacta"] is False and reporte["tokens_antes"] == reporte["tokens_despues"]
@@ -0,0 +1,118 @@
+import pytest
+
+from app.commons.services import job_queue
+from app.commons.services.job_queue import JobQueue, PENDIENTE, EN_PROCESO, COMPLETADO, FALLIDO
+
+
+class RelojFalso:
+    def __init__(self):
+        self.ahora = 1_000_000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = RelojFalso()
+    monkeypatch.setattr(job_queue.time, "time", reloj)
+    return reloj
+
+
+@pytest.fixture
+def cola(tmp_path, reloj):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), lease_s=60, max_intentos=2)
+
+
+def test_reclamar_toma_el_mas_antiguo_una_sola_vez(cola, reloj):
+    primero = cola.encolar("c1", {"case_id": "c1"})
+    reloj.ahora += 1
+    cola.encolar("c2", {"case_id": "c2"})
+
+    job = cola.reclamar("w1")
+    assert (job["id"], job["estado"], job["intentos"], job["payload"]) == (primero, PENDIENTE, 1, {"case_id": "c1"})
+    assert cola.obtener(primero)["worker"] == "w1"
+    assert cola.reclamar("w2")["case_id"] == "c2"
+    assert cola.reclamar("w3") is None
+
+
+def test_flujo_normal(cola):
+    job_id = cola.encolar("c1", {})
+    cola.reclamar("w1")
+    assert cola.renovar(job_id, "w1")
+    assert cola.actualizar_progreso(job_id, "w1", {"etapas": {"multimedia": {}}})
+    assert cola.completar(job_id, "w1", {"ok": True})
+    job = cola.obtener(job_id)
+    assert (job["estado"], job["resultado"], job["progreso"], job["worker"]) == (COMPLETADO, {"ok": True}, {"etapas": {"multimedia": {}}}, None)
+    assert cola.contar_por_estado() == {COMPLETADO: 1}
+
+
+def test_lease_vigente_no_se_reclama(cola, reloj):
+    cola.encolar("c1", {})
+    cola.reclamar("w1")
+    reloj.ahora += 59
+    assert cola.reclamar("w2") is None
+
+
+def test_lease_vencido_lo_reclama_otro_worker_y_el_anterior_ya_no_escribe(cola, reloj):
+    job_id = cola.encolar("c1", {})
+    cola.reclamar("w1")
+    reloj.ahora += 61
+
+    job = cola.reclamar("w2")
+    assert (job["id"], job["intentos"]) == (job_id, 2)
+
+    # El worker viejo sigue vivo (p. ej. la renovación falló): nada de lo que escriba aplica
+    assert not cola.renovar(job_id, "w1")
+    assert not cola.actualizar_progreso(job_id, "w1", {"viejo": True})
+    assert not cola.completar(job_id, "w1", {"resultado": "viejo"})
+    assert not cola.fallar(job_id, "w1", "error del worker viejo")
+    job = cola.obtener(job_id)
+    assert (job["estado"], job["worker"], job["progreso"], job["resultado"], job["error"]) == (EN_PROCESO, "w2", {}, None, None)
+    # fallar no devolvió el trabajo a la cola: un tercer worker no lo toma
+    assert cola.reclamar("w3") is None
+
+    assert cola.completar(job_id, "w2", {"resultado": "nuevo"})
+    assert cola.obtener(job_id)["resultado"] == {"resultado": "nuevo"}
+    assert not cola.fallar(job_id, "w2", "tarde")
+    assert cola.obtener(job_id)["estado"] == COMPLETADO
+
+
+def test_renovar_extiende_el_lease(cola, reloj):
+    job_id = cola.encolar("c1", {})
+    cola.reclamar("w1")
+    reloj.ahora += 50
+    assert cola.renovar(job_id, "w1")
+    reloj.ahora += 50
+    assert cola.reclamar("w2") is None
+
+
+def test_fallar_reencola_hasta_agotar_los_intentos(cola):
+    job_id = cola.encolar("c1", {})
+    cola.reclamar("w1")
+    assert cola.fallar(job_id, "w1", "cuota agotada")
+    job = cola.obtener(job_id)
+    assert (job["estado"], job["error"], job["worker"]) == (PENDIENTE, "cuota agotada", None)
+
+    assert cola.reclamar("w2")["intentos"] == 2
+    assert cola.fallar(job_id, "w2", "cuota agotada otra vez")
+    assert cola.obtener(job_id)["estado"] == FALLIDO
+    assert cola.reclamar("w3") is None
+
+
+def test_lease_vencido_sin_intentos_queda_fallido(cola, reloj):
+    job_id = cola.encolar("c1", {})
+    cola.reclamar("w1")
+    reloj.ahora += 61
+    cola.reclamar("w2")
+    reloj.ahora += 61
+
+    assert cola.reclamar("w3") is None
+    job = cola.obtener(job_id)
+    assert job["estado"] == FALLIDO and "intentos" in job["error"]
+
+
+def test_la_cola_sobrevive_al_reinicio(tmp_path, reloj):
+    ruta = str(tmp_path / "jobs.sqlite3")
+    job_id = JobQueue(ruta).encolar("c1", {"case_id": "c1"})
+    assert JobQueue(ruta).reclamar("w1")["id"] == job_id
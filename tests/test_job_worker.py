@@ -0,0 +1,110 @@
+import time
+import asyncio
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from app.Funciones import job_worker
+from app.Funciones.job_worker import JobWorkerPool
+from app.commons.services.job_queue import JobQueue, PENDIENTE, EN_PROCESO, COMPLETADO
+
+
+VEREDICTO = {"evento": "veredicto", "ok": True, "case_id": "c1"}
+
+
+@pytest.fixture
+def cola(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), lease_s=0.3, max_intentos=3)
+
+
+def _pool(cola):
+    return JobWorkerPool(cola, lambda: ({}, None), workers=1)
+
+
+def _caso(duracion_s, estado):
+    async def eventos(request, llms, contexto_marcus):
+        estado["inicio"] = True
+        yield {"evento": "modalidad", "nombre": "IA_VISUAL_PRO", "ok": True, "latencia_s": 0.1}
+        try:
+            await asyncio.sleep(duracion_s)
+        except asyncio.CancelledError:
+            estado["cancelado"] = True
+            raise
+        yield dict(VEREDICTO)
+    return eventos
+
+
+def _reclamar(cola):
+    cola.encolar("c1", {"case_id": "c1"})
+    return cola.reclamar("w1")
+
+
+def test_caso_completo_con_renovaciones(cola, monkeypatch):
+    estado = {}
+    monkeypatch.setattr(job_worker, "ejecutar_caso_eventos", _caso(0.5, estado))
+    job = _reclamar(cola)
+
+    asyncio.run(_pool(cola)._procesar(job, "w1"))
+
+    guardado = cola.obtener(job["id"])
+    assert guardado["estado"] == COMPLETADO
+    assert guardado["resultado"] == {"ok": True, "case_id": "c1"}
+    assert guardado["progreso"]["modalidades"]["IA_VISUAL_PRO"]["ok"] is True
+
+
+def test_lease_perdido_cancela_el_caso_sin_escribir(cola, monkeypatch):
+    estado = {}
+    monkeypatch.setattr(job_worker, "ejecutar_caso_eventos", _caso(10, estado))
+    job = _reclamar(cola)
+
+    async def correr():
+        proceso = asyncio.create_task(_pool(cola)._procesar(job, "w1"))
+        await asyncio.sleep(0.15)
+        # Otro worker reclamó el trabajo (p. ej. este estuvo sin renovar más que el lease)
+        with closing(cola._conectar()) as conn:
+            conn.execute("UPDATE jobs SET worker = 'w2' WHERE id = ?", (job["id"],))
+        await asyncio.wait_for(proceso, 2)
+
+    t_inicio = time.monotonic()
+    asyncio.run(correr())
+
+    assert estado.get("cancelado") is True
+    assert time.monotonic() - t_inicio < 2
+    guardado = cola.obtener(job["id"])
+    assert (guardado["estado"], guardado["worker"], guardado["resultado"]) == (EN_PROCESO, "w2", None)
+
+
+def test_error_al_renovar_se_reintenta(cola, monkeypatch):
+    monkeypatch.setattr(job_worker, "ejecutar_caso_eventos", _caso(0.5, {}))
+    monkeypatch.setattr(job_worker, "JOBS_POLL_S", 0.02)
+    renovar = cola.renovar
+    llamadas = []
+
+    def renovar_inestable(job_id, worker):
+        llamadas.append(job_id)
+        if len(llamadas) <= 2:
+            raise sqlite3.OperationalError("database is locked")
+        return renovar(job_id, worker)
+
+    monkeypatch.setattr(cola, "renovar", renovar_inestable)
+    job = _reclamar(cola)
+
+    asyncio.run(_pool(cola)._procesar(job, "w1"))
+
+    assert len(llamadas) > 2
+    assert cola.obtener(job["id"])["estado"] == COMPLETADO
+
+
+def test_error_del_caso_vuelve_a_la_cola(cola, monkeypatch):
+    async def eventos(request, llms, contexto_marcus):
+        raise RuntimeError("Vertex no disponible")
+        yield
+
+    monkeypatch.setattr(job_worker, "ejecutar_caso_eventos", eventos)
+    job = _reclamar(cola)
+
+    asyncio.run(_pool(cola)._procesar(job, "w1"))
+
+    guardado = cola.obtener(job["id"])
+    assert (guardado["estado"], guardado["error"]) == (PENDIENTE, "Vertex no disponible")
@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.commons.services import context_cache, llm_invoker
+from app.commons.services.llm_cassette import Cassette, CassetteSinGrabacion, MODO_GRABAR, MODO_REPRODUCIR, huella_solicitud
+
+
+class ModeloFalso:
+    _model_name = "modelo-prueba"
+
+
+CONFIG = {"temperature": 0.0}
+
+
+def test_modelo_enlazado_al_prefijo_produce_la_huella_del_prompt_completo(monkeypatch):
+    enlazado = ModeloFalso()
+    monkeypatch.setitem(context_cache._prefijos, enlazado, "PREFIJO ")
+
+    assert context_cache.prefijo_cacheado(enlazado) == "PREFIJO "
+    assert huella_solicitud("modelo-prueba", enlazado, ["datos del caso"], CONFIG) == huella_solicitud(
+        "modelo-prueba", ModeloFalso(), ["PREFIJO datos del caso"], CONFIG
+    )
+
+
+def test_modelo_sin_prefijo_no_altera_la_solicitud():
+    modelo = ModeloFalso()
+
+    assert context_cache.prefijo_cacheado(modelo) is None
+    assert context_cache.prefijo_cacheado(object()) is None
+    assert huella_solicitud("modelo-prueba", modelo, ["datos"], CONFIG) != huella_solicitud(
+        "modelo-prueba", modelo, ["PREFIJO datos"], CONFIG
+    )
+
+
+# --- Grabación y reproducción a través de invocar_modelo_async ---
+
+class ModeloGrabable:
+    _model_name = "modelo-prueba"
+
+    def __init__(self):
+        self.llamadas = 0
+
+    async def generate_content_async(self, contents, generation_config=None, labels=None):
+        self.llamadas += 1
+        uso = SimpleNamespace(prompt_token_count=12, candidates_token_count=3, total_token_count=15)
+        return SimpleNamespace(text=f'{{"respuesta": {self.llamadas}}}', usage_metadata=uso)
+
+
+class ModeloSinRed:
+    _model_name = "modelo-prueba"
+
+    async def generate_content_async(self, *args, **kwargs):
+        raise AssertionError("en replay no se llama al modelo")
+
+
+def _invocar(model, prompt):
+    return asyncio.run(llm_invoker.invocar_modelo_async(model, [prompt], CONFIG, {}))
+
+
+def test_grabar_y_reproducir_devuelve_las_mismas_respuestas(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "cassette.jsonl")
+    modelo = ModeloGrabable()
+    monkeypatch.setattr(llm_invoker, "cassette", Cassette(ruta, MODO_GRABAR, con_latencia=False))
+    grabadas = [_invocar(modelo, "caso 1"), _invocar(modelo, "caso 2"), _invocar(modelo, "caso 1")]
+    assert modelo.llamadas == 3
+    assert llm_invoker.cassette.estadisticas()["grabadas"] == 3
+
+    monkeypatch.setattr(llm_invoker, "cassette", Cassette(ruta, MODO_REPRODUCIR, con_latencia=False))
+    reproducidas = [_invocar(ModeloSinRed(), "caso 1"), _invocar(ModeloSinRed(), "caso 2"), _invocar(ModeloSinRed(), "caso 1")]
+
+    # Las solicitudes repetidas se entregan en el orden en que se grabaron
+    assert [r.text for r in reproducidas] == [r.text for r in grabadas]
+    assert reproducidas[0].usage_metadata.total_token_count == 15
+    assert llm_invoker.cassette.estadisticas()["reproducidas"] == 3
+
+
+def test_solicitud_sin_grabacion_falla_en_replay(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "cassette.jsonl")
+    monkeypatch.setattr(llm_invoker, "cassette", Cassette(ruta, MODO_GRABAR, con_latencia=False))
+    _invocar(ModeloGrabable(), "caso 1")
+
+    monkeypatch.setattr(llm_invoker, "cassette", Cassette(ruta, MODO_REPRODUCIR, con_latencia=False))
+    with pytest.raises(CassetteSinGrabacion):
+        _invocar(ModeloSinRed(), "prompt modificado")
+    assert llm_invoker.cassette.estadisticas()["sin_grabacion"] == 1
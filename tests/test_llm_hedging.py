@@ -0,0 +1,146 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.commons.services import llm_invoker, metricas
+from app.commons.services.llm_cassette import Cassette, MODO_GRABAR
+from app.commons.services.llm_hedging import Hedger
+
+
+class LimitesFalsos:
+    def __init__(self, espera=0.0):
+        self.espera = espera
+        self.reservas = 0
+        self.canceladas = 0
+        self.consumos = []
+
+    def reservar(self, tokens):
+        self.reservas += 1
+        return self.espera
+
+    def cancelar(self, tokens):
+        self.canceladas += 1
+
+    def registrar_consumo(self, estimados, respuesta):
+        self.consumos.append(estimados)
+
+
+def _hedger(**opciones):
+    parametros = dict(activo=True, percentil_umbral=0.9, presupuesto=0.05, min_muestras=3,
+                      ventana=50, umbral_min_s=0.01, modalidades={"visual"})
+    parametros.update(opciones)
+    return Hedger(**parametros)
+
+
+def test_umbral_requiere_muestras_y_respeta_el_minimo():
+    hedger = _hedger(umbral_min_s=0.5)
+    for latencia in (0.1, 0.2):
+        hedger.observar("m", "visual", latencia)
+    assert hedger.umbral("m", "visual") is None
+    hedger.observar("m", "visual", 0.3)
+    assert hedger.umbral("m", "visual") == 0.5
+    for latencia in (2.0, 3.0, 4.0):
+        hedger.observar("m", "visual", latencia)
+    assert hedger.umbral("m", "visual") == 4.0
+    assert hedger.umbral("m", "audio") is None
+
+
+def test_aplica_solo_activo_y_en_sus_modalidades():
+    assert _hedger().aplica("visual")
+    assert not _hedger().aplica("marcus")
+    assert not _hedger(activo=False).aplica("visual")
+
+
+def test_presupuesto_limita_los_duplicados():
+    hedger = _hedger(presupuesto=0.05)
+    limites = LimitesFalsos()
+    hedger._stats["primarias"] = 19
+    assert not hedger._autorizar(limites, 100)
+    hedger._stats["primarias"] = 20
+    assert hedger._autorizar(limites, 100)
+    assert not hedger._autorizar(limites, 100)
+    assert hedger._stats["disparadas"] == 1
+    assert hedger._stats["sin_presupuesto"] == 2
+    # Denegar por presupuesto no toca la cuota
+    assert limites.reservas == 1
+
+
+def test_sin_cuota_inmediata_no_se_duplica_y_se_devuelve_la_reserva():
+    hedger = _hedger(presupuesto=1.0)
+    hedger._stats["primarias"] = 10
+    limites = LimitesFalsos(espera=2.5)
+    assert not hedger._autorizar(limites, 100)
+    assert (limites.reservas, limites.canceladas) == (1, 1)
+    assert hedger._stats["sin_cuota"] == 1
+
+
+def test_duplicado_gana_y_la_primaria_se_cancela():
+    hedger = _hedger(presupuesto=1.0, min_muestras=1)
+    hedger.observar("m", "visual", 0.02)
+    limites = LimitesFalsos()
+    llamadas = []
+
+    async def intento():
+        llamadas.append(len(llamadas))
+        await asyncio.sleep(10 if len(llamadas) == 1 else 0.01)
+        return f"respuesta {len(llamadas)}"
+
+    async def correr():
+        respuesta = await hedger.ejecutar_async("m", "visual", intento, limites, 100)
+        await asyncio.sleep(0)  # deja que la cancelación de la primaria se procese
+        pendientes = [t for t in asyncio.all_tasks() if t is not asyncio.current_task() and not t.done()]
+        return respuesta, pendientes
+
+    respuesta, pendientes = asyncio.run(correr())
+    assert respuesta == "respuesta 2"
+    assert pendientes == []
+    assert limites.consumos == [100]
+    estadisticas = hedger.estadisticas()
+    assert (estadisticas["primarias"], estadisticas["disparadas"], estadisticas["ganadas"]) == (1, 1, 1)
+
+
+def test_primaria_rapida_no_dispara_duplicado():
+    hedger = _hedger(presupuesto=1.0, min_muestras=1)
+    hedger.observar("m", "visual", 0.5)
+
+    async def intento():
+        return "ok"
+
+    assert asyncio.run(hedger.ejecutar_async("m", "visual", intento, LimitesFalsos(), 100)) == "ok"
+    assert hedger.estadisticas()["disparadas"] == 0
+
+
+def test_en_grabacion_un_duplicado_que_termina_junto_a_la_primaria_no_se_graba(tmp_path, monkeypatch):
+    cassette = Cassette(str(tmp_path / "cassette.jsonl"), MODO_GRABAR, con_latencia=False)
+    hedger = _hedger(presupuesto=1.0, min_muestras=1)
+    hedger.observar("modelo-prueba", "visual", 0.02)
+    monkeypatch.setattr(llm_invoker, "cassette", cassette)
+    monkeypatch.setattr(llm_invoker, "hedger", hedger)
+
+    class ModeloFalso:
+        _model_name = "modelo-prueba"
+
+        def __init__(self):
+            self.llamadas = 0
+            self.liberar = None
+
+        async def generate_content_async(self, contents, generation_config=None, labels=None):
+            self.llamadas += 1
+            if self.llamadas == 2:
+                # Llegó el duplicado: ambos intentos responden en la misma vuelta del loop
+                self.liberar.set()
+            await self.liberar.wait()
+            return SimpleNamespace(text=f"respuesta {self.llamadas}", usage_metadata=None)
+
+    async def correr(modelo):
+        modelo.liberar = asyncio.Event()
+        with metricas.en_modalidad("visual"):
+            return await llm_invoker.invocar_modelo_async(modelo, ["prompt"], {}, {})
+
+    modelo = ModeloFalso()
+    asyncio.run(correr(modelo))
+
+    assert modelo.llamadas == 2
+    assert cassette.estadisticas()["grabadas"] == 1
+    assert len((tmp_path / "cassette.jsonl").read_text(encoding="utf-8").splitlines()) == 1
@@ -0,0 +1,66 @@
+import pytest
+
+from app.commons.services import llm_scheduler
+from app.commons.services.llm_scheduler import TokenBucket
+
+
+class RelojFalso:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = RelojFalso()
+    monkeypatch.setattr(llm_scheduler.time, "monotonic", reloj)
+    return reloj
+
+
+def test_reserva_dentro_de_la_capacidad_no_espera(reloj):
+    cubeta = TokenBucket(capacidad=10, tasa_por_s=1)
+    assert cubeta.reservar(4) == 0.0
+    assert cubeta.reservar(6) == 0.0
+
+
+def test_reserva_anticipada_devuelve_la_espera_acumulada(reloj):
+    cubeta = TokenBucket(capacidad=10, tasa_por_s=2)
+    cubeta.reservar(10)
+    # La reserva descuenta igual: la siguiente espera detrás de esta
+    assert cubeta.reservar(4) == pytest.approx(2.0)
+    assert cubeta.reservar(4) == pytest.approx(4.0)
+
+
+def test_relleno_con_el_tiempo_sin_superar_la_capacidad(reloj):
+    cubeta = TokenBucket(capacidad=10, tasa_por_s=2)
+    cubeta.reservar(10)
+    reloj.ahora += 3
+    assert cubeta.reservar(6) == 0.0
+    reloj.ahora += 3600
+    assert cubeta.reservar(10) == 0.0
+    assert cubeta.reservar(1) == pytest.approx(0.5)
+
+
+def test_reserva_mayor_que_la_capacidad_se_acota(reloj):
+    cubeta = TokenBucket(capacidad=10, tasa_por_s=1)
+    # Una solicitud más grande que la cubeta nunca quedaría cubierta: cuenta como la capacidad
+    assert cubeta.reservar(50) == 0.0
+    assert cubeta.reservar(1) == pytest.approx(1.0)
+
+
+def test_devolver_libera_la_reserva(reloj):
+    cubeta = TokenBucket(capacidad=10, tasa_por_s=1)
+    cubeta.reservar(10)
+    cubeta.devolver(5)
+    assert cubeta.reservar(5) == 0.0
+
+
+def test_ajustar_corrige_con_el_consumo_real(reloj):
+    cubeta = TokenBucket(capacidad=10, tasa_por_s=1)
+    cubeta.reservar(6)
+    cubeta.ajustar(4)     # se consumió más de lo estimado
+    assert cubeta.reservar(1) == pytest.approx(1.0)
+    cubeta.ajustar(-3)    # se consumió menos
+    assert cubeta.reservar(2) == 0.0
@@ -0,0 +1,122 @@
+import copy
+
+import pytest
+
+from app.commons.services import marcus_cascada
+from app.commons.services.marcus_cascada import motivos_escalamiento, nivel_en_escala, NIVELES_CONFIANZA, NIVELES_IMPACTO
+
+
+ACEPTABLE = {
+    "conclusion_general_del_caso": {
+        "confianza_decision_global": "alta 85-95%",
+        "determinacion_responsabilidad_primaria": "vehiculo_a",
+        "porcentaje_responsabilidad": {"vehiculo_a": "100%", "vehiculo_b": "0%"},
+        "inconsistencias_criticas": {"impacto_en_conclusion": "ninguno"},
+    },
+    "analisis_por_vehiculo": {
+        "vehiculo_a": {"justificacion_asignacion": {"nivel_certeza": "muy_alta"}, "circunstancia_marcus": {"id": "C07"}},
+        "vehiculo_b": {"justificacion_asignacion": {"nivel_certeza": "alta"}, "circunstancia_marcus": {"id": "C01"}},
+    },
+    "resumen_fuentes_informacion": {"coherencia_fuentes": "coherente"},
+}
+
+
+@pytest.fixture(autouse=True)
+def umbrales(monkeypatch):
+    monkeypatch.setattr(marcus_cascada, "MARCUS_CASCADA_CONFIANZA_MIN", "alta")
+    monkeypatch.setattr(marcus_cascada, "MARCUS_CASCADA_IMPACTO_MAX", "menor")
+    monkeypatch.setattr(marcus_cascada, "MARCUS_CASCADA_ACEPTAR_COMPARTIDA", False)
+
+
+def _con(**cambios_conclusion):
+    resultado = copy.deepcopy(ACEPTABLE)
+    resultado["conclusion_general_del_caso"].update(cambios_conclusion)
+    return resultado
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    ("alta 85-95%", 3),
+    ("Muy_Alta, >95%", 4),
+    ("media.", 2),
+    ("segura", None),
+    ("", None),
+    (None, None),
+    (90, None),
+])
+def test_nivel_en_escala(valor, esperado):
+    assert nivel_en_escala(valor, NIVELES_CONFIANZA) == esperado
+
+
+def test_adjudicacion_clara_la_decide_flash():
+    assert motivos_escalamiento(ACEPTABLE) == []
+
+
+@pytest.mark.parametrize("resultado", [
+    {"error": "JSON inválido"},
+    {"error": "timeout", "raw": "```json {"},
+    "texto libre",
+    None,
+])
+def test_forma_de_error_se_escala_como_json_invalido(resultado):
+    assert motivos_escalamiento(resultado) == ["json_invalido"]
+
+
+def test_un_campo_error_dentro_de_un_resultado_completo_no_es_la_forma_de_error():
+    resultado = copy.deepcopy(ACEPTABLE)
+    resultado["error"] = "advertencia del modelo"
+    assert motivos_escalamiento(resultado) == []
+
+
+def test_confianza_por_debajo_del_minimo(monkeypatch):
+    assert motivos_escalamiento(_con(confianza_decision_global="media 60-75%")) == ["confianza_global_baja"]
+    monkeypatch.setattr(marcus_cascada, "MARCUS_CASCADA_CONFIANZA_MIN", "media")
+    assert motivos_escalamiento(_con(confianza_decision_global="media 60-75%")) == []
+
+
+def test_certeza_y_circunstancia_por_vehiculo():
+    resultado = copy.deepcopy(ACEPTABLE)
+    resultado["analisis_por_vehiculo"]["vehiculo_b"] = {
+        "justificacion_asignacion": {"nivel_certeza": "baja"},
+        "circunstancia_marcus": {"id": "indeterminable"},
+    }
+    assert motivos_escalamiento(resultado) == ["certeza_baja_vehiculo_b", "sin_circunstancia_vehiculo_b"]
+
+
+def test_responsabilidad_indeterminada():
+    resultado = _con(determinacion_responsabilidad_primaria="Indeterminada por falta de evidencia", porcentaje_responsabilidad={})
+    assert motivos_escalamiento(resultado) == ["responsabilidad_indeterminada"]
+
+
+def test_responsabilidad_compartida_se_escala_salvo_que_se_acepte(monkeypatch):
+    resultado = _con(determinacion_responsabilidad_primaria="compartida", porcentaje_responsabilidad={"vehiculo_a": 50, "vehiculo_b": 50})
+    assert motivos_escalamiento(resultado) == ["responsabilidad_compartida"]
+    monkeypatch.setattr(marcus_cascada, "MARCUS_CASCADA_ACEPTAR_COMPARTIDA", True)
+    assert motivos_escalamiento(resultado) == []
+
+
+@pytest.mark.parametrize("determinacion, porcentajes, motivo", [
+    ("vehiculo_a", {"vehiculo_a": "30%", "vehiculo_b": "70%"}, "porcentajes_contradicen_determinacion"),
+    ("vehiculo_b", {"vehiculo_a": 50, "vehiculo_b": 50}, "porcentajes_contradicen_determinacion"),
+    ("vehiculo_a", {"vehiculo_a": "80%", "vehiculo_b": "40%"}, "porcentajes_no_suman_100"),
+])
+def test_porcentajes_que_no_cuadran(determinacion, porcentajes, motivo):
+    resultado = _con(determinacion_responsabilidad_primaria=determinacion, porcentaje_responsabilidad=porcentajes)
+    assert motivos_escalamiento(resultado) == [motivo]
+
+
+def test_porcentajes_ilegibles_no_se_comparan():
+    assert motivos_escalamiento(_con(porcentaje_responsabilidad={"vehiculo_a": "mayoritario", "vehiculo_b": "0%"})) == []
+
+
+def test_fuentes_contradictorias_e_inconsistencias_criticas():
+    resultado = _con(inconsistencias_criticas={"impacto_en_conclusion": "significativo"})
+    resultado["resumen_fuentes_informacion"]["coherencia_fuentes"] = "Contradictorio"
+    assert motivos_escalamiento(resultado) == ["fuentes_contradictorias", "inconsistencias_criticas"]
+    assert nivel_en_escala("menor", NIVELES_IMPACTO) == 1
+    assert motivos_escalamiento(_con(inconsistencias_criticas={"impacto_en_conclusion": "menor"})) == []
+
+
+def test_umbral_desconocido_usa_el_valor_por_defecto(monkeypatch):
+    monkeypatch.setattr(marcus_cascada, "MARCUS_CASCADA_CONFIANZA_MIN", "altisima")
+    assert motivos_escalamiento(_con(confianza_decision_global="media")) == ["confianza_global_baja"]
+    assert motivos_escalamiento(ACEPTABLE) == []
@@ -0,0 +1,45 @@
+import io
+
+from pypdf import PdfReader, PdfWriter
+
+from app.commons.services import pdf_split
+
+
+def _pdf(paginas: int) -> bytes:
+    escritor = PdfWriter()
+    for indice in range(paginas):
+        # Ancho distinto por página para reconocer cuál quedó en cada fragmento
+        escritor.add_blank_page(width=100 + indice, height=100)
+    salida = io.BytesIO()
+    escritor.write(salida)
+    return salida.getvalue()
+
+
+def _anchos(data: bytes) -> list:
+    return [int(pagina.mediabox.width) for pagina in PdfReader(io.BytesIO(data)).pages]
+
+
+def test_rangos_cubren_el_documento_sin_huecos():
+    assert pdf_split.rangos_paginas(5, 2) == [(1, 2), (3, 4), (5, 5)]
+    assert pdf_split.rangos_paginas(4, 2) == [(1, 2), (3, 4)]
+    assert pdf_split.rangos_paginas(1, 3) == [(1, 1)]
+    assert pdf_split.rangos_paginas(0, 2) == []
+    # Un tamaño de fragmento inválido se trata como una página por fragmento
+    assert pdf_split.rangos_paginas(2, 0) == [(1, 1), (2, 2)]
+
+
+def test_dividir_pdf_reparte_las_paginas_en_orden():
+    total, fragmentos = pdf_split.dividir_pdf(_pdf(5), 2)
+
+    assert total == 5
+    assert [rango for rango, _ in fragmentos] == [(1, 2), (3, 4), (5, 5)]
+    assert [_anchos(contenido) for _, contenido in fragmentos] == [[100, 101], [102, 103], [104]]
+
+
+def test_dividir_pdf_que_cabe_en_un_fragmento_no_se_reescribe():
+    data = _pdf(2)
+
+    total, fragmentos = pdf_split.dividir_pdf(data, 4)
+
+    assert total == 2
+    assert fragmentos == [((1, 2), data)]
@@ -0,0 +1,137 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.Funciones import procesar_audio
+from app.commons.services.salida_estructurada import esquema, validar
+from app.commons.services.result_cache import result_cache, MemoriaLRU, llave_resultado, identidad_bytes
+
+
+class ModeloFalso:
+    _model_name = "modelo-prueba"
+
+
+LLMS = {"gemini_flash": ModeloFalso(), "config": {"labels": {}, "params_flash": {}}}
+AUDIO = b"ID3 grabacion de prueba"
+
+
+@pytest.fixture(autouse=True)
+def cache_limpio(monkeypatch):
+    monkeypatch.setattr(result_cache, "backend", MemoriaLRU(1024 * 1024, 3600))
+
+
+def _minimo(nodo):
+    """Respuesta mínima que cumple el esquema: solo los campos obligatorios."""
+    if nodo["type"] == "object":
+        return {campo: _minimo(nodo["properties"][campo]) for campo in nodo.get("required", [])}
+    if nodo["type"] == "array":
+        return []
+    if nodo["type"] == "string":
+        return nodo.get("enum", ["dato"])[0]
+    return False if nodo["type"] == "boolean" else 0
+
+
+def _respuesta_minima():
+    respuesta = _minimo(esquema("transcription_audio"))
+    assert validar(respuesta, esquema("transcription_audio")) == []
+    return respuesta
+
+
+def _llave():
+    model, _, generation_config, _ = procesar_audio._config_audio(LLMS)
+    return llave_resultado("audio", [identidad_bytes(AUDIO)], "transcription_audio", model, generation_config)
+
+
+def _responder(texto, monkeypatch):
+    llamadas = []
+
+    def invocar(model, contents, generation_config, labels):
+        llamadas.append(contents[0])
+        return SimpleNamespace(text=texto)
+
+    monkeypatch.setattr(procesar_audio, "invocar_modelo", invocar)
+    return llamadas
+
+
+def test_respuesta_fuera_del_esquema_es_error_y_no_se_cachea(monkeypatch):
+    llamadas = _responder("esto no es JSON", monkeypatch)
+
+    resultado = procesar_audio.transcribir_audio_bytes(AUDIO, "audio/mpeg", LLMS)
+
+    assert resultado.startswith("Error en audio:")
+    assert len(llamadas) > 1
+    assert result_cache.get(_llave()) is None
+    # Al reenviar el caso se vuelve a llamar al modelo en lugar de repetir la respuesta inválida
+    procesar_audio.transcribir_audio_bytes(AUDIO, "audio/mpeg", LLMS)
+    assert len(llamadas) > 2
+
+
+def test_respuesta_valida_se_cachea(monkeypatch):
+    valido = json.dumps(_respuesta_minima())
+    llamadas = _responder(valido, monkeypatch)
+
+    assert procesar_audio.transcribir_audio_bytes(AUDIO, "audio/mpeg", LLMS) == valido
+    assert procesar_audio.transcribir_audio_bytes(AUDIO, "audio/mpeg", LLMS) == valido
+    assert len(llamadas) == 1
+    assert result_cache.get(_llave()) == valido
+
+
+URI = "gs://bucket/llamada.mp3"
+
+
+def _modo_largo(monkeypatch, texto):
+    """AUDIO_LARGO=1 con identidad por URI (sin GCS) y la ruta de archivo completo respondiendo `texto`."""
+    monkeypatch.setattr(procesar_audio.audio_largo, "AUDIO_LARGO", True)
+    monkeypatch.setattr(
+        procesar_audio, "llave_para_uris",
+        lambda modalidad, uris, prompt, model, config, extra=None: llave_resultado(modalidad, uris, prompt, model, config, extra),
+    )
+    monkeypatch.setattr(procesar_audio, "generar_con_medios", lambda *args: SimpleNamespace(text=texto))
+
+    async def generar_async(*args):
+        return SimpleNamespace(text=texto)
+
+    monkeypatch.setattr(procesar_audio, "generar_con_medios_async", generar_async)
+
+
+def _llave_uri(largo):
+    model, _, generation_config, _ = procesar_audio._config_audio(LLMS)
+    return procesar_audio._llave_audio(URI, model, generation_config, largo)
+
+
+def test_ruta_sincronica_no_cachea_con_la_llave_del_modo_largo(monkeypatch):
+    valido = json.dumps(_respuesta_minima())
+    _modo_largo(monkeypatch, valido)
+
+    assert procesar_audio.transcribir_audio_gemini(URI, LLMS) == valido
+    assert result_cache.get(_llave_uri(largo=False)) == valido
+    assert result_cache.get(_llave_uri(largo=True)) is None
+
+
+def test_modo_largo_cachea_con_sus_opciones(monkeypatch):
+    _modo_largo(monkeypatch, "no se usa")
+
+    async def largo(*args):
+        return "transcripcion por fragmentos"
+
+    monkeypatch.setattr(procesar_audio, "_transcribir_largo_async", largo)
+
+    assert asyncio.run(procesar_audio.transcribir_audio_gemini_async(URI, LLMS)) == "transcripcion por fragmentos"
+    assert result_cache.get(_llave_uri(largo=True)) == "transcripcion por fragmentos"
+    assert result_cache.get(_llave_uri(largo=False)) is None
+
+
+def test_respaldo_sin_ffmpeg_cachea_con_la_llave_de_archivo_completo(monkeypatch):
+    valido = json.dumps(_respuesta_minima())
+    _modo_largo(monkeypatch, valido)
+
+    async def sin_ffmpeg(*args):
+        raise FileNotFoundError("ffmpeg")
+
+    monkeypatch.setattr(procesar_audio, "_transcribir_largo_async", sin_ffmpeg)
+
+    assert asyncio.run(procesar_audio.transcribir_audio_gemini_async(URI, LLMS)) == valido
+    assert result_cache.get(_llave_uri(largo=False)) == valido
+    assert result_cache.get(_llave_uri(largo=True)) is None
@@ -0,0 +1,87 @@
+import json
+import asyncio
+
+import pytest
+
+from app.Funciones import procesar_imagen
+
+
+def _fragmentos(*paginas):
+    return [{"uri": "gs://b/informe.pdf", "paginas": p, "total": 4, "identidad": f"md5#p{p}", "bytes": b"%PDF"} for p in paginas]
+
+
+def test_consolidar_sin_pdf_devuelve_la_respuesta_de_las_fotos():
+    assert procesar_imagen._consolidar('{"a": 1}', [], []) == ('{"a": 1}', True)
+
+
+def test_consolidar_anida_cada_fragmento_con_su_procedencia():
+    texto, completo = procesar_imagen._consolidar('{"foto": 1}', _fragmentos("1-2", "3-4"), ['{"p": 1}', '{"p": 3}'])
+
+    assert completo
+    assert json.loads(texto) == {
+        "fotografias": {"foto": 1},
+        "documentos": [
+            {"uri": "gs://b/informe.pdf", "paginas": "1-2", "total_paginas": 4, "extraccion": {"p": 1}},
+            {"uri": "gs://b/informe.pdf", "paginas": "3-4", "total_paginas": 4, "extraccion": {"p": 3}},
+        ],
+    }
+
+
+def test_consolidar_registra_el_fragmento_fallido_y_conserva_el_resto():
+    texto, completo = procesar_imagen._consolidar(None, _fragmentos("1-2", "3-4"), ['{"p": 1}', TimeoutError("plazo agotado")])
+
+    assert not completo
+    consolidado = json.loads(texto)
+    assert consolidado["fotografias"] is None
+    assert consolidado["documentos"][0]["extraccion"] == {"p": 1}
+    assert consolidado["documentos"][1]["error"] == "plazo agotado"
+    assert "extraccion" not in consolidado["documentos"][1]
+
+
+def test_consolidar_sin_ninguna_parte_valida_propaga_el_error():
+    with pytest.raises(ValueError, match="fotos"):
+        procesar_imagen._consolidar(ValueError("fotos"), _fragmentos("1-2"), [RuntimeError("pdf")])
+
+
+def _planificar(monkeypatch):
+    monkeypatch.setattr(procesar_imagen, "_planificar_fragmentos", lambda urls, datos: ([], _fragmentos("1-2", "3-4")))
+
+
+def test_fragmento_fallido_no_descarta_los_demas(monkeypatch):
+    _planificar(monkeypatch)
+
+    def extraer(fragmento, *args):
+        if fragmento["paginas"] == "3-4":
+            raise RuntimeError("respuesta fuera del esquema")
+        return '{"p": 1}'
+
+    monkeypatch.setattr(procesar_imagen, "_extraer_fragmento", extraer)
+    texto, completo = procesar_imagen._procesar_por_fragmentos(["gs://b/informe.pdf"], [b"%PDF"], None, "", {}, {})
+
+    assert not completo
+    documentos = json.loads(texto)["documentos"]
+    assert documentos[0]["extraccion"] == {"p": 1}
+    assert documentos[1]["error"] == "respuesta fuera del esquema"
+
+
+def test_fragmento_fallido_no_cancela_los_demas_async(monkeypatch):
+    _planificar(monkeypatch)
+    terminados = []
+
+    async def extraer(fragmento, *args):
+        if fragmento["paginas"] == "1-2":
+            raise RuntimeError("respuesta fuera del esquema")
+        await asyncio.sleep(0.01)
+        terminados.append(fragmento["paginas"])
+        return '{"p": 3}'
+
+    monkeypatch.setattr(procesar_imagen, "_extraer_fragmento_async", extraer)
+    texto, completo = asyncio.run(
+        procesar_imagen._procesar_por_fragmentos_async(["gs://b/informe.pdf"], [b"%PDF"], None, "", {}, {})
+    )
+
+    assert not completo
+    assert terminados == ["3-4"]
+    documentos = json.loads(texto)["documentos"]
+    assert documentos[0]["error"] == "respuesta fuera del esquema"
+    assert documentos[1]["extraccion"] == {"p": 3}
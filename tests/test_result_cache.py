@@ -0,0 +1,168 @@
+import os
+
+import pytest
+
+import app.commons.services.result_cache as modulo
+from app.commons.services.result_cache import MemoriaLRU, DiscoStore, llave_resultado, result_cache
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(modulo.time, "time", reloj)
+    return reloj
+
+
+# --- MemoriaLRU ---
+
+def test_memoria_desaloja_la_menos_usada(reloj):
+    memoria = MemoriaLRU(max_bytes=10, ttl_s=60)
+    memoria.set("a", "aaaa")
+    memoria.set("b", "bbbb")
+    assert memoria.get("a") == "aaaa"  # "b" pasa a ser la menos usada
+
+    memoria.set("c", "cccc")
+
+    assert memoria.get("b") is None
+    assert memoria.get("a") == "aaaa"
+    assert memoria.get("c") == "cccc"
+    assert memoria.desalojos == 1
+    assert memoria.tamano_bytes() == 8
+
+
+def test_memoria_expira_por_ttl(reloj):
+    memoria = MemoriaLRU(max_bytes=100, ttl_s=60)
+    memoria.set("a", "valor")
+
+    reloj.ahora += 59
+    assert memoria.get("a") == "valor"
+    reloj.ahora += 2
+    assert memoria.get("a") is None
+    assert memoria.tamano_bytes() == 0
+
+
+def test_memoria_sobrescribir_no_duplica_el_tamano(reloj):
+    memoria = MemoriaLRU(max_bytes=100, ttl_s=60)
+    memoria.set("a", "x" * 30)
+    memoria.set("a", "x" * 10)
+
+    assert memoria.tamano_bytes() == 10
+    assert memoria.desalojos == 0
+
+
+def test_memoria_ignora_valores_mayores_que_el_tope(reloj):
+    memoria = MemoriaLRU(max_bytes=4, ttl_s=60)
+    memoria.set("a", "abc")
+    memoria.set("b", "demasiado largo")
+
+    assert memoria.get("a") == "abc"
+    assert memoria.get("b") is None
+
+
+# --- DiscoStore ---
+
+def _tamano_archivo(disco, llave):
+    return disco._ruta(llave).stat().st_size
+
+
+def test_disco_desaloja_por_bytes_en_orden_de_uso(tmp_path, reloj):
+    disco = DiscoStore(str(tmp_path), max_bytes=10_000, ttl_s=60)
+    disco.set("a", "x" * 100)
+    disco.set("b", "y" * 100)
+    # Uso explícito: "a" se leyó después de escribir "b"
+    os.utime(disco._ruta("a"), (1, 1))
+    os.utime(disco._ruta("b"), (2, 2))
+    assert disco.get("a") == "x" * 100
+    disco.max_bytes = _tamano_archivo(disco, "a") * 2 + 10
+
+    disco.set("c", "z" * 100)
+
+    assert disco.get("b") is None
+    assert disco.get("a") == "x" * 100
+    assert disco.get("c") == "z" * 100
+    assert disco.desalojos == 1
+    assert disco.tamano_bytes() == _tamano_archivo(disco, "a") + _tamano_archivo(disco, "c")
+
+
+def test_disco_expira_por_ttl_y_descuenta_el_archivo(tmp_path, reloj):
+    disco = DiscoStore(str(tmp_path), max_bytes=10_000, ttl_s=60)
+    disco.set("a", "valor")
+
+    reloj.ahora += 61
+
+    assert disco.get("a") is None
+    assert not disco._ruta("a").exists()
+    assert disco.tamano_bytes() == 0
+
+
+def test_disco_sobrescribir_no_duplica_el_tamano(tmp_path, reloj):
+    disco = DiscoStore(str(tmp_path), max_bytes=10_000, ttl_s=60)
+    disco.set("a", "x" * 300)
+    disco.set("a", "x" * 10)
+
+    assert disco.tamano_bytes() == _tamano_archivo(disco, "a")
+
+
+def test_disco_reconstruye_el_tamano_al_reiniciar(tmp_path, reloj):
+    disco = DiscoStore(str(tmp_path), max_bytes=10_000, ttl_s=60)
+    disco.set("a", "x" * 100)
+    disco.set("b", "y" * 50)
+
+    reiniciado = DiscoStore(str(tmp_path), max_bytes=10_000, ttl_s=60)
+
+    assert reiniciado.tamano_bytes() == disco.tamano_bytes()
+    assert reiniciado.get("a") == "x" * 100
+
+
+# --- llave_resultado ---
+
+class ModeloFalso:
+    def __init__(self, nombre):
+        self._model_name = nombre
+
+
+@pytest.fixture
+def cache_activo(monkeypatch):
+    monkeypatch.setattr(result_cache, "backend", MemoriaLRU(1024, 60))
+    versiones = {"extraction_visual": "v1"}
+    monkeypatch.setattr(modulo.registry, "version_prompt", lambda prompt_type: versiones[prompt_type])
+    return versiones
+
+
+def _llave(modelo="gemini-2.5-pro", config=None, extra=None):
+    return llave_resultado("visual", ["md5:abc"], "extraction_visual", ModeloFalso(modelo), config or {"temperature": 0.0}, extra)
+
+
+def test_llave_estable_para_la_misma_solicitud(cache_activo):
+    assert _llave() == _llave()
+    # El recurso completo de un modelo enlazado a caché de contexto cuenta como el mismo modelo
+    assert _llave("projects/p/locations/l/publishers/google/models/gemini-2.5-pro") == _llave()
+
+
+def test_llave_cambia_con_la_version_del_prompt(cache_activo):
+    antes = _llave()
+    cache_activo["extraction_visual"] = "v2"
+
+    assert _llave() != antes
+
+
+def test_llave_cambia_con_el_modelo_la_configuracion_y_el_extra(cache_activo):
+    base = _llave()
+
+    assert _llave(modelo="gemini-2.5-flash") != base
+    assert _llave(config={"temperature": 0.2}) != base
+    assert _llave(extra={"preproceso": {"max_lado": 1024}}) != base
+
+
+def test_sin_cache_o_sin_identidad_no_hay_llave(cache_activo, monkeypatch):
+    assert llave_resultado("visual", None, "extraction_visual", ModeloFalso("m"), {}) is None
+    monkeypatch.setattr(result_cache, "backend", None)
+    assert _llave() is None
@@ -0,0 +1,154 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.commons.services import salida_estructurada
+from app.commons.services.salida_estructurada import (
+    esquema, esquema_vertex, parsear_json, validar, generar_validado, generar_validado_async, datos_modalidad,
+    RespuestaFueraDeEsquema,
+)
+
+
+ESQUEMA = {
+    "type": "object",
+    "required": ["semaforo", "vehiculos"],
+    "properties": {
+        "semaforo": {"type": "string", "enum": ["verde", "amarillo", "rojo"]},
+        "velocidad_kmh": {"type": "number"},
+        "placa": {"type": "string", "nullable": False},
+        "vehiculos": {"type": "array", "items": {"type": "object", "properties": {"letra": {"type": "string"}}}},
+    },
+}
+VALIDO = {"semaforo": "rojo", "velocidad_kmh": 40, "placa": "ABC123", "vehiculos": [{"letra": "A"}]}
+
+
+@pytest.mark.parametrize("texto", [
+    json.dumps(VALIDO),
+    "```json\n" + json.dumps(VALIDO) + "\n```",
+    "  ```\n" + json.dumps(VALIDO) + "```  ",
+])
+def test_parsear_json_quita_el_fence(texto):
+    assert parsear_json(texto) == (VALIDO, None)
+
+
+@pytest.mark.parametrize("texto", [None, "", "```json", "{\"a\": ", "Aquí está el JSON: {}"])
+def test_parsear_json_devuelve_el_error(texto):
+    datos, error = parsear_json(texto)
+    assert datos is None and isinstance(error, ValueError)
+
+
+def test_respuesta_valida():
+    assert validar(VALIDO, ESQUEMA) == []
+
+
+def test_hojas_admiten_null_salvo_indicacion_contraria():
+    assert validar({**VALIDO, "velocidad_kmh": None, "semaforo": None}, ESQUEMA) == []
+    assert validar({**VALIDO, "placa": None}, ESQUEMA) == ["$.placa: null no permitido"]
+    assert validar({**VALIDO, "vehiculos": None}, ESQUEMA) == ["$.vehiculos: null no permitido"]
+    assert validar(None, ESQUEMA) == ["$: null no permitido"]
+
+
+def test_valor_fuera_del_enum():
+    assert validar({**VALIDO, "semaforo": "Rojo"}, ESQUEMA) == ["$.semaforo: 'Rojo' no es uno de ['verde', 'amarillo', 'rojo']"]
+
+
+def test_tipos_y_campos_obligatorios():
+    violaciones = validar({"semaforo": "rojo", "velocidad_kmh": True, "vehiculos": [{"letra": 1}]}, ESQUEMA)
+    assert violaciones == [
+        "$.velocidad_kmh: se esperaba number, llegó bool",
+        "$.vehiculos[0].letra: se esperaba string, llegó int",
+    ]
+    assert validar({"semaforo": "rojo"}, ESQUEMA) == ["$.vehiculos: campo obligatorio ausente"]
+
+
+def test_esquema_vertex_marca_nullable_y_conserva_el_orden():
+    vertex = esquema_vertex(ESQUEMA)
+    assert vertex["type_"] == "OBJECT" and "nullable" not in vertex
+    assert vertex["property_ordering"] == ["semaforo", "velocidad_kmh", "placa", "vehiculos"]
+    assert vertex["properties"]["semaforo"] == {"type_": "STRING", "nullable": True, "enum": ["verde", "amarillo", "rojo"]}
+    assert "nullable" not in vertex["properties"]["placa"]
+    assert vertex["properties"]["vehiculos"]["items"]["properties"]["letra"]["type_"] == "STRING"
+
+
+@pytest.mark.parametrize("nombre", ["transcription_audio", "transcription_audio_fragmento", "extraction_visual", "evaluar_circunstancias_marcus"])
+def test_esquemas_del_repositorio_se_traducen(nombre):
+    assert esquema_vertex(esquema(nombre))["type_"] in ("OBJECT", "ARRAY")
+
+
+def test_datos_modalidad():
+    assert datos_modalidad('{"a": 1}') == {"a": 1}
+    assert datos_modalidad("Error visual: timeout") == "Error visual: timeout"
+    assert datos_modalidad({"a": 1}) == {"a": 1}
+
+
+class GeneradorFalso:
+    """Devuelve las respuestas en orden y guarda la nota de cada llamada."""
+
+    def __init__(self, *textos):
+        self.textos = list(textos)
+        self.notas = []
+
+    def __call__(self, nota):
+        self.notas.append(nota)
+        return SimpleNamespace(text=self.textos[min(len(self.notas), len(self.textos)) - 1])
+
+
+@pytest.fixture
+def con_esquema_de_prueba(monkeypatch):
+    monkeypatch.setattr(salida_estructurada, "esquema", lambda nombre: ESQUEMA)
+
+
+def test_respuesta_valida_no_se_reintenta(con_esquema_de_prueba):
+    generar = GeneradorFalso(json.dumps(VALIDO))
+    assert generar_validado("prueba", generar).text == json.dumps(VALIDO)
+    assert generar.notas == [""]
+
+
+def test_reintento_dirigido_con_la_nota_de_correccion(con_esquema_de_prueba):
+    generar = GeneradorFalso(json.dumps({**VALIDO, "semaforo": "morado"}), json.dumps(VALIDO))
+    assert generar_validado("prueba", generar).text == json.dumps(VALIDO)
+    assert len(generar.notas) == 2
+    assert "CORRECCIÓN DE FORMATO" in generar.notas[1] and "'morado'" in generar.notas[1]
+
+
+@pytest.mark.parametrize("reintentos", [0, 1, 3])
+def test_reintentos_acotados_por_la_configuracion(con_esquema_de_prueba, monkeypatch, reintentos):
+    monkeypatch.setattr(salida_estructurada, "LLM_SCHEMA_REINTENTOS", reintentos)
+    generar = GeneradorFalso("no es json")
+    with pytest.raises(RespuestaFueraDeEsquema) as error:
+        generar_validado("prueba", generar)
+    assert len(generar.notas) == reintentos + 1
+    assert error.value.respuesta.text == "no es json"
+    assert error.value.violaciones[0].startswith("$: JSON inválido")
+
+
+def test_reintentos_en_la_variante_asincrona(con_esquema_de_prueba, monkeypatch):
+    monkeypatch.setattr(salida_estructurada, "LLM_SCHEMA_REINTENTOS", 2)
+    generar = GeneradorFalso("{}", "{}", json.dumps(VALIDO))
+
+    async def generar_async(nota):
+        return generar(nota)
+
+    assert asyncio.run(generar_validado_async("prueba", generar_async)).text == json.dumps(VALIDO)
+    assert len(generar.notas) == 3
+
+
+def test_prompt_sin_esquema_no_se_valida(monkeypatch):
+    monkeypatch.setattr(salida_estructurada, "esquema", lambda nombre: None)
+    generar = GeneradorFalso("texto libre")
+    assert generar_validado("sin_esquema", generar).text == "texto libre"
+    assert generar.notas == [""]
+
+
+def test_variante_asincrona_lanza_si_sigue_fuera_del_esquema(con_esquema_de_prueba, monkeypatch):
+    monkeypatch.setattr(salida_estructurada, "LLM_SCHEMA_REINTENTOS", 1)
+    generar = GeneradorFalso(json.dumps({**VALIDO, "semaforo": "morado"}))
+
+    async def generar_async(nota):
+        return generar(nota)
+
+    with pytest.raises(RespuestaFueraDeEsquema, match="morado"):
+        asyncio.run(generar_validado_async("prueba", generar_async))
+    assert len(generar.notas) == 2